@@ -26,7 +26,7 @@ from api.db.db_models import APIToken, Task, File
 from api.db.services import duplicate_name
 from api.db.services.api_service import APITokenService, API4ConversationService
 from api.db.services.dialog_service import DialogService, chat, keyword_extraction, label_question
-from api.db.services.document_service import DocumentService, doc_upload_and_parse
+from api.db.services.document_service import DocumentService, doc_upload_and_parse, get_chunk_image
 from api.db.services.file2document_service import File2DocumentService
 from api.db.services.file_service import FileService
 from api.db.services.knowledgebase_service import KnowledgebaseService
@@ -742,8 +742,7 @@ def completion_faq():
             for chunk_idx in chunk_idxs[:1]:
                 if ans["reference"]["chunks"][chunk_idx]["img_id"]:
                     try:
-                        bkt, nm = ans["reference"]["chunks"][chunk_idx]["img_id"].split("-")
-                        response = STORAGE_IMPL.get(bkt, nm)
+                        response = get_chunk_image(ans["reference"]["chunks"][chunk_idx]["img_id"])
                         data_type_picture["url"] = base64.b64encode(response).decode('utf-8')
                         data.append(data_type_picture)
                         break
@@ -787,8 +786,7 @@ def completion_faq():
         for chunk_idx in chunk_idxs[:1]:
             if ans["reference"]["chunks"][chunk_idx]["img_id"]:
                 try:
-                    bkt, nm = ans["reference"]["chunks"][chunk_idx]["img_id"].split("-")
-                    response = STORAGE_IMPL.get(bkt, nm)
+                    response = get_chunk_image(ans["reference"]["chunks"][chunk_idx]["img_id"])
                     data_type_picture["url"] = base64.b64encode(response).decode('utf-8')
                     data.append(data_type_picture)
                     break
@@ -34,7 +34,7 @@ from api.db.services.user_service import UserTenantService
 from api.db.services import duplicate_name
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.task_service import TaskService
-from api.db.services.document_service import DocumentService, doc_upload_and_parse
+from api.db.services.document_service import DocumentService, doc_upload_and_parse, get_chunk_image
 from api.utils.api_utils import (
     server_error_response,
     get_data_error_result,
@@ -506,11 +506,10 @@ def change_parser():
 # @login_required
 def get_image(image_id):
     try:
-        arr = image_id.split("-")
-        if len(arr) != 2:
+        image = get_chunk_image(image_id)
+        if not image:
             return get_data_error_result(message="Image not found.")
-        bkt, nm = image_id.split("-")
-        response = flask.make_response(STORAGE_IMPL.get(bkt, nm))
+        response = flask.make_response(image)
         response.headers.set('Content-Type', 'image/JPEG')
         return response
     except Exception as e:
@@ -489,6 +489,42 @@ def queue_raptor_o_graphrag_tasks(doc, ty, msg):
     assert REDIS_CONN.queue_product(SVR_QUEUE_NAME, message=task), "Can't access Redis. Please check the Redis' status."
 
 
+def get_chunk_image(img_id):
+    """
+    The JPEG image of a chunk. The image of a pdf chunk indexed without one (CHUNK_IMAGE_LAZY) is
+    rendered from the pdf and its positions on first request, and stored for the next ones. Other
+    chunks are served from the storage only, like before.
+    """
+    from api.db.services.file2document_service import File2DocumentService
+    from deepdoc.parser.pdf_parser import RAGFlowPdfParser
+
+    arr = img_id.split("-")
+    if len(arr) != 2:
+        return
+    kb_id, chunk_id = arr
+    # the storage connectors log, reconnect and wait a second on getting a missing object
+    if STORAGE_IMPL.obj_exist(kb_id, chunk_id):
+        return STORAGE_IMPL.get(kb_id, chunk_id)
+
+    e, kb = KnowledgebaseService.get_by_id(kb_id)
+    if not e:
+        return
+    chunk = settings.docStoreConn.get(chunk_id, search.index_name(kb.tenant_id), [kb_id])
+    if not chunk or not chunk.get("img_lazy_int") or not chunk.get("position_int") or not re.search(r"\.pdf$", chunk.get("docnm_kwd", ""), re.IGNORECASE):
+        return
+    bucket, name = File2DocumentService.get_storage_address(doc_id=chunk["doc_id"])
+    binary = STORAGE_IMPL.get(bucket, name)
+    if not binary:
+        return
+    image = RAGFlowPdfParser.crop_positions(binary, chunk["position_int"])
+    if not image:
+        return
+    output_buffer = BytesIO()
+    image.save(output_buffer, format='JPEG')
+    STORAGE_IMPL.put(kb_id, chunk_id, output_buffer.getvalue())
+    return output_buffer.getvalue()
+
+
 def doc_upload_and_parse(conversation_id, file_objs, user_id):
     from rag.app import presentation, picture, naive, audio, email
     from api.db.services.dialog_service import DialogService
@@ -552,6 +588,12 @@ def doc_upload_and_parse(conversation_id, file_objs, user_id):
             d["id"] = xxhash.xxh64((ck["content_with_weight"] + str(d["doc_id"])).encode("utf-8")).hexdigest()
             d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
             d["create_timestamp_flt"] = datetime.now().timestamp()
+            if d.pop("lazy_image", False):
+                d.pop("image", None)
+                d["img_id"] = "{}-{}".format(kb.id, d["id"])
+                d["img_lazy_int"] = 1
+                docs.append(d)
+                continue
             if not d.get("image"):
                 docs.append(d)
                 continue
@@ -17,9 +17,13 @@ import json
 import logging
 import os
 
+import numpy as np
+import xxhash
+
 from api.db.services.user_service import TenantService
 from api.utils.file_utils import get_project_base_directory
 from rag.llm import EmbeddingModel, CvModel, ChatModel, RerankModel, Seq2txtModel, TTSModel
+from rag.utils.embed_cache import EMBED_CACHE
 from api.db import LLMType
 from api.db.db_models import DB
 from api.db.db_models import LLMFactories, LLM, TenantLLM
@@ -235,21 +239,45 @@ class LLMBundle(object):
             tenant_id, llm_type, llm_name)
         model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
         self.max_length = model_config.get("max_tokens", 8192)
+        self.cache_namespace = "{}/{}".format(model_config.get("llm_factory", ""), model_config.get("llm_name", llm_name))
+        # models of the same name behind different endpoints, e.g. local deployments, do not share vectors
+        if model_config.get("api_base"):
+            self.cache_namespace += "@" + xxhash.xxh64(model_config["api_base"].encode("utf-8")).hexdigest()
 
     def encode(self, texts: list):
-        embeddings, used_tokens = self.mdl.encode(texts)
-        if not TenantLLMService.increase_usage(
-                self.tenant_id, self.llm_type, used_tokens):
-            logging.error(
-                "LLMBundle.encode can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
-        return embeddings, used_tokens
+        if not texts:
+            return np.array([]), 0
+        vects = EMBED_CACHE.get_many(self.cache_namespace, texts)
+        missing = [i for i, v in enumerate(vects) if v is None]
+        used_tokens = 0
+        if missing:
+            embeddings, used_tokens = self.mdl.encode([texts[i] for i in missing])
+            if not TenantLLMService.increase_usage(
+                    self.tenant_id, self.llm_type, used_tokens):
+                logging.error(
+                    "LLMBundle.encode can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
+            if len(embeddings) != len(missing):
+                raise Exception(f"LLMBundle.encode got {len(embeddings)} embeddings for {len(missing)} texts from {self.cache_namespace}")
+            if len(missing) == len(texts):
+                EMBED_CACHE.set_many(self.cache_namespace, {texts[i]: v for i, v in zip(missing, embeddings)})
+                return embeddings, used_tokens
+            for i, v in zip(missing, embeddings):
+                vects[i] = v
+            EMBED_CACHE.set_many(self.cache_namespace, {texts[i]: vects[i] for i in missing})
+        return np.vstack(vects), used_tokens
 
     def encode_queries(self, query: str):
+        namespace = self.cache_namespace + "/query"
+        emd = EMBED_CACHE.get_many(namespace, [query])[0]
+        if emd is not None:
+            return emd.copy(), 0
         emd, used_tokens = self.mdl.encode_queries(query)
         if not TenantLLMService.increase_usage(
                 self.tenant_id, self.llm_type, used_tokens):
             logging.error(
                 "LLMBundle.encode_queries can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
+        if len(emd):
+            EMBED_CACHE.set_many(namespace, {query: emd})
         return emd, used_tokens
 
     def similarity(self, query: str, texts: list):
@@ -20,7 +20,7 @@ from datetime import datetime
 
 from api.db.db_utils import bulk_insert_into_db
 from deepdoc.parser import PdfParser
-from peewee import JOIN
+from peewee import JOIN, fn
 from api.db.db_models import DB, File2Document, File
 from api.db import StatusEnum, FileType, TaskStatus
 from api.db.db_models import Task, Document, Knowledgebase, Tenant
@@ -126,6 +126,14 @@ class TaskService(CommonService):
     def update_chunk_ids(cls, id: str, chunk_ids: str):
         cls.model.update(chunk_ids=chunk_ids).where(cls.model.id == id).execute()
 
+    @classmethod
+    @DB.connection_context()
+    def append_chunk_ids(cls, id: str, chunk_ids: str):
+        """Append space separated chunk ids to the task, returns the number of updated rows."""
+        return cls.model.update(
+            chunk_ids=fn.CONCAT(fn.COALESCE(cls.model.chunk_ids, ""), " ", chunk_ids)
+        ).where(cls.model.id == id).execute()
+
     @classmethod
     @DB.connection_context()
     def get_ongoing_doc_name(cls):
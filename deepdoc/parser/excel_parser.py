@@ -11,157 +11,164 @@
 #  limitations under the License.
 #
 
-from openpyxl import load_workbook, Workbook
+import csv
+import logging
+import math
+import re
 import sys
 from io import BytesIO
 
-from rag.nlp import find_codec
-
 import pandas as pd
+from openpyxl import load_workbook
 
+from rag.nlp import find_codec
 
-class RAGFlowExcelParser:
-    def html(self, fnm, chunk_rows=256):
+# Rows of a csv read at a time.
+CSV_CHUNK_ROWS = 10000
 
-        # if isinstance(fnm, str):
-        #     wb = load_workbook(fnm)
-        # else:
-        #     wb = load_workbook(BytesIO(fnm))++
 
+class RAGFlowExcelParser:
+    @staticmethod
+    def _iter_sheets(fnm):
+        """
+        Yield (sheetname, rows) for every sheet, rows being a lazy iterator of the tuples of cell values.
+        Workbooks are read in read-only mode and csv files a chunk of rows at a time, nothing is loaded whole.
+        """
         s_fnm = fnm
         if not isinstance(fnm, str):
             s_fnm = BytesIO(fnm)
-        else:
-            pass
+
+        # Neither a zip (xlsx, ods...) nor an OLE2 (xls) file.
+        if isinstance(fnm, str) and re.search(r"\.csv$", fnm, re.IGNORECASE) or \
+                not isinstance(fnm, str) and fnm[:2] != b"PK" and fnm[:8] != b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1":
+            yield "Data", RAGFlowExcelParser._iter_csv_rows(fnm)
+            return
 
         try:
-            wb = load_workbook(s_fnm)
+            wb = load_workbook(s_fnm, read_only=True)
         except Exception as e:
-            print(f'****wxy: file parser error: {e}, s_fnm={s_fnm}, trying convert files')
+            logging.warning(f"Failed to load workbook: {e}, trying pandas.")
+            if not isinstance(s_fnm, str):
+                s_fnm.seek(0)
             df = pd.read_excel(s_fnm)
-            wb = Workbook()
-            # if len(wb.worksheets) > 0:
-            #   del wb.worksheets[0]
-            # else: pass
-            ws = wb.active
-            ws.title = "Data"
-            for col_num, column_name in enumerate(df.columns, 1):
-                ws.cell(row=1, column=col_num, value=column_name)
-            else:
-                pass
-            for row_num, row in enumerate(df.values, 2):
-                for col_num, value in enumerate(row, 1):
-                    ws.cell(row=row_num, column=col_num, value=value)
-                else:
-                    pass
-            else:
-                pass
-
-        tb_chunks = []
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
-                continue
+            yield "Data", RAGFlowExcelParser._iter_df_rows(df)
+            return
 
-            tb_rows_0 = "<tr>"
-            for t in list(rows[0]):
-                tb_rows_0 += f"<th>{t.value}</th>"
-            tb_rows_0 += "</tr>"
-
-            for chunk_i in range((len(rows) - 1) // chunk_rows + 1):
-                tb = ""
-                tb += f"<table><caption>{sheetname}</caption>"
-                tb += tb_rows_0
-                for r in list(
-                  rows[1 + chunk_i * chunk_rows: 1 + (chunk_i + 1) * chunk_rows]
-                ):
-                    tb += "<tr>"
-                    for i, c in enumerate(r):
-                        if c.value is None:
-                            tb += "<td></td>"
-                        else:
-                            tb += f"<td>{c.value}</td>"
-                    tb += "</tr>"
-                tb += "</table>\n"
-                tb_chunks.append(tb)
-
-        return tb_chunks
+        try:
+            for ws in wb.worksheets:
+                RAGFlowExcelParser._check_dimensions(ws)
+                yield ws.title, (tuple([c.value for c in r]) for r in ws.rows)
+        finally:
+            wb.close()
 
-    def __call__(self, fnm):
-        # if isinstance(fnm, str):
-        #   wb = load_workbook(fnm)
-        # else:
-        #   wb = load_workbook(BytesIO(fnm))
+    @staticmethod
+    def _check_dimensions(ws):
+        """Whether the dimensions of a read-only sheet can be trusted, they are dropped otherwise."""
+        # Some writers leave an "A1" dimension whatever the content, which read-only mode would stop at.
+        if (ws.max_row or 0) <= 1 and (ws.max_column or 0) <= 1:
+            ws.reset_dimensions()
+            return False
+        return True
 
-        s_fnm = fnm
-        if not isinstance(fnm, str):
-            s_fnm = BytesIO(fnm)
-        else:
-            pass
+    @staticmethod
+    def _iter_df_rows(df):
+        def value(v):
+            return None if isinstance(v, float) and math.isnan(v) else v
+
+        yield tuple(df.columns)
+        for r in df.itertuples(index=False, name=None):
+            yield tuple([value(v) for v in r])
 
+    @staticmethod
+    def _iter_csv_rows(fnm):
+        if isinstance(fnm, str):
+            with open(fnm, "rb") as f:
+                fnm = f.read()
+        encoding = find_codec(fnm)
         try:
-            wb = load_workbook(s_fnm)
-        except Exception as e:
-            print(f'****wxy: file parser error: {e}, s_fnm={s_fnm}, trying convert files')
-            df = pd.read_excel(s_fnm)
-            wb = Workbook()
-            if len(wb.worksheets) > 0:
-                del wb.worksheets[0]
-            else:
-                pass
-            ws = wb.active
-            ws.title = "Data"
-            for col_num, column_name in enumerate(df.columns, 1):
-                ws.cell(row=1, column=col_num, value=column_name)
-            else:
-                pass
-            for row_num, row in enumerate(df.values, 2):
-                for col_num, value in enumerate(row, 1):
-                    ws.cell(row=row_num, column=col_num, value=value)
-                else:
-                    pass
-            else:
-                pass
-
-        res = []
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+            sep = csv.Sniffer().sniff(fnm[:65536].decode(encoding, errors="ignore"), delimiters=",\t;|").delimiter
+        except csv.Error:
+            sep = ","
+        header = True
+        for df in pd.read_csv(BytesIO(fnm), encoding=encoding, encoding_errors="ignore", sep=sep, dtype=str,
+                              keep_default_na=False, chunksize=CSV_CHUNK_ROWS):
+            df = df.where(df != "", None)
+            rows = RAGFlowExcelParser._iter_df_rows(df)
+            if not header:
+                next(rows)
+            header = False
+            yield from rows
+
+    @staticmethod
+    def _pad(row, width):
+        return row + (None,) * (width - len(row)) if len(row) < width else row
+
+    def iter_html(self, fnm, chunk_rows=256):
+        """Yield the rows of every sheet as html tables of `chunk_rows` rows, each with the sheet header."""
+        for sheetname, rows in self._iter_sheets(fnm):
+            header = next(rows, None)
+            if header is None:
                 continue
-            ti = list(rows[0])
-            for r in list(rows[1:]):
+            head = "".join(["<tr>"] + [f"<th>{v}</th>" for v in header] + ["</tr>"])
+            tb, n = [], 0
+            for r in rows:
+                r = self._pad(r, len(header))
+                tb.append("".join(["<tr>"] + ["<td></td>" if v is None else f"<td>{v}</td>" for v in r] + ["</tr>"]))
+                n += 1
+                if len(tb) == chunk_rows:
+                    yield "".join([f"<table><caption>{sheetname}</caption>", head] + tb + ["</table>\n"])
+                    tb = []
+            # a sheet with a header only is still a table
+            if tb or not n:
+                yield "".join([f"<table><caption>{sheetname}</caption>", head] + tb + ["</table>\n"])
+
+    def html(self, fnm, chunk_rows=256):
+        return list(self.iter_html(fnm, chunk_rows))
+
+    def iter_lines(self, fnm):
+        """Yield every row as a `header：value; ...` line."""
+        for sheetname, rows in self._iter_sheets(fnm):
+            ti = next(rows, None)
+            if ti is None:
+                continue
+            for r in rows:
                 fields = []
-                for i, c in enumerate(r):
-                    if not c.value:
+                for i, v in enumerate(r):
+                    if not v:
                         continue
-                    t = str(ti[i].value) if i < len(ti) else ""
-                    t += ("：" if t else "") + str(c.value)
+                    t = str(ti[i]) if i < len(ti) else ""
+                    t += ("：" if t else "") + str(v)
                     fields.append(t)
                 line = "; ".join(fields)
                 if sheetname.lower().find("sheet") < 0:
                     line += " ——" + sheetname
-                res.append(line)
-        return res
+                yield line
+
+    def __call__(self, fnm):
+        return list(self.iter_lines(fnm))
 
     @staticmethod
     def row_number(fnm, binary):
         if fnm.split(".")[-1].lower().find("xls") >= 0:
-            wb = load_workbook(BytesIO(binary))
+            try:
+                wb = load_workbook(BytesIO(binary) if binary else fnm, read_only=True)
+            except Exception:
+                return len(pd.read_excel(BytesIO(binary) if binary else fnm)) + 1
             total = 0
-            for sheetname in wb.sheetnames:
-                ws = wb[sheetname]
-                total += len(list(ws.rows))
+            try:
+                for ws in wb.worksheets:
+                    # the dimension recorded in the sheet, rows are only counted when it is missing
+                    total += ws.max_row if RAGFlowExcelParser._check_dimensions(ws) else sum(1 for _ in ws.rows)
+            finally:
+                wb.close()
             return total
 
         if fnm.split(".")[-1].lower() in ["csv", "txt"]:
             encoding = find_codec(binary)
             txt = binary.decode(encoding, errors="ignore")
-            return len(txt.split("\n"))
+            return txt.count("\n") + 1
 
 
 if __name__ == "__main__":
     psr = RAGFlowExcelParser()
     psr(sys.argv[1])
-
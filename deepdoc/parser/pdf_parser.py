@@ -14,9 +14,16 @@
 #  limitations under the License.
 #
 
+import functools
+import inspect
 import logging
 import os
 import random
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import xgboost as xgb
 from io import BytesIO
@@ -25,14 +32,164 @@ import pdfplumber
 from PIL import Image
 import numpy as np
 from pypdf import PdfReader as pdf2_read
+from pdfplumber.utils.text import WordExtractor
 
 from api import settings
 from api.utils.file_utils import get_project_base_directory
 from deepdoc.vision import OCR, Recognizer, LayoutRecognizer, TableStructureRecognizer
+from deepdoc.vision.recognizer import BoxIndex
 from rag.nlp import rag_tokenizer
+from rag.nlp.rag_tokenizer import is_chinese
+from rag.utils.parse_cache import PARSE_CACHE
 from copy import deepcopy
 from huggingface_hub import snapshot_download
 
+# The number of rendered pages kept in memory per parser.
+PDF_PAGE_CACHE_SIZE = int(os.environ.get("PDF_PAGE_CACHE_SIZE", "8"))
+# Spill the rendered pages evicted from memory to disk instead of rendering them again. Off by default, the raw
+# pages of concurrent parsers fill up the temporary directory of containers without a disk quota.
+PDF_PAGE_SPILL = int(os.environ.get("PDF_PAGE_SPILL", "0"))
+# The directory pages are spilled to, the temporary directory of the system if empty.
+PDF_PAGE_SPILL_DIR = os.environ.get("PDF_PAGE_SPILL_DIR", "")
+# The number of pages OCRed, and of layout batches recognized, at the same time by each parser.
+# The models are shared by all of them.
+PDF_PARSER_WORKERS = int(os.environ.get("PDF_PARSER_WORKERS", "1"))
+# Build the text boxes of the pages having a clean text layer from their chars, instead of detecting
+# and recognizing them. Only the images of those pages are OCRed. Off by default, as it changes the
+# parsed text, of english documents too, whose text layer is otherwise ignored.
+PDF_TEXT_LAYER = int(os.environ.get("PDF_TEXT_LAYER", "0"))
+# The least chars a page needs for its text layer to be used.
+PDF_TEXT_LAYER_MIN_CHARS = int(os.environ.get("PDF_TEXT_LAYER_MIN_CHARS", "32"))
+# The largest share of garbled, unmapped or rotated chars a page can have for its text layer to be used.
+PDF_TEXT_LAYER_MAX_GARBLED = float(os.environ.get("PDF_TEXT_LAYER_MAX_GARBLED", "0.02"))
+# Pages mostly covered by images are scans, whatever their text layer, and OCRed as a whole.
+PDF_TEXT_LAYER_MAX_IMAGE_RATIO = 0.5
+
+
+class PdfPageImages:
+    """
+    The pages of a pdf rendered on demand at 72 * `zoomin` dpi, usable like the list of page images.
+    Only the most recently used pages are kept in memory. The evicted ones are rendered again, or, if `spill`,
+    spilled to memory-mapped files, so that every page is rendered at most once.
+    """
+
+    def __init__(self, pages, zoomin, cache_size=PDF_PAGE_CACHE_SIZE, spill=PDF_PAGE_SPILL):
+        self.pages = pages
+        self.resolution = 72 * zoomin
+        self.cache_size = max(cache_size, 1)
+        self.spill = spill
+        self.lru = OrderedDict()
+        self.sizes = [None] * len(pages)
+        self.spilled = {}
+        self.spill_dir = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("page index out of range")
+        with self.lock:
+            img = self.lru.get(i)
+            if img is not None:
+                self.lru.move_to_end(i)
+                return img
+            if i in self.spilled:
+                img = Image.fromarray(np.load(self.spilled[i], mmap_mode="r"))
+            else:
+                img = self.pages[i].to_image(resolution=self.resolution).annotated
+                self.sizes[i] = img.size
+            self.lru[i] = img
+            while len(self.lru) > self.cache_size:
+                self._evict()
+            return img
+
+    def size(self, i):
+        """The (width, height) of page `i`, without keeping it in memory once known."""
+        if self.sizes[i] is None:
+            self[i]
+        return self.sizes[i]
+
+    def _evict(self):
+        i, img = self.lru.popitem(last=False)
+        if not self.spill or i in self.spilled:
+            return
+        try:
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix="ragflow_pdf_pages_", dir=PDF_PAGE_SPILL_DIR or None)
+            path = os.path.join(self.spill_dir, f"{i}.npy")
+            np.save(path, np.asarray(img))
+            self.spilled[i] = path
+        except Exception:
+            logging.exception("PdfPageImages fail to spill page {} to disk".format(i))
+
+    def close(self):
+        with self.lock:
+            self.lru.clear()
+            self.spilled = {}
+            if self.spill_dir:
+                shutil.rmtree(self.spill_dir, ignore_errors=True)
+                self.spill_dir = None
+
+    def __del__(self):
+        self.close()
+
+
+def cached_parse(func):
+    """
+    Cache what the `__call__` of a DeepDOC pdf parser returns in PARSE_CACHE, keyed by the pdf and every
+    argument but the callback. On a hit, the pages are only reopened, for `crop` to render them on demand.
+    """
+    sig = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not PARSE_CACHE.enabled:
+            return func(self, *args, **kwargs)
+        params = sig.bind(self, *args, **kwargs)
+        params.apply_defaults()
+        params = dict(params.arguments)
+        params.pop("self")
+        callback = params.pop("callback", None)
+        fnm, binary = params.pop("filename"), params.pop("binary", None)
+        if not binary:
+            binary = fnm
+        if isinstance(binary, str):
+            with open(binary, "rb") as f:
+                binary = f.read()
+        params["text_layer"] = [PDF_TEXT_LAYER, PDF_TEXT_LAYER_MIN_CHARS, PDF_TEXT_LAYER_MAX_GARBLED]
+        key = PARSE_CACHE.key(binary, f"{type(self).__module__}.{type(self).__qualname__}", params)
+
+        cached = PARSE_CACHE.get(key)
+        if cached is not None:
+            self._reopen_pages(binary, **cached["state"])
+            if callback:
+                callback(0.67, "Parse result reused.")
+            return cached["result"]
+
+        res = func(self, *args, **kwargs)
+        PARSE_CACHE.set(key, {"result": res, "state": {
+            "page_from": self.page_from,
+            "page_count": len(self.page_images),
+            "zoomin": self.page_images.resolution // 72,
+            "is_english": bool(self.is_english),
+            "outlines": self.outlines,
+            "total_page": getattr(self, "total_page", 0)
+        }})
+        return res
+
+    return wrapper
+
+
 class RAGFlowPdfParser:
     def __init__(self):
         self.ocr = OCR()
@@ -244,17 +401,18 @@ class RAGFlowPdfParser:
         clmns = sorted([r for r in self.tb_cpns if re.match(
             r"table column$", r["label"])], key=lambda x: (x["pn"], x["layoutno"], x["x0"]))
         clmns = Recognizer.layouts_cleanup(self.boxes, clmns, 5, 0.5)
+        rows_idx, headers_idx, clmns_idx, spans_idx = [BoxIndex(r) for r in (rows, headers, clmns, spans)]
         for b in self.boxes:
             if b.get("layout_type", "") != "table":
                 continue
-            ii = Recognizer.find_overlapped_with_threashold(b, rows, thr=0.3)
+            ii = Recognizer.find_overlapped_with_threashold(b, rows, thr=0.3, index=rows_idx)
             if ii is not None:
                 b["R"] = ii
                 b["R_top"] = rows[ii]["top"]
                 b["R_bott"] = rows[ii]["bottom"]
 
             ii = Recognizer.find_overlapped_with_threashold(
-                b, headers, thr=0.3)
+                b, headers, thr=0.3, index=headers_idx)
             if ii is not None:
                 b["H_top"] = headers[ii]["top"]
                 b["H_bott"] = headers[ii]["bottom"]
@@ -262,13 +420,13 @@ class RAGFlowPdfParser:
                 b["H_right"] = headers[ii]["x1"]
                 b["H"] = ii
 
-            ii = Recognizer.find_horizontally_tightest_fit(b, clmns)
+            ii = Recognizer.find_horizontally_tightest_fit(b, clmns, index=clmns_idx)
             if ii is not None:
                 b["C"] = ii
                 b["C_left"] = clmns[ii]["x0"]
                 b["C_right"] = clmns[ii]["x1"]
 
-            ii = Recognizer.find_overlapped_with_threashold(b, spans, thr=0.3)
+            ii = Recognizer.find_overlapped_with_threashold(b, spans, thr=0.3, index=spans_idx)
             if ii is not None:
                 b["H_top"] = spans[ii]["top"]
                 b["H_bott"] = spans[ii]["bottom"]
@@ -276,31 +434,103 @@ class RAGFlowPdfParser:
                 b["H_right"] = spans[ii]["x1"]
                 b["SP"] = ii
 
+    @staticmethod
+    def _garbled(c):
+        return not c.get("upright", True) or re.search(r"\(cid:[0-9]+\)|[\ufffd\ue000-\uf8ff\x00-\x08\x0b-\x1f]", c["text"])
+
+    def _text_layer_usable(self, pagenum, ZM):
+        """Whether the text layer of a page covers it well enough to build its boxes without detection."""
+        chars = self.page_chars[pagenum - 1]
+        regions = self.page_image_regions[pagenum - 1]
+        if not PDF_TEXT_LAYER or regions is None or len(chars) < PDF_TEXT_LAYER_MIN_CHARS:
+            return False
+        if len([1 for c in chars if self._garbled(c)]) > len(chars) * PDF_TEXT_LAYER_MAX_GARBLED:
+            return False
+        w, h = self.page_images.size(pagenum - 1)
+        return sum([(x1 - x0) * (btm - tp) for x0, tp, x1, btm in regions]) <= w * h / ZM / ZM * PDF_TEXT_LAYER_MAX_IMAGE_RATIO
+
+    def _text_layer_boxes(self, pagenum, chars):
+        """Text boxes, as the detector would return them, built from the words of the text layer."""
+        words = [ws for _, ws in WordExtractor(keep_blank_chars=False).iter_extract_tuples(chars)]
+        bxs = []
+        for ws in words:
+            txt = "".join([c["text"] for c in ws])
+            wd = {"x0": min([c["x0"] for c in ws]), "x1": max([c["x1"] for c in ws]),
+                  "top": min([c["top"] for c in ws]), "bottom": max([c["bottom"] for c in ws])}
+            if bxs:
+                b = bxs[-1]
+                ht = min(b["bottom"] - b["top"], wd["bottom"] - wd["top"])
+                # Words of a line are kept together unless they are farther than a char height apart, like columns.
+                if min(b["bottom"], wd["bottom"]) - max(b["top"], wd["top"]) > ht / 2 \
+                        and 0 <= wd["x0"] - b["x1"] < max(ht, 1):
+                    if b["text"] and txt and not b["text"].endswith(" ") \
+                            and not (is_chinese(b["text"][-1]) and is_chinese(txt[0])):
+                        b["text"] += " "
+                    b["text"] += txt
+                    b["x1"] = max(b["x1"], wd["x1"])
+                    b["top"] = min(b["top"], wd["top"])
+                    b["bottom"] = max(b["bottom"], wd["bottom"])
+                    continue
+            bxs.append({**wd, "text": txt, "page_number": pagenum})
+        for b in bxs:
+            b["text"] = re.sub(r" +", " ", b["text"]).strip()
+        return [b for b in bxs if b["text"]]
+
+    def __text_layer_ocr(self, pagenum, img, ZM=3):
+        """The text boxes of a page built from its text layer, with the ones detected in its images."""
+        bxs = self._text_layer_boxes(pagenum, self.page_chars[pagenum - 1])
+        bxs_idx = BoxIndex(bxs)
+        for x0, tp, x1, btm in self.page_image_regions[pagenum - 1]:
+            if (x1 - x0) * ZM < 16 or (btm - tp) * ZM < 16:
+                continue
+            region_np = np.array(img.crop((x0 * ZM, tp * ZM, x1 * ZM, btm * ZM)))
+            dets = self.ocr.detect(region_np)
+            if not isinstance(dets, zip):
+                continue
+            dets = [b for b, _ in dets if b[0][0] <= b[1][0] and b[0][1] <= b[-1][1]]
+            for b, txt in zip(dets, self.ocr.recognize_batch(region_np, dets)):
+                bx = {"x0": x0 + b[0][0] / ZM, "x1": x0 + b[1][0] / ZM,
+                      "top": tp + b[0][1] / ZM, "bottom": tp + b[-1][1] / ZM,
+                      "text": txt, "page_number": pagenum}
+                # Text laid over an image is already in the text layer.
+                if txt and Recognizer.find_overlapped_with_threashold(bx, bxs_idx.boxes, thr=0.3, index=bxs_idx) is None:
+                    bxs.append(bx)
+        if not bxs:
+            return bxs
+        if self.mean_height[pagenum - 1] == 0:
+            self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
+        return Recognizer.sort_Y_firstly(bxs, self.mean_height[pagenum - 1] / 3)
+
     def __ocr(self, pagenum, img, chars, ZM=3):
-        bxs = self.ocr.detect(np.array(img))
+        """Detect and recognize the text boxes of a page, returns them with the chars left out of any box."""
+        if self._text_layer_usable(pagenum, ZM):
+            return self.__text_layer_ocr(pagenum, img, ZM), []
+        lefted_chars = []
+        img_np = np.array(img)
+        bxs = self.ocr.detect(img_np)
         if not bxs:
-            self.boxes.append([])
-            return
+            return [], lefted_chars
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
             [{"x0": b[0][0] / ZM, "x1": b[1][0] / ZM,
               "top": b[0][1] / ZM, "text": "", "txt": t,
               "bottom": b[-1][1] / ZM,
               "page_number": pagenum} for b, t in bxs if b[0][0] <= b[1][0] and b[0][1] <= b[-1][1]],
-            self.mean_height[-1] / 3
+            self.mean_height[pagenum - 1] / 3
         )
-        
+
         # merge chars in the same rect
+        bxs_idx = BoxIndex(bxs)
         for c in Recognizer.sort_Y_firstly(
                 chars, self.mean_height[pagenum - 1] // 4):
-            ii = Recognizer.find_overlapped(c, bxs)
+            ii = Recognizer.find_overlapped(c, bxs, index=bxs_idx)
             if ii is None:
-                self.lefted_chars.append(c)
+                lefted_chars.append(c)
                 continue
             ch = c["bottom"] - c["top"]
             bh = bxs[ii]["bottom"] - bxs[ii]["top"]
             if abs(ch - bh) / max(ch, bh) >= 0.7 and c["text"] != ' ':
-                self.lefted_chars.append(c)
+                lefted_chars.append(c)
                 continue
             if c["text"] == " " and bxs[ii]["text"]:
                 if re.match(r"[0-9a-zA-Zа-яА-Я,.?;:!%%]", bxs[ii]["text"][-1]):
@@ -308,24 +538,27 @@ class RAGFlowPdfParser:
             else:
                 bxs[ii]["text"] += c["text"]
 
+        boxes_to_reg = []
         for b in bxs:
             if not b["text"]:
                 left, right, top, bott = b["x0"] * ZM, b["x1"] * \
                                          ZM, b["top"] * ZM, b["bottom"] * ZM
-                b["text"] = self.ocr.recognize(np.array(img),
-                                               np.array([[left, top], [right, top], [right, bott], [left, bott]],
-                                                        dtype=np.float32))
+                boxes_to_reg.append((b, np.array([[left, top], [right, top], [right, bott], [left, bott]],
+                                                 dtype=np.float32)))
             del b["txt"]
+        texts = self.ocr.recognize_batch(img_np, [box for _, box in boxes_to_reg])
+        for (b, _), text in zip(boxes_to_reg, texts):
+            b["text"] = text
         bxs = [b for b in bxs if b["text"]]
-        if self.mean_height[-1] == 0:
-            self.mean_height[-1] = np.median([b["bottom"] - b["top"]
-                                              for b in bxs])
-        self.boxes.append(bxs)
+        if self.mean_height[pagenum - 1] == 0:
+            self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"]
+                                                       for b in bxs])
+        return bxs, lefted_chars
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
         self.boxes, self.page_layout = self.layouter(
-            self.page_images, self.boxes, ZM, drop=drop)
+            self.page_images, self.boxes, ZM, drop=drop, max_workers=PDF_PARSER_WORKERS)
         # cumlative Y
         for i in range(len(self.boxes)):
             self.boxes[i]["top"] += \
@@ -459,6 +692,73 @@ class RAGFlowPdfParser:
 
         # concat between rows
         boxes = deepcopy(self.boxes)
+
+        def concat_candidate(up, down):
+            """None if no box from `down` on can be concatenated to `up`, False to skip `down`, True to ask the model."""
+            ydis = self._y_dis(up, down)
+            smpg = up["page_number"] == down["page_number"]
+            mh = self.mean_height[up["page_number"] - 1]
+            mw = self.mean_width[up["page_number"] - 1]
+            if smpg and ydis > mh * 4:
+                return None
+            if not smpg and ydis > mh * 16:
+                return None
+            if not concat_between_pages and down["page_number"] > up["page_number"]:
+                return None
+
+            if up.get("R", "") != down.get(
+                    "R", "") and up["text"][-1:] != "，":
+                return False
+
+            if re.match(r"[0-9]{2,3}/[0-9]{3}$", up["text"]) \
+                    or re.match(r"[0-9]{2,3}/[0-9]{3}$", down["text"]) \
+                    or not down["text"].strip():
+                return False
+
+            if not down["text"].strip() or not up["text"].strip():
+                return False
+
+            if up["x1"] < down["x0"] - 10 * \
+                    mw or up["x0"] > down["x1"] + 10 * mw:
+                return False
+            return True
+
+        # Score the pairs the merge asks the model about, a batch per round: every box is paired with its next
+        # candidate below until one scores above 0.5, or it is concatenated without the model. The pairs it asks
+        # about once earlier boxes are merged away are scored when needed.
+        pending = {}
+        for i, up in enumerate(boxes):
+            js = []
+            for j in range(i + 1, min(i + 13, len(boxes))):
+                cand = concat_candidate(up, boxes[j])
+                if cand is None:
+                    break
+                if not cand:
+                    continue
+                if j - i <= 5 and up.get("layout_type") == "text":
+                    if up.get("layoutno", "1") == boxes[j].get("layoutno", "2"):
+                        break
+                    continue
+                js.append(j)
+            if js:
+                pending[i] = js
+        concat_probs = {}
+        while pending:
+            pairs = [(i, js.pop(0)) for i, js in pending.items()]
+            probs = self.updown_cnt_mdl.predict(
+                xgb.DMatrix([self._updown_concat_features(boxes[i], boxes[j]) for i, j in pairs]))
+            for (i, j), prob in zip(pairs, probs):
+                concat_probs[(id(boxes[i]), id(boxes[j]))] = prob
+                if prob > 0.5 or not pending[i]:
+                    del pending[i]
+
+        def concat_prob(up, down):
+            k = (id(up), id(down))
+            if k not in concat_probs:
+                concat_probs[k] = self.updown_cnt_mdl.predict(
+                    xgb.DMatrix([self._updown_concat_features(up, down)]))[0]
+            return concat_probs[k]
+
         blocks = []
         while boxes:
             chunks = []
@@ -467,35 +767,11 @@ class RAGFlowPdfParser:
                 chunks.append(up)
                 i = dp
                 while i < min(dp + 12, len(boxes)):
-                    ydis = self._y_dis(up, boxes[i])
-                    smpg = up["page_number"] == boxes[i]["page_number"]
-                    mh = self.mean_height[up["page_number"] - 1]
-                    mw = self.mean_width[up["page_number"] - 1]
-                    if smpg and ydis > mh * 4:
-                        break
-                    if not smpg and ydis > mh * 16:
-                        break
                     down = boxes[i]
-                    if not concat_between_pages and down["page_number"] > up["page_number"]:
+                    cand = concat_candidate(up, down)
+                    if cand is None:
                         break
-
-                    if up.get("R", "") != down.get(
-                            "R", "") and up["text"][-1] != "，":
-                        i += 1
-                        continue
-
-                    if re.match(r"[0-9]{2,3}/[0-9]{3}$", up["text"]) \
-                            or re.match(r"[0-9]{2,3}/[0-9]{3}$", down["text"]) \
-                            or not down["text"].strip():
-                        i += 1
-                        continue
-
-                    if not down["text"].strip() or not up["text"].strip():
-                        i += 1
-                        continue
-
-                    if up["x1"] < down["x0"] - 10 * \
-                            mw or up["x0"] > down["x1"] + 10 * mw:
+                    if not cand:
                         i += 1
                         continue
 
@@ -508,9 +784,7 @@ class RAGFlowPdfParser:
                         i += 1
                         continue
 
-                    fea = self._updown_concat_features(up, down)
-                    if self.updown_cnt_mdl.predict(
-                            xgb.DMatrix([fea]))[0] <= 0.5:
+                    if concat_prob(up, down) <= 0.5:
                         i += 1
                         continue
                     dfs(down, i + 1)
@@ -850,8 +1124,8 @@ class RAGFlowPdfParser:
         page_images_cnt = len(self.page_images)
         if pn[-1] - 1 >= page_images_cnt:
             return ""
-        while bott * ZM > self.page_images[pn[-1] - 1].size[1]:
-            bott -= self.page_images[pn[-1] - 1].size[1] / ZM
+        while bott * ZM > self.page_images.size(pn[-1] - 1)[1]:
+            bott -= self.page_images.size(pn[-1] - 1)[1] / ZM
             pn.append(pn[-1] + 1)
             if pn[-1] - 1 >= page_images_cnt:
                 return ""
@@ -872,7 +1146,7 @@ class RAGFlowPdfParser:
             if b.get("layout_type"):
                 return True
             if width(
-                    b) > self.page_images[b["page_number"] - 1].size[0] / ZM / 3:
+                    b) > self.page_images.size(b["page_number"] - 1)[0] / ZM / 3:
                 return True
             if b["bottom"] - b["top"] > self.mean_height[b["page_number"] - 1]:
                 return True
@@ -882,7 +1156,7 @@ class RAGFlowPdfParser:
         while boxes:
             lines = []
             widths = []
-            pw = self.page_images[boxes[0]["page_number"] - 1].size[0] / ZM
+            pw = self.page_images.size(boxes[0]["page_number"] - 1)[0] / ZM
             mh = self.mean_height[boxes[0]["page_number"] - 1]
             mj = self.proj_match(
                 boxes[0]["text"]) or boxes[0].get(
@@ -954,13 +1228,21 @@ class RAGFlowPdfParser:
         try:
             self.pdf = pdfplumber.open(fnm) if isinstance(
                 fnm, str) else pdfplumber.open(BytesIO(fnm))
-            self.page_images = [p.to_image(resolution=72 * zoomin).annotated for i, p in
-                                enumerate(self.pdf.pages[page_from:page_to])]
+            if isinstance(getattr(self, "page_images", None), PdfPageImages):
+                self.page_images.close()
+            self.page_images = PdfPageImages(self.pdf.pages[page_from:page_to], zoomin)
             try:
                 self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
             except Exception as e:
                 logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
                 self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
+            try:
+                self.page_image_regions = [[(max(im["x0"], 0), max(im["top"], 0), min(im["x1"], page.width), min(im["bottom"], page.height))
+                                            for im in page.images if im["x0"] < im["x1"] and im["top"] < im["bottom"]]
+                                           for page in self.pdf.pages[page_from:page_to]]
+            except Exception as e:
+                logging.warning(f"Failed to extract images for pages {page_from}-{page_to}: {str(e)}")
+                self.page_image_regions = [None for _ in range(page_to - page_from)]  # Unknown images, the pages are OCRed.
                 
             self.total_page = len(self.pdf.pages)
         except Exception:
@@ -995,7 +1277,8 @@ class RAGFlowPdfParser:
             self.is_english = False
 
         # st = timer()
-        for i, img in enumerate(self.page_images):
+        pages_chars = []
+        for i in range(len(self.page_images)):
             chars = self.page_chars[i] if not self.is_english else []
             self.mean_height.append(
                 np.median(sorted([c["height"] for c in chars])) if chars else 0
@@ -1003,7 +1286,6 @@ class RAGFlowPdfParser:
             self.mean_width.append(
                 np.median(sorted([c["width"] for c in chars])) if chars else 8
             )
-            self.page_cum_height.append(img.size[1] / zoomin)
             j = 0
             while j + 1 < len(chars):
                 if chars[j]["text"] and chars[j + 1]["text"] \
@@ -1012,10 +1294,19 @@ class RAGFlowPdfParser:
                                                                        chars[j]["width"]) / 2:
                     chars[j]["text"] += " "
                 j += 1
-
-            self.__ocr(i + 1, img, chars, zoomin)
-            if callback and i % 6 == 5:
-                callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
+            pages_chars.append(chars)
+
+        def ocr_page(i):
+            return self.__ocr(i + 1, self.page_images[i], pages_chars[i], zoomin)
+
+        # Pages are independent, their boxes are merged back in page order.
+        with ThreadPoolExecutor(max_workers=max(PDF_PARSER_WORKERS, 1)) as exe:
+            for i, (bxs, lefted_chars) in enumerate(exe.map(ocr_page, range(len(self.page_images)))):
+                self.boxes.append(bxs)
+                self.lefted_chars.extend(lefted_chars)
+                self.page_cum_height.append(self.page_images.size(i)[1] / zoomin)
+                if callback and i % 6 == 5:
+                    callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
         # print("OCR:", timer()-st)
 
         if not self.is_english and not any(
@@ -1031,6 +1322,18 @@ class RAGFlowPdfParser:
         if len(self.boxes) == 0 and zoomin < 9:
             self.__images__(fnm, zoomin * 3, page_from, page_to, callback)
 
+    def _reopen_pages(self, fnm, page_from, page_count, zoomin, is_english, outlines, total_page):
+        """Restore what `crop` and the chunkers use after parsing, from a cached parse result."""
+        self.pdf = pdfplumber.open(fnm) if isinstance(
+            fnm, str) else pdfplumber.open(BytesIO(fnm))
+        if isinstance(getattr(self, "page_images", None), PdfPageImages):
+            self.page_images.close()
+        self.page_images = PdfPageImages(self.pdf.pages[page_from:page_from + page_count], zoomin)
+        self.page_from = page_from
+        self.is_english = is_english
+        self.outlines = [tuple(o) for o in outlines]
+        self.total_page = total_page
+
     def __call__(self, fnm, need_image=True, zoomin=3, return_html=False):
         self.__images__(fnm, zoomin)
         self._layouts_rec(zoomin)
@@ -1045,7 +1348,7 @@ class RAGFlowPdfParser:
     def remove_tag(self, txt):
         return re.sub(r"@@[\t0-9.-]+?##", "", txt)
 
-    def crop(self, text, ZM=3, need_position=False):
+    def crop(self, text, ZM=3, need_position=False, need_image=True):
         imgs = []
         poss = []
         for tag in re.findall(r"@@[0-9-]+\t[0-9.\t]+##", text):
@@ -1067,39 +1370,43 @@ class RAGFlowPdfParser:
         poss.insert(0, ([pos[0][0]], pos[1], pos[2], max(
             0, pos[3] - 120), max(pos[3] - GAP, 0)))
         pos = poss[-1]
-        poss.append(([pos[0][-1]], pos[1], pos[2], min(self.page_images[pos[0][-1]].size[1] / ZM, pos[4] + GAP),
-                     min(self.page_images[pos[0][-1]].size[1] / ZM, pos[4] + 120)))
+        poss.append(([pos[0][-1]], pos[1], pos[2], min(self.page_images.size(pos[0][-1])[1] / ZM, pos[4] + GAP),
+                     min(self.page_images.size(pos[0][-1])[1] / ZM, pos[4] + 120)))
 
         positions = []
         for ii, (pns, left, right, top, bottom) in enumerate(poss):
             right = left + max_width
             bottom *= ZM
             for pn in pns[1:]:
-                bottom += self.page_images[pn - 1].size[1]
-            imgs.append(
-                self.page_images[pns[0]].crop((left * ZM, top * ZM,
-                                               right *
-                                               ZM, min(
-                    bottom, self.page_images[pns[0]].size[1])
-                                               ))
-            )
+                bottom += self.page_images.size(pn - 1)[1]
+            if need_image:
+                imgs.append(
+                    self.page_images[pns[0]].crop((left * ZM, top * ZM,
+                                                   right *
+                                                   ZM, min(
+                        bottom, self.page_images.size(pns[0])[1])
+                                                   ))
+                )
             if 0 < ii < len(poss) - 1:
                 positions.append((pns[0] + self.page_from, left, right, top, min(
-                    bottom, self.page_images[pns[0]].size[1]) / ZM))
-            bottom -= self.page_images[pns[0]].size[1]
+                    bottom, self.page_images.size(pns[0])[1]) / ZM))
+            bottom -= self.page_images.size(pns[0])[1]
             for pn in pns[1:]:
-                imgs.append(
-                    self.page_images[pn].crop((left * ZM, 0,
-                                               right * ZM,
-                                               min(bottom,
-                                                   self.page_images[pn].size[1])
-                                               ))
-                )
+                if need_image:
+                    imgs.append(
+                        self.page_images[pn].crop((left * ZM, 0,
+                                                   right * ZM,
+                                                   min(bottom,
+                                                       self.page_images.size(pn)[1])
+                                                   ))
+                    )
                 if 0 < ii < len(poss) - 1:
                     positions.append((pn + self.page_from, left, right, 0, min(
-                        bottom, self.page_images[pn].size[1]) / ZM))
-                bottom -= self.page_images[pn].size[1]
+                        bottom, self.page_images.size(pn)[1]) / ZM))
+                bottom -= self.page_images.size(pn)[1]
 
+        if not need_image:
+            return (None, positions) if need_position else None
         if not imgs:
             if need_position:
                 return None, None
@@ -1126,19 +1433,36 @@ class RAGFlowPdfParser:
             return pic, positions
         return pic
 
+    @staticmethod
+    def crop_positions(fnm, positions, ZM=3):
+        """
+        The image `crop` returns for a chunk, rendered again from its pdf and the
+        (page number, left, right, top, bottom) positions stored with the chunk.
+        """
+        parser = RAGFlowPdfParser.__new__(RAGFlowPdfParser)
+        parser.pdf = pdfplumber.open(fnm) if isinstance(
+            fnm, str) else pdfplumber.open(BytesIO(fnm))
+        parser.page_images = PdfPageImages(parser.pdf.pages, ZM)
+        parser.page_from = 0
+        try:
+            return parser.crop("".join(["@@{}\t{}\t{}\t{}\t{}##".format(*pos) for pos in positions]), ZM)
+        finally:
+            parser.page_images.close()
+            parser.pdf.close()
+
     def get_position(self, bx, ZM):
         poss = []
         pn = bx["page_number"]
         top = bx["top"] - self.page_cum_height[pn - 1]
         bott = bx["bottom"] - self.page_cum_height[pn - 1]
         poss.append((pn, bx["x0"], bx["x1"], top, min(
-            bott, self.page_images[pn - 1].size[1] / ZM)))
-        while bott * ZM > self.page_images[pn - 1].size[1]:
-            bott -= self.page_images[pn - 1].size[1] / ZM
+            bott, self.page_images.size(pn - 1)[1] / ZM)))
+        while bott * ZM > self.page_images.size(pn - 1)[1]:
+            bott -= self.page_images.size(pn - 1)[1] / ZM
             top = 0
             pn += 1
             poss.append((pn, bx["x0"], bx["x1"], top, min(
-                bott, self.page_images[pn - 1].size[1] / ZM)))
+                bott, self.page_images.size(pn - 1)[1] / ZM)))
         return poss
 
 
@@ -1170,7 +1494,7 @@ class PlainParser(object):
 
         return [(line, "") for line in lines], []
 
-    def crop(self, ck, need_position):
+    def crop(self, ck, need_position, need_image=True):
         raise NotImplementedError
 
     @staticmethod
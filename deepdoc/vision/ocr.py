@@ -16,11 +16,14 @@
 
 import logging
 import copy
+import queue
+import threading
 import time
 import os
 
 from huggingface_hub import snapshot_download
 
+from api.utils import get_base_config
 from api.utils.file_utils import get_project_base_directory
 from .operators import *  # noqa: F403
 from . import operators
@@ -66,6 +69,82 @@ def create_operators(op_param_list, global_config=None):
     return ops
 
 
+# Session options of every model, optionally overridden per model name (det, rec, layout, tsr...) under `models`.
+ONNX_CONFIG = get_base_config("onnx", {}) or {}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def onnx_model_config(nm):
+    # 0 threads lets ONNX Runtime use one per physical core.
+    conf = {
+        "intra_op_num_threads": 0,
+        "inter_op_num_threads": 0,
+        "enable_cpu_mem_arena": True,
+        "graph_optimization_level": "all",
+        "execution_mode": "sequential",
+        "sessions": 1,
+        "optimized_model_dir": "",
+    }
+    conf.update({k: v for k, v in ONNX_CONFIG.items() if k != "models"})
+    conf.update((ONNX_CONFIG.get("models") or {}).get(nm) or {})
+    return conf
+
+
+class SessionPool:
+    """
+    `sessions` InferenceSessions of one model, handed out to concurrent callers one at a time.
+    It runs like an InferenceSession, and keeps the count and latency of the inferences.
+    """
+
+    def __init__(self, name, sessions):
+        self.name = name
+        self.sessions = sessions
+        self.idle = queue.Queue()
+        for sess in sessions:
+            self.idle.put(sess)
+        self.lock = threading.Lock()
+        self.count = 0
+        self.elapsed = 0.0
+        self.max_elapsed = 0.0
+
+    def get_inputs(self):
+        return self.sessions[0].get_inputs()
+
+    def get_outputs(self):
+        return self.sessions[0].get_outputs()
+
+    def run(self, output_names, input_feed, run_options=None):
+        sess = self.idle.get()
+        st = time.time()
+        try:
+            return sess.run(output_names, input_feed, run_options)
+        finally:
+            elapsed = time.time() - st
+            self.idle.put(sess)
+            with self.lock:
+                self.count += 1
+                self.elapsed += elapsed
+                self.max_elapsed = max(self.max_elapsed, elapsed)
+
+    def stats(self):
+        with self.lock:
+            return {"sessions": len(self.sessions), "count": self.count,
+                    "avg_ms": round(self.elapsed * 1000 / self.count, 2) if self.count else 0,
+                    "max_ms": round(self.max_elapsed * 1000, 2)}
+
+
+def session_pool_stats():
+    """Inference count and latency of every loaded model."""
+    # a snapshot, models are loaded concurrently
+    return {os.path.basename(path): sess.stats() for path, (sess, _) in list(loaded_models.items())}
+
+
 def load_model(model_dir, nm):
     model_file_path = os.path.join(model_dir, nm + ".onnx")
     global loaded_models
@@ -87,37 +166,64 @@ def load_model(model_dir, nm):
             return False
         return False
 
-    options = ort.SessionOptions()
-    options.enable_cpu_mem_arena = False
-    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    options.intra_op_num_threads = 2
-    options.inter_op_num_threads = 2
+    conf = onnx_model_config(nm)
+    use_cuda = cuda_is_available()
+
+    def session_options():
+        options = ort.SessionOptions()
+        options.enable_cpu_mem_arena = bool(conf["enable_cpu_mem_arena"])
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if conf["execution_mode"] == "parallel" \
+            else ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = int(conf["intra_op_num_threads"])
+        options.inter_op_num_threads = int(conf["inter_op_num_threads"])
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[conf["graph_optimization_level"]]
+        return options
+
+    # The graph optimized for the execution provider is saved once, later startups load it without optimizing again.
+    path_to_load = model_file_path
+    optimized_model_path = None
+    if conf["optimized_model_dir"]:
+        os.makedirs(conf["optimized_model_dir"], exist_ok=True)
+        optimized_model_path = os.path.join(conf["optimized_model_dir"],
+                                            "{}.{}.{}.onnx".format(nm, "gpu" if use_cuda else "cpu",
+                                                                   conf["graph_optimization_level"]))
+        if os.path.exists(optimized_model_path):
+            path_to_load = optimized_model_path
 
     # https://github.com/microsoft/onnxruntime/issues/9509#issuecomment-951546580
     # Shrink GPU memory after execution
     run_options = ort.RunOptions()
-    if cuda_is_available():
-        cuda_provider_options = {
-            "device_id": 0, # Use specific GPU
-            "gpu_mem_limit": 512 * 1024 * 1024, # Limit gpu memory
-            "arena_extend_strategy": "kNextPowerOfTwo",  # gpu memory allocation strategy
-        }
-        sess = ort.InferenceSession(
-            model_file_path,
-            options=options,
-            providers=['CUDAExecutionProvider'],
-            provider_options=[cuda_provider_options]
-            )
+    sessions = []
+    for i in range(max(int(conf["sessions"]), 1)):
+        options = session_options()
+        if path_to_load != model_file_path:
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        elif optimized_model_path and i == 0:
+            options.optimized_model_filepath = optimized_model_path
+        if use_cuda:
+            cuda_provider_options = {
+                "device_id": 0, # Use specific GPU
+                "gpu_mem_limit": 512 * 1024 * 1024, # Limit gpu memory
+                "arena_extend_strategy": "kNextPowerOfTwo",  # gpu memory allocation strategy
+            }
+            sessions.append(ort.InferenceSession(
+                path_to_load,
+                sess_options=options,
+                providers=['CUDAExecutionProvider'],
+                provider_options=[cuda_provider_options]
+                ))
+        else:
+            sessions.append(ort.InferenceSession(
+                path_to_load,
+                sess_options=options,
+                providers=['CPUExecutionProvider']))
+    if use_cuda:
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "gpu:0")
-        logging.info(f"load_model {model_file_path} uses GPU")
+        logging.info(f"load_model {path_to_load} uses GPU, {len(sessions)} sessions")
     else:
-        sess = ort.InferenceSession(
-            model_file_path,
-            options=options,
-            providers=['CPUExecutionProvider'])
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "cpu")
-        logging.info(f"load_model {model_file_path} uses CPU")
-    loaded_model = (sess, run_options)
+        logging.info(f"load_model {path_to_load} uses CPU, {len(sessions)} sessions")
+    loaded_model = (SessionPool(nm, sessions), run_options)
     loaded_models[model_file_path] = loaded_model
     return loaded_model
 
@@ -620,6 +726,14 @@ class OCR(object):
             return ""
         return text
 
+    def recognize_batch(self, ori_im, boxes):
+        """Recognize the text of every box of `ori_im`, batched by TextRecognizer in order of aspect ratio."""
+        if not boxes:
+            return []
+        img_crops = [self.get_rotate_crop_image(ori_im, box) for box in boxes]
+        rec_res, elapse = self.text_recognizer(img_crops)
+        return [text if score >= self.drop_score else "" for text, score in rec_res]
+
     def __call__(self, img, cls=True):
         time_dict = {'det': 0, 'rec': 0, 'cls': 0, 'all': 0}
 
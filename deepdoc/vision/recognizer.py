@@ -16,7 +16,7 @@
 
 import logging
 import os
-import math
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
 from functools import cmp_to_key
@@ -71,44 +71,37 @@ class Recognizer(object):
         arr = sorted(arr, key=cmp_to_key(cmp))
         return arr
 
+    @staticmethod
+    def sort_keyed_runs(arr, key, key_fld):
+        """
+        Stable sort, by `key`, every run of consecutive boxes having `key_fld`. Boxes without it stay in place.
+        It is what restoring the order with adjacent swaps, never crossing a box without `key_fld`, ends with.
+        """
+        res, run = [], []
+        for b in arr:
+            if key_fld in b:
+                run.append(b)
+                continue
+            res.extend(sorted(run, key=key))
+            run = []
+            res.append(b)
+        res.extend(sorted(run, key=key))
+        return res
+
     @staticmethod
     def sort_C_firstly(arr, thr=0):
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["x0"], r["top"]))
         arr = Recognizer.sort_X_firstly(arr, thr)
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                # restore the order using th
-                if "C" not in arr[j] or "C" not in arr[j + 1]:
-                    continue
-                if arr[j + 1]["C"] < arr[j]["C"] \
-                        or (
-                        arr[j + 1]["C"] == arr[j]["C"]
-                        and arr[j + 1]["top"] < arr[j]["top"]
-                ):
-                    tmp = arr[j]
-                    arr[j] = arr[j + 1]
-                    arr[j + 1] = tmp
-        return arr
+        # restore the order using th
+        return Recognizer.sort_keyed_runs(arr, lambda b: (b["C"], b["top"]), "C")
 
     @staticmethod
     def sort_R_firstly(arr, thr=0):
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["top"], r["x0"]))
         arr = Recognizer.sort_Y_firstly(arr, thr)
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                if "R" not in arr[j] or "R" not in arr[j + 1]:
-                    continue
-                if arr[j + 1]["R"] < arr[j]["R"] \
-                        or (
-                        arr[j + 1]["R"] == arr[j]["R"]
-                        and arr[j + 1]["x0"] < arr[j]["x0"]
-                ):
-                    tmp = arr[j]
-                    arr[j] = arr[j + 1]
-                    arr[j + 1] = tmp
-        return arr
+        return Recognizer.sort_keyed_runs(arr, lambda b: (b["R"], b["x0"]), "R")
 
     @staticmethod
     def overlapped_area(a, b, ratio=True):
@@ -139,6 +132,7 @@ class Recognizer(object):
                         a["bottom"] < b["top"],
                         a["top"] > b["bottom"]])
 
+        index = BoxIndex(boxes)
         i = 0
         while i + 1 < len(layouts):
             j = i + 1
@@ -162,11 +156,12 @@ class Recognizer(object):
                 continue
 
             area_i, area_i_1 = 0, 0
-            for b in boxes:
-                if not notOverlapped(b, layouts[i]):
-                    area_i += Recognizer.overlapped_area(b, layouts[i], False)
-                if not notOverlapped(b, layouts[j]):
-                    area_i_1 += Recognizer.overlapped_area(b, layouts[j], False)
+            for k in index.overlapping(layouts[i]):
+                if not notOverlapped(boxes[k], layouts[i]):
+                    area_i += Recognizer.overlapped_area(boxes[k], layouts[i], False)
+            for k in index.overlapping(layouts[j]):
+                if not notOverlapped(boxes[k], layouts[j]):
+                    area_i_1 += Recognizer.overlapped_area(boxes[k], layouts[j], False)
 
             if area_i > area_i_1:
                 layouts.pop(j)
@@ -216,7 +211,7 @@ class Recognizer(object):
         return inputs
 
     @staticmethod
-    def find_overlapped(box, boxes_sorted_by_y, naive=False):
+    def find_overlapped(box, boxes_sorted_by_y, naive=False, index=None):
         if not boxes_sorted_by_y:
             return
         bxs = boxes_sorted_by_y
@@ -241,7 +236,8 @@ class Recognizer(object):
             break
 
         max_overlaped_i, max_overlaped = None, 0
-        for i in range(s, e):
+        # Boxes not touching `box` overlap by 0, which never wins.
+        for i in (range(s, e) if index is None else index.overlapping(box, s, e)):
             ov = Recognizer.overlapped_area(bxs[i], box)
             if ov <= max_overlaped:
                 continue
@@ -251,9 +247,11 @@ class Recognizer(object):
         return max_overlaped_i
 
     @staticmethod
-    def find_horizontally_tightest_fit(box, boxes):
+    def find_horizontally_tightest_fit(box, boxes, index=None):
         if not boxes:
             return
+        if index is not None:
+            return index.horizontally_tightest_fit(box)
         min_dis, min_i = 1000000, None
         for i,b in enumerate(boxes):
             if box.get("layoutno", "0") != b.get("layoutno", "0"):
@@ -265,12 +263,13 @@ class Recognizer(object):
         return min_i
 
     @staticmethod
-    def find_overlapped_with_threashold(box, boxes, thr=0.3):
+    def find_overlapped_with_threashold(box, boxes, thr=0.3, index=None):
         if not boxes:
             return
         max_overlapped_i, max_overlapped, _max_overlapped = None, thr, 0
         s, e = 0, len(boxes)
-        for i in range(s, e):
+        # Boxes not touching `box` overlap by 0, which is below any positive threshold.
+        for i in (range(s, e) if index is None or thr <= 0 else index.overlapping(box)):
             ov = Recognizer.overlapped_area(box, boxes[i])
             _ov = Recognizer.overlapped_area(boxes[i], box)
             if (ov, _ov) < (max_overlapped, _max_overlapped):
@@ -407,29 +406,75 @@ class Recognizer(object):
             "score": float(scores[i])
         } for i in indices]
 
-    def __call__(self, image_list, thr=0.7, batch_size=16):
-        res = []
-        imgs = []
-        for i in range(len(image_list)):
-            if not isinstance(image_list[i], np.ndarray):
-                imgs.append(np.array(image_list[i]))
-            else:
-                imgs.append(image_list[i])
-
-        batch_loop_cnt = math.ceil(float(len(imgs)) / batch_size)
-        for i in range(batch_loop_cnt):
-            start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(imgs))
-            batch_image_list = imgs[start_index:end_index]
+    def __call__(self, image_list, thr=0.7, batch_size=16, max_workers=1):
+        def recognize_batch(start_index):
+            # Convert the images batch by batch, so that pages rendered on demand are not all held at once.
+            end_index = min(start_index + batch_size, len(image_list))
+            batch_image_list = [img if isinstance(img, np.ndarray) else np.array(img)
+                                for img in (image_list[j] for j in range(start_index, end_index))]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
-            for ins in inputs:
-                bb = self.postprocess(self.ort_sess.run(None, {k:v for k,v in ins.items() if k in self.input_names}, self.run_options)[0], ins, thr)
-                res.append(bb)
+            return [self.postprocess(self.ort_sess.run(None, {k:v for k,v in ins.items() if k in self.input_names}, self.run_options)[0], ins, thr)
+                    for ins in inputs]
+
+        res = []
+        batch_starts = range(0, len(image_list), batch_size)
+        if max_workers > 1 and len(batch_starts) > 1:
+            # The session is shared, batches are recognized concurrently and kept in order.
+            with ThreadPoolExecutor(max_workers=max_workers) as exe:
+                for bbs in exe.map(recognize_batch, batch_starts):
+                    res.extend(bbs)
+        else:
+            for start_index in batch_starts:
+                res.extend(recognize_batch(start_index))
 
         #seeit.save_results(image_list, res, self.label_list, threshold=thr)
 
         return res
 
 
-
+class BoxIndex:
+    """
+    Boxes (dicts with x0, x1, top and bottom) indexed by their top, to find the boxes a box
+    touches without scanning all of them. Results are indexes in the original list, in order,
+    so that callers keep their tie-breaking.
+    """
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+        bounds = np.array([[b["x0"], b["x1"], b["top"], b["bottom"]] for b in boxes],
+                          dtype=np.float64).reshape(-1, 4)
+        # Bounds are ordered, so that a box with swapped coordinates is still found.
+        self.x0 = np.minimum(bounds[:, 0], bounds[:, 1])
+        self.x1 = np.maximum(bounds[:, 0], bounds[:, 1])
+        self.top = np.minimum(bounds[:, 2], bounds[:, 3])
+        self.bottom = np.maximum(bounds[:, 2], bounds[:, 3])
+        self.order = np.argsort(self.top, kind="stable")
+        self.sorted_top = self.top[self.order]
+        self.raw_x0 = bounds[:, 0]
+        self.raw_x1 = bounds[:, 1]
+        self.layoutno = [b.get("layoutno", "0") for b in boxes]
+
+    def overlapping(self, box, s=0, e=None):
+        """Indexes, within [s, e), of the boxes whose bounds touch `box`, in increasing order."""
+        x0, x1 = min(box["x0"], box["x1"]), max(box["x0"], box["x1"])
+        top, bottom = min(box["top"], box["bottom"]), max(box["top"], box["bottom"])
+        cand = self.order[:np.searchsorted(self.sorted_top, bottom, side="right")]
+        cand = cand[(self.bottom[cand] >= top) & (self.x0[cand] <= x1) & (self.x1[cand] >= x0)]
+        if e is None:
+            e = len(self.boxes)
+        cand = cand[(cand >= s) & (cand < e)]
+        return np.sort(cand).tolist()
+
+    def horizontally_tightest_fit(self, box):
+        """Same as Recognizer.find_horizontally_tightest_fit over the indexed boxes."""
+        mask = np.array([no == box.get("layoutno", "0") for no in self.layoutno], dtype=bool)
+        if not mask.any():
+            return
+        dis = np.minimum(np.minimum(np.abs(box["x0"] - self.raw_x0), np.abs(box["x1"] - self.raw_x1)),
+                         np.abs(box["x0"] + box["x1"] - self.raw_x1 - self.raw_x0) / 2)
+        dis[~mask] = np.inf
+        i = int(np.argmin(dis))
+        if not dis[i] < 1000000:
+            return
+        return i
@@ -0,0 +1,145 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Blocking of the candidate pairs of entity resolution.
+
+Instead of comparing every two entities of a type, names are bucketed by MinHash-LSH over their character
+n-grams, and optionally paired with their nearest neighbours by name embedding. Every entity keeps at most
+`top_k` candidates of each kind, so the number of pairs grows linearly with the number of entities.
+"""
+import heapq
+import logging
+import os
+import re
+from collections import defaultdict
+from itertools import combinations
+
+import numpy as np
+import xxhash
+
+from rag.nlp import is_english
+
+# The number of candidates each entity keeps, by name n-grams and by name embedding.
+ENTITY_RESOLUTION_TOP_K = int(os.environ.get("ENTITY_RESOLUTION_TOP_K", "8"))
+# The cosine similarity from which two name embeddings are candidates, above 1 disables the embedding neighbours.
+ENTITY_RESOLUTION_EMBEDDING_THRESHOLD = float(os.environ.get("ENTITY_RESOLUTION_EMBEDDING_THRESHOLD", "0.9"))
+
+MINHASH_PERMUTATIONS = 32
+# 16 bands of 2 rows: pairs with a Jaccard similarity of 0.25 share a bucket half of the time, of 0.5 99% of it.
+MINHASH_BANDS = 16
+# Buckets holding more names are n-grams most names share, like `公司` or `inc`, and are not enumerated.
+MAX_BUCKET_SIZE = 100
+MIN_JACCARD = 0.2
+_MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(20250101)
+_PERM_A = _rng.randint(1, _MERSENNE_PRIME, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+_PERM_B = _rng.randint(0, _MERSENNE_PRIME, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+
+
+def shingles(name: str) -> set:
+    """Character trigrams of the words of english names, characters and bigrams of the others."""
+    name = re.sub(r"\s+", " ", name.lower()).strip()
+    if is_english(name):
+        return set([f" {w} "[i:i + 3] for w in name.split() for i in range(len(w))]) or {name}
+    chars = name.replace(" ", "")
+    return set(chars) | set([chars[i:i + 2] for i in range(len(chars) - 1)])
+
+
+def minhash_signatures(shingle_sets: list) -> np.ndarray:
+    """(len(shingle_sets), MINHASH_PERMUTATIONS) MinHash signatures."""
+    sigs = np.full((len(shingle_sets), MINHASH_PERMUTATIONS), _MERSENNE_PRIME, dtype=np.uint64)
+    for i, sh in enumerate(shingle_sets):
+        if not sh:
+            continue
+        hs = np.array([xxhash.xxh32_intdigest(s.encode("utf-8")) for s in sh], dtype=np.uint64)
+        sigs[i] = ((np.outer(hs, _PERM_A) + _PERM_B) % _MERSENNE_PRIME).min(axis=0)
+    return sigs
+
+
+def _keep_top_k(scores: dict, top_k: int) -> set:
+    """Pairs among the `top_k` best scored of one of their two entities."""
+    by_entity = defaultdict(list)
+    for (i, j), s in scores.items():
+        by_entity[i].append((s, j))
+        by_entity[j].append((s, i))
+    kept = set()
+    for i, cands in by_entity.items():
+        for _, j in heapq.nlargest(top_k, cands):
+            kept.add((min(i, j), max(i, j)))
+    return kept
+
+
+def lsh_candidates(names: list, top_k: int = ENTITY_RESOLUTION_TOP_K) -> set:
+    """Index pairs of names sharing a MinHash-LSH bucket, scored by the Jaccard similarity of their n-grams."""
+    shs = [shingles(n) for n in names]
+    sigs = minhash_signatures(shs)
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    scores = {}
+    for b in range(MINHASH_BANDS):
+        buckets = defaultdict(list)
+        band = np.ascontiguousarray(sigs[:, b * rows:(b + 1) * rows])
+        for i in range(len(names)):
+            buckets[band[i].tobytes()].append(i)
+        for idxs in buckets.values():
+            if len(idxs) < 2 or len(idxs) > MAX_BUCKET_SIZE:
+                continue
+            for i, j in combinations(idxs, 2):
+                if (i, j) in scores:
+                    continue
+                scores[(i, j)] = len(shs[i] & shs[j]) / max(len(shs[i] | shs[j]), 1)
+    return _keep_top_k({p: s for p, s in scores.items() if s >= MIN_JACCARD}, top_k)
+
+
+def embedding_candidates(vects: list, top_k: int = ENTITY_RESOLUTION_TOP_K,
+                         threshold: float = ENTITY_RESOLUTION_EMBEDDING_THRESHOLD, batch_size: int = 1024) -> set:
+    """Index pairs of the nearest neighbours by the cosine similarity of `vects`, None vectors being left out."""
+    idxs = [i for i, v in enumerate(vects) if v is not None]
+    if len(idxs) < 2 or threshold > 1:
+        return set()
+    mat = np.array([np.asarray(vects[i], dtype=np.float32).ravel() for i in idxs])
+    mat /= np.maximum(np.linalg.norm(mat, axis=1, keepdims=True), 1e-9)
+    k = min(top_k, len(idxs) - 1)
+    scores = {}
+    for s in range(0, len(idxs), batch_size):
+        sims = mat[s:s + batch_size] @ mat.T
+        sims[np.arange(sims.shape[0]), np.arange(s, s + sims.shape[0])] = -1
+        nbrs = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        for r, js in enumerate(nbrs):
+            i = idxs[s + r]
+            for j in js:
+                if sims[r, j] >= threshold:
+                    scores[(min(i, idxs[j]), max(i, idxs[j]))] = float(sims[r, j])
+    return _keep_top_k(scores, top_k)
+
+
+def block_candidates(names: list, is_similarity=None, embd_mdl=None,
+                     top_k: int = ENTITY_RESOLUTION_TOP_K) -> list:
+    """
+    Candidate pairs of `names` for resolution: the pairs bucketed together by MinHash-LSH, and, given an
+    embedding model, the nearest neighbours by name embedding. Pairs failing `is_similarity` are dropped.
+    """
+    if len(names) < 2:
+        return []
+    pairs = lsh_candidates(names, top_k)
+    if embd_mdl is not None and ENTITY_RESOLUTION_EMBEDDING_THRESHOLD <= 1:
+        # Entities are embedded by their names when they are stored, those vectors are mostly cached.
+        from graphrag.utils import embed_batch
+        try:
+            pairs |= embedding_candidates(embed_batch(embd_mdl, names), top_k)
+        except Exception as e:
+            logging.exception(f"Fail to pair entities by embedding: {e}")
+    pairs = sorted(pairs)
+    return [(names[i], names[j]) for i, j in pairs if not is_similarity or is_similarity(names[i], names[j])]
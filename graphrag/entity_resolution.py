@@ -14,14 +14,16 @@
 #  limitations under the License.
 #
 import logging
-import itertools
+import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Any, Callable
 
 import networkx as nx
 
+from graphrag.entity_blocking import block_candidates
 from graphrag.general.extractor import Extractor
 from rag.nlp import is_english
 import editdistance
@@ -32,6 +34,9 @@ from graphrag.utils import perform_variable_replacements
 DEFAULT_RECORD_DELIMITER = "##"
 DEFAULT_ENTITY_INDEX_DELIMITER = "<|>"
 DEFAULT_RESOLUTION_RESULT_DELIMITER = "&&"
+# The number of candidate pairs asked in one LLM prompt, and the number of prompts asked concurrently.
+ENTITY_RESOLUTION_BATCH_SIZE = int(os.environ.get("ENTITY_RESOLUTION_BATCH_SIZE", "100"))
+ENTITY_RESOLUTION_MAX_WORKERS = int(os.environ.get("ENTITY_RESOLUTION_MAX_WORKERS", "8"))
 
 
 @dataclass
@@ -56,18 +61,26 @@ class EntityResolution(Extractor):
             get_entity: Callable | None = None,
             set_entity: Callable | None = None,
             get_relation: Callable | None = None,
-            set_relation: Callable | None = None
+            set_relation: Callable | None = None,
+            set_entities: Callable | None = None,
+            set_relations: Callable | None = None,
+            get_entities: Callable | None = None,
+            get_relations: Callable | None = None,
+            embd_mdl=None
     ):
-        super().__init__(llm_invoker, get_entity=get_entity, set_entity=set_entity, get_relation=get_relation, set_relation=set_relation)
+        super().__init__(llm_invoker, get_entity=get_entity, set_entity=set_entity, get_relation=get_relation, set_relation=set_relation,
+                         set_entities=set_entities, set_relations=set_relations, get_entities=get_entities, get_relations=get_relations)
         """Init method definition."""
         self._llm = llm_invoker
+        self._embd_mdl = embd_mdl
         self._resolution_prompt = ENTITY_RESOLUTION_PROMPT
         self._record_delimiter_key = "record_delimiter"
         self._entity_index_dilimiter_key = "entity_index_delimiter"
         self._resolution_result_delimiter_key = "resolution_result_delimiter"
         self._input_text_key = "input_text"
 
-    def __call__(self, graph: nx.Graph, prompt_variables: dict[str, Any] | None = None) -> EntityResolutionResult:
+    def __call__(self, graph: nx.Graph, prompt_variables: dict[str, Any] | None = None,
+                 callback: Callable | None = None) -> EntityResolutionResult:
         """Call method definition."""
         if prompt_variables is None:
             prompt_variables = {}
@@ -92,86 +105,123 @@ class EntityResolution(Extractor):
 
         candidate_resolution = {entity_type: [] for entity_type in entity_types}
         for k, v in node_clusters.items():
-            candidate_resolution[k] = [(a, b) for a, b in itertools.combinations(v, 2) if self.is_similarity(a, b)]
+            candidate_resolution[k] = block_candidates(v, self.is_similarity, self._embd_mdl)
+        num_candidates = sum([len(candidates) for candidates in candidate_resolution.values()])
+        logging.info(f"Entity resolution: {num_candidates} candidate pairs among {len(nodes)} entities.")
+        if callback:
+            callback(msg=f"Identified {num_candidates} candidate pairs among {len(nodes)} entities.")
 
-        gen_conf = {"temperature": 0.5}
         resolution_result = set()
-        for candidate_resolution_i in candidate_resolution.items():
-            if candidate_resolution_i[1]:
-                try:
-                    pair_txt = [
-                        f'When determining whether two {candidate_resolution_i[0]}s are the same, you should only focus on critical properties and overlook noisy factors.\n']
-                    for index, candidate in enumerate(candidate_resolution_i[1]):
-                        pair_txt.append(
-                            f'Question {index + 1}: name of{candidate_resolution_i[0]} A is {candidate[0]} ,name of{candidate_resolution_i[0]} B is {candidate[1]}')
-                    sent = 'question above' if len(pair_txt) == 1 else f'above {len(pair_txt)} questions'
-                    pair_txt.append(
-                        f'\nUse domain knowledge of {candidate_resolution_i[0]}s to help understand the text and answer the {sent} in the format: For Question i, Yes, {candidate_resolution_i[0]} A and {candidate_resolution_i[0]} B are the same {candidate_resolution_i[0]}./No, {candidate_resolution_i[0]} A and {candidate_resolution_i[0]} B are different {candidate_resolution_i[0]}s. For Question i+1, (repeat the above procedures)')
-                    pair_prompt = '\n'.join(pair_txt)
-
-                    variables = {
-                        **prompt_variables,
-                        self._input_text_key: pair_prompt
-                    }
-                    text = perform_variable_replacements(self._resolution_prompt, variables=variables)
-
-                    response = self._chat(text, [{"role": "user", "content": "Output:"}], gen_conf)
-                    result = self._process_results(len(candidate_resolution_i[1]), response,
-                                                   prompt_variables.get(self._record_delimiter_key,
-                                                                        DEFAULT_RECORD_DELIMITER),
-                                                   prompt_variables.get(self._entity_index_dilimiter_key,
-                                                                        DEFAULT_ENTITY_INDEX_DELIMITER),
-                                                   prompt_variables.get(self._resolution_result_delimiter_key,
-                                                                        DEFAULT_RESOLUTION_RESULT_DELIMITER))
-                    for result_i in result:
-                        resolution_result.add(candidate_resolution_i[1][result_i[0] - 1])
-                except Exception:
-                    logging.exception("error entity resolution")
+        batches = [(entity_type, candidates[i:i + ENTITY_RESOLUTION_BATCH_SIZE])
+                   for entity_type, candidates in candidate_resolution.items()
+                   for i in range(0, len(candidates), ENTITY_RESOLUTION_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=ENTITY_RESOLUTION_MAX_WORKERS) as exe:
+            threads = [exe.submit(self._resolve_candidates, entity_type, candidates, prompt_variables)
+                       for entity_type, candidates in batches]
+            for i, th in enumerate(threads):
+                resolution_result.update(th.result())
+                if callback and (i + 1) % 10 == 0:
+                    callback(msg=f"Resolved {i + 1}/{len(threads)} batches of candidate pairs.")
 
         connect_graph = nx.Graph()
         removed_entities = []
         connect_graph.add_edges_from(resolution_result)
+        components = []
         for sub_connect_graph in nx.connected_components(connect_graph):
-            sub_connect_graph = connect_graph.subgraph(sub_connect_graph)
-            remove_nodes = list(sub_connect_graph.nodes)
+            remove_nodes = list(connect_graph.subgraph(sub_connect_graph).nodes)
             keep_node = remove_nodes.pop()
-            self._merge_nodes(keep_node, self._get_entity_(remove_nodes))
-            for remove_node in remove_nodes:
-                removed_entities.append(remove_node)
-                remove_node_neighbors = graph[remove_node]
-                remove_node_neighbors = list(remove_node_neighbors)
-                for remove_node_neighbor in remove_node_neighbors:
-                    rel = self._get_relation_(remove_node, remove_node_neighbor)
-                    if graph.has_edge(remove_node, remove_node_neighbor):
-                        graph.remove_edge(remove_node, remove_node_neighbor)
-                    if remove_node_neighbor == keep_node:
-                        if graph.has_edge(keep_node, remove_node):
-                            graph.remove_edge(keep_node, remove_node)
-                        continue
-                    if not rel:
-                        continue
-                    if graph.has_edge(keep_node, remove_node_neighbor):
-                        self._merge_edges(keep_node, remove_node_neighbor, [rel])
-                    else:
-                        pair = sorted([keep_node, remove_node_neighbor])
-                        graph.add_edge(pair[0], pair[1], weight=rel['weight'])
-                        self._set_relation_(pair[0], pair[1],
-                                           dict(
-                                                src_id=pair[0],
-                                                tgt_id=pair[1],
-                                                weight=rel['weight'],
-                                                description=rel['description'],
-                                                keywords=[],
-                                                source_id=rel.get("source_id", ""),
-                                                metadata={"created_at": time.time()}
-                                           ))
-                graph.remove_node(remove_node)
+            components.append((keep_node, remove_nodes))
+
+        if self._set_entities_ and self._set_relations_:
+            self._pending_entities_, self._pending_relations_ = {}, {}
+        try:
+            # the relations of the removed nodes move to the kept node, merging into its own with their neighbours
+            entity_names, relation_pairs = [], []
+            for keep_node, remove_nodes in components:
+                neighbors = set([nbr for n in remove_nodes for nbr in graph[n]]) - {keep_node}
+                entity_names.extend([keep_node] + remove_nodes + list(neighbors))
+                relation_pairs.extend([(n, nbr) for n in remove_nodes for nbr in graph[n]])
+                relation_pairs.extend([(keep_node, nbr) for nbr in neighbors])
+            self._prefetch(entity_names, relation_pairs)
+            for keep_node, remove_nodes in components:
+                self._merge_nodes(keep_node, [e for e in [self._get_entity(n) for n in remove_nodes] if e])
+                for remove_node in remove_nodes:
+                    removed_entities.append(remove_node)
+                    remove_node_neighbors = graph[remove_node]
+                    remove_node_neighbors = list(remove_node_neighbors)
+                    for remove_node_neighbor in remove_node_neighbors:
+                        rel = self._get_relation(remove_node, remove_node_neighbor)
+                        if graph.has_edge(remove_node, remove_node_neighbor):
+                            graph.remove_edge(remove_node, remove_node_neighbor)
+                        if remove_node_neighbor == keep_node:
+                            if graph.has_edge(keep_node, remove_node):
+                                graph.remove_edge(keep_node, remove_node)
+                            continue
+                        if not rel:
+                            continue
+                        if graph.has_edge(keep_node, remove_node_neighbor):
+                            self._merge_edges(keep_node, remove_node_neighbor, [rel])
+                        else:
+                            pair = sorted([keep_node, remove_node_neighbor])
+                            graph.add_edge(pair[0], pair[1], weight=rel['weight'])
+                            self._save_relation(pair[0], pair[1],
+                                                dict(
+                                                    src_id=pair[0],
+                                                    tgt_id=pair[1],
+                                                    weight=rel['weight'],
+                                                    description=rel['description'],
+                                                    keywords=[],
+                                                    source_id=rel.get("source_id", ""),
+                                                    metadata={"created_at": time.time()}
+                                                ))
+                    graph.remove_node(remove_node)
+
+            if self._pending_entities_:
+                self._set_entities_(self._pending_entities_)
+            if self._pending_relations_:
+                self._set_relations_(self._pending_relations_)
+        finally:
+            self._pending_entities_, self._pending_relations_ = None, None
+            self._fetched_entities_, self._fetched_relations_ = None, None
 
         return EntityResolutionResult(
             graph=graph,
             removed_entities=removed_entities
         )
 
+    def _resolve_candidates(self, entity_type: str, candidates: list, prompt_variables: dict[str, Any]) -> list:
+        """The pairs of `candidates` the LLM deems the same entity, asked in a single prompt."""
+        gen_conf = {"temperature": 0.5}
+        try:
+            pair_txt = [
+                f'When determining whether two {entity_type}s are the same, you should only focus on critical properties and overlook noisy factors.\n']
+            for index, candidate in enumerate(candidates):
+                pair_txt.append(
+                    f'Question {index + 1}: name of{entity_type} A is {candidate[0]} ,name of{entity_type} B is {candidate[1]}')
+            sent = 'question above' if len(pair_txt) == 1 else f'above {len(pair_txt)} questions'
+            pair_txt.append(
+                f'\nUse domain knowledge of {entity_type}s to help understand the text and answer the {sent} in the format: For Question i, Yes, {entity_type} A and {entity_type} B are the same {entity_type}./No, {entity_type} A and {entity_type} B are different {entity_type}s. For Question i+1, (repeat the above procedures)')
+            pair_prompt = '\n'.join(pair_txt)
+
+            variables = {
+                **prompt_variables,
+                self._input_text_key: pair_prompt
+            }
+            text = perform_variable_replacements(self._resolution_prompt, variables=variables)
+
+            response = self._chat(text, [{"role": "user", "content": "Output:"}], gen_conf)
+            result = self._process_results(len(candidates), response,
+                                           prompt_variables.get(self._record_delimiter_key,
+                                                                DEFAULT_RECORD_DELIMITER),
+                                           prompt_variables.get(self._entity_index_dilimiter_key,
+                                                                DEFAULT_ENTITY_INDEX_DELIMITER),
+                                           prompt_variables.get(self._resolution_result_delimiter_key,
+                                                                DEFAULT_RESOLUTION_RESULT_DELIMITER))
+            return [candidates[result_i[0] - 1] for result_i in result]
+        except Exception:
+            logging.exception("error entity resolution")
+            return []
+
     def _process_results(
             self,
             records_length: int,
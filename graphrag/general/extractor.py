@@ -44,6 +44,10 @@ class Extractor:
         set_entity: Callable | None = None,
         get_relation: Callable | None = None,
         set_relation: Callable | None = None,
+        set_entities: Callable | None = None,
+        set_relations: Callable | None = None,
+        get_entities: Callable | None = None,
+        get_relations: Callable | None = None,
     ):
         self._llm = llm_invoker
         self._language = language
@@ -52,6 +56,16 @@ class Extractor:
         self._set_entity_ = set_entity
         self._get_relation_ = get_relation
         self._set_relation_ = set_relation
+        self._set_entities_ = set_entities
+        self._set_relations_ = set_relations
+        self._get_entities_ = get_entities
+        self._get_relations_ = get_relations
+        # Entities and relations merged by the current run, written in bulk when it is done.
+        self._pending_entities_ = None
+        self._pending_relations_ = None
+        # Entities and relations the current run may merge into, read in bulk before it starts.
+        self._fetched_entities_ = None
+        self._fetched_relations_ = None
 
     def _chat(self, system, history, gen_conf):
         hist = deepcopy(history)
@@ -121,15 +135,28 @@ class Extractor:
                 maybe_nodes[k].extend(v)
             for k, v in m_edges.items():
                 maybe_edges[tuple(sorted(k))].extend(v)
-        logging.info("Inserting entities into storage...")
-        all_entities_data = []
-        for en_nm, ents in maybe_nodes.items():
-            all_entities_data.append(self._merge_nodes(en_nm, ents))
+        if self._set_entities_ and self._set_relations_:
+            self._pending_entities_, self._pending_relations_ = {}, {}
+        try:
+            self._prefetch(list(maybe_nodes.keys()) + [e for k in maybe_edges.keys() for e in k],
+                           list(maybe_edges.keys()))
+            logging.info("Inserting entities into storage...")
+            all_entities_data = []
+            for en_nm, ents in maybe_nodes.items():
+                all_entities_data.append(self._merge_nodes(en_nm, ents))
 
-        logging.info("Inserting relationships into storage...")
-        all_relationships_data = []
-        for (src,tgt), rels in maybe_edges.items():
-            all_relationships_data.append(self._merge_edges(src, tgt, rels))
+            logging.info("Inserting relationships into storage...")
+            all_relationships_data = []
+            for (src,tgt), rels in maybe_edges.items():
+                all_relationships_data.append(self._merge_edges(src, tgt, rels))
+
+            if self._pending_entities_:
+                self._set_entities_(self._pending_entities_)
+            if self._pending_relations_:
+                self._set_relations_(self._pending_relations_)
+        finally:
+            self._pending_entities_, self._pending_relations_ = None, None
+            self._fetched_entities_, self._fetched_relations_ = None, None
 
         if not len(all_entities_data) and not len(all_relationships_data):
             logging.warning(
@@ -150,7 +177,7 @@ class Extractor:
         already_source_ids = []
         already_description = []
 
-        already_node = self._get_entity_(entity_name)
+        already_node = self._get_entity(entity_name)
         if already_node:
             already_entity_types.append(already_node["entity_type"])
             already_source_ids.extend(already_node["source_id"])
@@ -176,7 +203,7 @@ class Extractor:
             source_id=already_source_ids,
         )
         node_data["entity_name"] = entity_name
-        self._set_entity_(entity_name, node_data)
+        self._save_entity(entity_name, node_data)
         return node_data
 
     def _merge_edges(
@@ -192,7 +219,7 @@ class Extractor:
         already_description = []
         already_keywords = []
 
-        relation = self._get_relation_(src_id, tgt_id)
+        relation = self._get_relation(src_id, tgt_id)
         if relation:
             already_weights = [relation["weight"]]
             already_source_ids = relation["source_id"]
@@ -207,9 +234,9 @@ class Extractor:
         source_id = flat_uniq_list(edges_data, "source_id") + already_source_ids
 
         for need_insert_id in [src_id, tgt_id]:
-            if self._get_entity_(need_insert_id):
+            if self._get_entity(need_insert_id):
                 continue
-            self._set_entity_(need_insert_id, {
+            self._save_entity(need_insert_id, {
                         "source_id": source_id,
                         "description": description,
                         "entity_type": 'UNKNOWN'
@@ -225,10 +252,60 @@ class Extractor:
             weight=weight,
             source_id=source_id
         )
-        self._set_relation_(src_id, tgt_id, edge_data)
+        self._save_relation(src_id, tgt_id, edge_data)
 
         return edge_data
 
+    def _prefetch(self, entity_names: list, relation_pairs: list):
+        """
+        Read the stored entities and relations the run may merge into, with one bulk query each. The names and pairs
+        not stored are kept as None, the others are read one by one when first used.
+        """
+        if self._get_entities_:
+            entity_names = list(set(entity_names))
+            self._fetched_entities_ = {n: None for n in entity_names}
+            self._fetched_entities_.update(self._get_entities_(entity_names))
+        if self._get_relations_:
+            relation_pairs = list(set(relation_pairs))
+            self._fetched_relations_ = {p: None for p in relation_pairs}
+            self._fetched_relations_.update(self._get_relations_(relation_pairs))
+
+    def _get_entity(self, entity_name: str):
+        if self._pending_entities_ and entity_name in self._pending_entities_:
+            return self._pending_entities_[entity_name]
+        if self._fetched_entities_ is not None and entity_name in self._fetched_entities_:
+            return self._fetched_entities_[entity_name]
+        return self._get_entity_(entity_name)
+
+    def _get_relation(self, src_id: str, tgt_id: str):
+        for pair in [(src_id, tgt_id), (tgt_id, src_id)]:
+            if self._pending_relations_ and pair in self._pending_relations_:
+                return self._pending_relations_[pair]
+        if self._fetched_relations_ is not None:
+            fetched = [pair for pair in [(src_id, tgt_id), (tgt_id, src_id)] if pair in self._fetched_relations_]
+            if fetched:
+                return next((self._fetched_relations_[pair] for pair in fetched if self._fetched_relations_[pair]), None)
+        return self._get_relation_(src_id, tgt_id)
+
+    def _save_entity(self, entity_name: str, node_data: dict):
+        if self._pending_entities_ is None:
+            self._set_entity_(entity_name, node_data)
+            if self._fetched_entities_ is not None:
+                self._fetched_entities_[entity_name] = node_data
+            return
+        self._pending_entities_.setdefault(entity_name, node_data)
+
+    def _save_relation(self, src_id: str, tgt_id: str, edge_data: dict):
+        if self._pending_relations_ is None:
+            self._set_relation_(src_id, tgt_id, edge_data)
+            if self._fetched_relations_ is not None:
+                self._fetched_relations_[(src_id, tgt_id)] = edge_data
+            return
+        # a relation merged twice is written once, under the direction it was first merged in
+        if (tgt_id, src_id) in self._pending_relations_:
+            src_id, tgt_id = tgt_id, src_id
+        self._pending_relations_[(src_id, tgt_id)] = edge_data
+
     def _handle_entity_relation_summary(
             self,
             entity_or_relation_name: str,
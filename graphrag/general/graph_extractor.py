@@ -65,8 +65,13 @@ class GraphExtractor(Extractor):
         join_descriptions=True,
         max_gleanings: int | None = None,
         on_error: ErrorHandlerFn | None = None,
+        set_entities: Callable | None = None,
+        set_relations: Callable | None = None,
+        get_entities: Callable | None = None,
+        get_relations: Callable | None = None,
     ):
-        super().__init__(llm_invoker, language, entity_types, get_entity, set_entity, get_relation, set_relation)
+        super().__init__(llm_invoker, language, entity_types, get_entity, set_entity, get_relation, set_relation,
+                         set_entities, set_relations, get_entities, get_relations)
         """Init method definition."""
         # TODO: streamline construction
         self._llm = llm_invoker
@@ -15,7 +15,7 @@
 #
 import json
 import logging
-from functools import reduce, partial
+from functools import partial
 import networkx as nx
 
 from api import settings
@@ -23,10 +23,10 @@ from graphrag.general.community_reports_extractor import CommunityReportsExtract
 from graphrag.entity_resolution import EntityResolution
 from graphrag.general.extractor import Extractor
 from graphrag.general.graph_extractor import DEFAULT_ENTITY_TYPES
-from graphrag.utils import graph_merge, set_entity, get_relation, set_relation, get_entity, get_graph, set_graph, \
-    chunk_id, update_nodes_pagerank_nhop_neighbour
+from graphrag.utils import set_entity, get_relation, set_relation, get_entity, get_graph, set_graph, \
+    chunk_id, update_nodes_pagerank_nhop_neighbour, set_entities, set_relations, get_entities, get_relations, \
+    graph_lock, merge_graph
 from rag.nlp import rag_tokenizer, search
-from rag.utils.redis_conn import RedisDistributedLock
 
 
 class Dealer:
@@ -49,7 +49,11 @@ class Dealer:
                         get_entity=partial(get_entity, tenant_id, kb_id),
                         set_entity=partial(set_entity, tenant_id, kb_id, self.embed_bdl),
                         get_relation=partial(get_relation, tenant_id, kb_id),
-                        set_relation=partial(set_relation, tenant_id, kb_id, self.embed_bdl)
+                        set_relation=partial(set_relation, tenant_id, kb_id, self.embed_bdl),
+                        set_entities=partial(set_entities, tenant_id, kb_id, self.embed_bdl),
+                        set_relations=partial(set_relations, tenant_id, kb_id, self.embed_bdl),
+                        get_entities=partial(get_entities, tenant_id, kb_id),
+                        get_relations=partial(get_relations, tenant_id, kb_id)
                         )
         ents, rels = ext(chunks, callback)
         self.graph = nx.Graph()
@@ -64,16 +68,7 @@ class Dealer:
                 #description=rel["description"]
             )
 
-        with RedisDistributedLock(kb_id, 60*60):
-            old_graph, old_doc_ids = get_graph(tenant_id, kb_id)
-            if old_graph is not None:
-                logging.info("Merge with an exiting graph...................")
-                self.graph = reduce(graph_merge, [old_graph, self.graph])
-            update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, self.graph, 2)
-            if old_doc_ids:
-                docids.extend(old_doc_ids)
-                docids = list(set(docids))
-            set_graph(tenant_id, kb_id, self.graph, docids)
+        merge_graph(tenant_id, kb_id, self.graph, docids, callback)
 
 
 class WithResolution(Dealer):
@@ -87,7 +82,7 @@ class WithResolution(Dealer):
         self.llm_bdl = llm_bdl
         self.embed_bdl = embed_bdl
 
-        with RedisDistributedLock(kb_id, 60*60):
+        with graph_lock(kb_id) as lock:
             self.graph, doc_ids = get_graph(tenant_id, kb_id)
             if not self.graph:
                 logging.error(f"Faild to fetch the graph. tenant_id:{kb_id}, kb_id:{kb_id}")
@@ -101,14 +96,20 @@ class WithResolution(Dealer):
                                   get_entity=partial(get_entity, tenant_id, kb_id),
                                   set_entity=partial(set_entity, tenant_id, kb_id, self.embed_bdl),
                                   get_relation=partial(get_relation, tenant_id, kb_id),
-                                  set_relation=partial(set_relation, tenant_id, kb_id, self.embed_bdl))
-            reso = er(self.graph)
+                                  set_relation=partial(set_relation, tenant_id, kb_id, self.embed_bdl),
+                                  set_entities=partial(set_entities, tenant_id, kb_id, self.embed_bdl),
+                                  set_relations=partial(set_relations, tenant_id, kb_id, self.embed_bdl),
+                                  get_entities=partial(get_entities, tenant_id, kb_id),
+                                  get_relations=partial(get_relations, tenant_id, kb_id),
+                                  embd_mdl=self.embed_bdl)
+            reso = er(self.graph, callback=callback)
             self.graph = reso.graph
             logging.info("Graph resolution is done. Remove {} nodes.".format(len(reso.removed_entities)))
             if callback:
                 callback(msg="Graph resolution is done. Remove {} nodes.".format(len(reso.removed_entities)))
             update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, self.graph, 2)
-            set_graph(tenant_id, kb_id, self.graph, doc_ids)
+            lock.check()
+            set_graph(tenant_id, kb_id, self.graph, doc_ids, fence=lock.fence)
 
         settings.docStoreConn.delete({
             "knowledge_graph_kwd": "relation",
@@ -141,7 +142,7 @@ class WithCommunity(Dealer):
         self.llm_bdl = llm_bdl
         self.embed_bdl = embed_bdl
 
-        with RedisDistributedLock(kb_id, 60*60):
+        with graph_lock(kb_id) as lock:
             self.graph, doc_ids = get_graph(tenant_id, kb_id)
             if not self.graph:
                 logging.error(f"Faild to fetch the graph. tenant_id:{kb_id}, kb_id:{kb_id}")
@@ -159,7 +160,8 @@ class WithCommunity(Dealer):
             cr = cr(self.graph, callback=callback)
             self.community_structure = cr.structured_output
             self.community_reports = cr.output
-            set_graph(tenant_id, kb_id, self.graph, doc_ids)
+            lock.check()
+            set_graph(tenant_id, kb_id, self.graph, doc_ids, fence=lock.fence)
 
         if callback:
             callback(msg="Graph community extraction is done. Indexing {} reports.".format(len(cr.structured_output)))
@@ -0,0 +1,98 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+PageRank and n-hop neighbourhoods of the knowledge graph, computed on its sparse adjacency matrix.
+"""
+import logging
+import os
+
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# The number of neighbours, heaviest edges first, a n-hop path is extended through at every hop.
+GRAPH_N_HOP_FANOUT = int(os.environ.get("GRAPH_N_HOP_FANOUT", "16"))
+
+
+class Adjacency:
+    """The weighted adjacency of an undirected graph, the neighbours of every node sorted by descending weight."""
+
+    def __init__(self, graph: nx.Graph, weight: str = "weight"):
+        self.nodes = list(graph.nodes)
+        idx = {n: i for i, n in enumerate(self.nodes)}
+        rows, cols, data = [], [], []
+        for u, v, d in graph.edges(data=True):
+            w = float(d.get(weight, 1))
+            rows.append(idx[u])
+            cols.append(idx[v])
+            data.append(w)
+            if u != v:
+                rows.append(idx[v])
+                cols.append(idx[u])
+                data.append(w)
+        rows, cols, data = np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), np.array(data, dtype=np.float64)
+        order = np.lexsort((cols, -data, rows))
+        self.indices, self.data = cols[order], data[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(self.nodes)))])
+        self.matrix = csr_matrix((self.data, self.indices, self.indptr), shape=(len(self.nodes), len(self.nodes)))
+
+    def neighbours(self, i: int):
+        s, e = self.indptr[i], self.indptr[i + 1]
+        return self.indices[s:e], self.data[s:e]
+
+    def pagerank(self, alpha: float = 0.85, max_iter: int = 100, tol: float = 1.0e-6) -> np.ndarray:
+        """The PageRank of every node, by power iteration as `nx.pagerank` with its defaults."""
+        n = len(self.nodes)
+        if n == 0:
+            return np.array([])
+        out = np.asarray(self.matrix.sum(axis=1)).ravel()
+        dangling = out == 0
+        out[dangling] = 1
+        # transition matrix, transposed so that an iteration is a single sparse product
+        trans = csr_matrix(self.matrix.multiply(1.0 / out[:, None])).T.tocsr()
+        x = np.full(n, 1.0 / n)
+        for _ in range(max_iter):
+            last = x
+            x = alpha * (trans @ x + x[dangling].sum() / n) + (1 - alpha) / n
+            if np.abs(x - last).sum() < n * tol:
+                return x
+        logging.warning(f"PageRank did not converge in {max_iter} iterations.")
+        return x
+
+    def n_hop_paths(self, i: int, n_hop: int, fanout: int = GRAPH_N_HOP_FANOUT) -> list:
+        """
+        The paths of up to `n_hop` edges from node `i`, as [{"path": [names], "weights": [edge weights]}].
+        A path is extended through the `fanout` heaviest edges of its last node, never back along its last edge,
+        and is kept as is when it can not be extended or already loops.
+        """
+        nbrs, wts = self.neighbours(i)
+        paths = [([i, j], [w]) for j, w in zip(nbrs[:fanout].tolist(), wts[:fanout].tolist())]
+        for _ in range(n_hop - 1):
+            extended = []
+            for path, weights in paths:
+                last = path[-1]
+                if last in path[:-1]:
+                    extended.append((path, weights))
+                    continue
+                nbrs, wts = self.neighbours(last)
+                keep = nbrs != path[-2]
+                nbrs, wts = nbrs[keep][:fanout].tolist(), wts[keep][:fanout].tolist()
+                if not nbrs:
+                    extended.append((path, weights))
+                    continue
+                extended.extend([(path + [j], weights + [w]) for j, w in zip(nbrs, wts)])
+            paths = extended
+        return [{"path": [self.nodes[j] for j in path], "weights": weights} for path, weights in paths]
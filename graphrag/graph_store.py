@@ -0,0 +1,265 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Versioned storage of the knowledge graph of a knowledge base in the object storage.
+
+The graph is kept as a compact binary snapshot followed by the deltas of the later versions, the nodes and edges
+that were added, changed or removed by each write. A manifest names the snapshot and the deltas of the current
+version. Once there are GRAPH_MAX_DELTAS deltas, or they outgrow half of the snapshot, a new snapshot replaces them.
+The replaced snapshot and deltas are kept until the next snapshot replaces it in turn, so that readers of the
+manifest they replaced can still load them.
+"""
+import json
+import logging
+import os
+import threading
+import weakref
+import zlib
+
+import networkx as nx
+import numpy as np
+import ormsgpack
+import xxhash
+from cachetools import LRUCache
+
+# The number of deltas after which the graph is written as a new snapshot.
+GRAPH_MAX_DELTAS = int(os.environ.get("GRAPH_MAX_DELTAS", "16"))
+# The number of knowledge graphs each process keeps in memory, at their last loaded or written version.
+GRAPH_CACHE_SIZE = int(os.environ.get("GRAPH_CACHE_SIZE", "2"))
+GRAPH_STORE_PREFIX = "graphrag/graph"
+
+
+def _fingerprint(attrs: dict) -> str:
+    return xxhash.xxh64(json.dumps(attrs, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def _edge_key(u, v):
+    return (u, v) if str(u) <= str(v) else (v, u)
+
+
+def _default(o):
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, (set, tuple)):
+        return list(o)
+    return str(o)
+
+
+def _pack(obj) -> bytes:
+    return zlib.compress(ormsgpack.packb(obj, default=_default, option=ormsgpack.OPT_NON_STR_KEYS))
+
+
+def _unpack(binary: bytes):
+    return ormsgpack.unpackb(zlib.decompress(binary))
+
+
+class GraphVersionConflict(Exception):
+    """
+    The stored graph is not at the version it was loaded at, or was written by a later holder of its lock, or was
+    replaced twice while it was loaded. Loading it again, and redoing what was done with it, resolves it.
+    """
+
+
+class GraphStore:
+    """The knowledge graphs of knowledge bases, stored as snapshots and deltas in the bucket of each knowledge base."""
+
+    def __init__(self, cache_size=GRAPH_CACHE_SIZE):
+        self.lock = threading.Lock()
+        self.cache = LRUCache(maxsize=cache_size) if cache_size > 0 else None
+        # The version loaded graphs are at and the fingerprints of their nodes and edges, to write only what changed.
+        self.baselines = weakref.WeakKeyDictionary()
+
+    @property
+    def storage(self):
+        from rag.utils.storage_factory import STORAGE_IMPL
+        return STORAGE_IMPL
+
+    @staticmethod
+    def _object_name(version: int, kind: str) -> str:
+        return f"{GRAPH_STORE_PREFIX}/{version:08d}.{kind}"
+
+    def _manifest(self, kb_id):
+        name = f"{GRAPH_STORE_PREFIX}/manifest.json"
+        if not self.storage.obj_exist(kb_id, name):
+            return
+        binary = self.storage.get(kb_id, name)
+        return json.loads(binary) if binary else None
+
+    @staticmethod
+    def _fingerprints(graph: nx.Graph):
+        return {n: _fingerprint(a) for n, a in graph.nodes(data=True)}, \
+               {_edge_key(u, v): _fingerprint(a) for u, v, a in graph.edges(data=True)}
+
+    def _remember(self, kb_id, manifest, graph, docids, fingerprints):
+        cached = graph.copy() if self.cache is not None else None
+        with self.lock:
+            self.baselines[graph] = (manifest["version"], fingerprints)
+            if cached is not None:
+                self.baselines[cached] = (manifest["version"], fingerprints)
+                self.cache[kb_id] = (manifest["version"], cached, list(docids))
+
+    def merged(self, kb_id) -> list:
+        """The ids of the queued graphs merged by the last merge stored, see `save`."""
+        manifest = self._manifest(kb_id)
+        return manifest.get("merged", []) if manifest else []
+
+    def load(self, kb_id):
+        """(graph, docids) of the current version, (None, None) if none was stored."""
+        manifest = self._manifest(kb_id)
+        if not manifest:
+            return None, None
+        if self.cache is not None:
+            with self.lock:
+                cached = self.cache.get(kb_id)
+            if cached and cached[0] == manifest["version"]:
+                graph = cached[1].copy()
+                with self.lock:
+                    self.baselines[graph] = self.baselines[cached[1]]
+                return graph, list(cached[2])
+
+        binary = self.storage.get(kb_id, self._object_name(manifest["snapshot"][0], "snapshot"))
+        if not binary:
+            raise GraphVersionConflict(f"The graph snapshot {manifest['snapshot'][0]} of {kb_id} is missing, "
+                                       f"it was replaced while loaded.")
+        snapshot = _unpack(binary)
+        graph = nx.Graph(**snapshot["graph"])
+        graph.add_nodes_from(zip(snapshot["nodes"], snapshot["node_attrs"]))
+        nodes = snapshot["nodes"]
+        src = np.frombuffer(snapshot["src"], dtype=np.int32).tolist()
+        tgt = np.frombuffer(snapshot["tgt"], dtype=np.int32).tolist()
+        weights = np.frombuffer(snapshot["weight"], dtype=np.float64).tolist()
+        for s, t, w, a in zip(src, tgt, weights, snapshot["edge_attrs"]):
+            if not np.isnan(w):
+                a = {**a, "weight": w}
+            graph.add_edge(nodes[s], nodes[t], **a)
+        docids = snapshot["docids"]
+
+        for version, _ in manifest["deltas"]:
+            binary = self.storage.get(kb_id, self._object_name(version, "delta"))
+            if not binary:
+                raise GraphVersionConflict(f"The graph delta {version} of {kb_id} is missing, it was replaced while loaded.")
+            delta = _unpack(binary)
+            graph.remove_edges_from(delta["removed_edges"])
+            graph.remove_nodes_from(delta["removed_nodes"])
+            for n, a in delta["nodes"]:
+                graph.add_node(n)
+                graph.nodes[n].clear()
+                graph.nodes[n].update(a)
+            for u, v, a in delta["edges"]:
+                graph.add_edge(u, v)
+                graph.edges[u, v].clear()
+                graph.edges[u, v].update(a)
+            docids = delta["docids"]
+
+        self._remember(kb_id, manifest, graph, docids, self._fingerprints(graph))
+        return graph, docids
+
+    def _write_snapshot(self, kb_id, version, graph, docids):
+        nodes = list(graph.nodes)
+        idx = {n: i for i, n in enumerate(nodes)}
+        src, tgt, weights, edge_attrs = [], [], [], []
+        for u, v, a in graph.edges(data=True):
+            src.append(idx[u])
+            tgt.append(idx[v])
+            a = dict(a)
+            w = a.pop("weight", None)
+            weights.append(np.nan if w is None else float(w))
+            edge_attrs.append(a)
+        binary = _pack({
+            "graph": graph.graph,
+            "docids": list(docids),
+            "nodes": nodes,
+            "node_attrs": [graph.nodes[n] for n in nodes],
+            "src": np.array(src, dtype=np.int32).tobytes(),
+            "tgt": np.array(tgt, dtype=np.int32).tobytes(),
+            "weight": np.array(weights, dtype=np.float64).tobytes(),
+            "edge_attrs": edge_attrs,
+        })
+        self.storage.put(kb_id, self._object_name(version, "snapshot"), binary)
+        return len(binary)
+
+    def save(self, kb_id, graph: nx.Graph, docids, base: nx.Graph | None = None, fence: int | None = None,
+             merged: list | None = None):
+        """
+        Store `graph` as the next version. Only the nodes and edges changed since it, or `base`, was loaded are
+        written, unless it was not loaded from the store or a new snapshot is due. `merged`, the ids of the queued
+        graphs merged into it, are recorded by the same write of the manifest, and kept until the next merge.
+        Raise GraphVersionConflict if another version was stored since it was loaded, or if `fence`, the fencing
+        token of the lock it is written under, is older than the one of the last write.
+        The checks read the manifest before it is written, they are not atomic: a writer whose lock expired between
+        its check and its write still overwrites the manifest. The lease of the lock being renewed while it is held,
+        and the lock being checked right before the write, keep that window small.
+        """
+        manifest = self._manifest(kb_id)
+        if manifest and fence is not None and manifest.get("fence", 0) > fence:
+            raise GraphVersionConflict(f"The graph of {kb_id} was written under the fencing token "
+                                       f"{manifest['fence']}, after {fence}.")
+        with self.lock:
+            baseline = self.baselines.get(base if base is not None else graph)
+        if manifest and baseline and baseline[0] != manifest["version"]:
+            raise GraphVersionConflict(f"The graph of {kb_id} was loaded at version {baseline[0]}, "
+                                       f"it is at {manifest['version']}.")
+        fingerprints = self._fingerprints(graph)
+        version = manifest["version"] + 1 if manifest else 1
+
+        delta, size = None, 0
+        if manifest and baseline and len(manifest["deltas"]) < GRAPH_MAX_DELTAS:
+            base_nodes, base_edges = baseline[1]
+            nodes, edges = fingerprints
+            edge_attrs = {_edge_key(u, v): a for u, v, a in graph.edges(data=True)}
+            delta = {
+                "docids": list(docids),
+                "nodes": [(n, graph.nodes[n]) for n, fp in nodes.items() if base_nodes.get(n) != fp],
+                "removed_nodes": [n for n in base_nodes if n not in nodes],
+                "edges": [(k[0], k[1], edge_attrs[k]) for k, fp in edges.items() if base_edges.get(k) != fp],
+                "removed_edges": [k for k in base_edges if k not in edges],
+            }
+            binary = _pack(delta)
+            size = len(binary)
+            if size + sum([s for _, s in manifest["deltas"]]) > manifest["snapshot"][1] // 2:
+                delta = None
+            else:
+                self.storage.put(kb_id, self._object_name(version, "delta"), binary)
+
+        old = None
+        if delta is None:
+            size = self._write_snapshot(kb_id, version, graph, docids)
+            old = manifest
+            manifest = {"version": version, "snapshot": [version, size], "deltas": []}
+            if old:
+                manifest["retired"] = [self._object_name(old["snapshot"][0], "snapshot")] + \
+                                      [self._object_name(v, "delta") for v, _ in old["deltas"]]
+                for k in ["fence", "merged"]:
+                    if k in old:
+                        manifest[k] = old[k]
+        else:
+            manifest = {**manifest, "version": version, "deltas": manifest["deltas"] + [[version, size]]}
+        if fence is not None:
+            manifest["fence"] = fence
+        if merged is not None:
+            manifest["merged"] = list(merged)
+        self.storage.put(kb_id, f"{GRAPH_STORE_PREFIX}/manifest.json", json.dumps(manifest).encode("utf-8"))
+        logging.info(f"Stored the graph of {kb_id} as version {version}, "
+                     f"{'a delta' if delta is not None else 'a snapshot'} of {size} bytes.")
+
+        # the objects replaced by the previous snapshot, no longer named by the manifests of the last two versions
+        if old:
+            for name in old.get("retired", []):
+                self.storage.rm(kb_id, name)
+        self._remember(kb_id, manifest, graph, docids, fingerprints)
+
+
+GRAPH_STORE = GraphStore()
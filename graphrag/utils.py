@@ -9,25 +9,44 @@ Reference:
 import html
 import json
 import logging
+import os
 import re
 import time
+import uuid
 from collections import defaultdict
-from copy import deepcopy
+from functools import reduce
 from hashlib import md5
 from typing import Any, Callable
 
 import networkx as nx
-import numpy as np
 import xxhash
 from networkx.readwrite import json_graph
 
 from api import settings
+from graphrag.graph_analytics import Adjacency
+from graphrag.graph_store import GRAPH_STORE, GraphVersionConflict
 from rag.nlp import search, rag_tokenizer
 from rag.utils.doc_store_conn import OrderByExpr
-from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.embed_cache import EMBED_CACHE
+from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
 
 ErrorHandlerFn = Callable[[BaseException | None, str | None, dict | None], None]
 
+EMBEDDING_BATCH_SIZE = 16
+# The number of entity names, or relations, looked up per terms query, and of rows written per bulk.
+GRAPH_TERMS_SIZE = 1024
+GRAPH_BULK_SIZE = 512
+# The relative change of the PageRank of an entity below which it is not written again.
+GRAPH_PAGERANK_TOLERANCE = float(os.environ.get("GRAPH_PAGERANK_TOLERANCE", "0.01"))
+# The nodes, by PageRank, and edges, by weight, of the graph indexed for users to view.
+GRAPH_SHOWN_NODES = 256
+GRAPH_SHOWN_EDGES = 128
+# The seconds the lock of a graph is held for before it is renewed, and free again after its holder crashed.
+GRAPH_LOCK_LEASE = int(os.environ.get("GRAPH_LOCK_LEASE", "60"))
+# The number of queued document graphs merged into the graph of a knowledge base at once.
+GRAPH_MERGE_BATCH_SIZE = int(os.environ.get("GRAPH_MERGE_BATCH_SIZE", "64"))
+GRAPH_MERGE_TIMEOUT = 60 * 60
+
 
 def perform_variable_replacements(
     input: str, history: list[dict] | None = None, variables: dict | None = None
@@ -78,14 +97,17 @@ def dict_has_keys_with_types(
     return True
 
 
-def get_llm_cache(llmnm, txt, history, genconf):
+def llm_cache_key(llmnm, txt, history, genconf):
     hasher = xxhash.xxh64()
     hasher.update(str(llmnm).encode("utf-8"))
     hasher.update(str(txt).encode("utf-8"))
     hasher.update(str(history).encode("utf-8"))
     hasher.update(str(genconf).encode("utf-8"))
+    return hasher.hexdigest()
 
-    k = hasher.hexdigest()
+
+def get_llm_cache(llmnm, txt, history, genconf):
+    k = llm_cache_key(llmnm, txt, history, genconf)
     bin = REDIS_CONN.get(k)
     if not bin:
         return
@@ -93,36 +115,71 @@ def get_llm_cache(llmnm, txt, history, genconf):
 
 
 def set_llm_cache(llmnm, txt, v, history, genconf):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
-    hasher.update(str(history).encode("utf-8"))
-    hasher.update(str(genconf).encode("utf-8"))
-
-    k = hasher.hexdigest()
+    k = llm_cache_key(llmnm, txt, history, genconf)
     REDIS_CONN.set(k, v.encode("utf-8"), 24*3600)
 
 
-def get_embed_cache(llmnm, txt):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
+def get_llm_cache_batch(llmnm, txts, history, genconf):
+    """Look up the cached answers of `txts` with a single MGET, misses are None."""
+    if not txts:
+        return []
+    bins = REDIS_CONN.mget([llm_cache_key(llmnm, txt, history, genconf) for txt in txts])
+    if not bins:
+        return [None] * len(txts)
+    return [bin if bin else None for bin in bins]
 
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
-    if not bin:
+
+def set_llm_cache_batch(llmnm, txt2v, history, genconf):
+    """Cache the answer of every text in `txt2v` with one pipelined round trip."""
+    if not txt2v:
         return
-    return np.array(json.loads(bin))
+    REDIS_CONN.mset({llm_cache_key(llmnm, txt, history, genconf): v.encode("utf-8") for txt, v in txt2v.items()},
+                    24*3600)
+
+
+def embed_cache_namespace(llmnm):
+    return f"graphrag/{llmnm}"
+
+
+def get_embed_cache(llmnm, txt):
+    return get_embed_cache_batch(llmnm, [txt])[0]
 
 
 def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
+    set_embed_cache_batch(llmnm, {txt: arr})
+
+
+def get_embed_cache_batch(llmnm, txts):
+    """Look up the cached float32 vectors of `txts` with a single MGET, misses are None."""
+    if not txts:
+        return []
+    return EMBED_CACHE.get_many(embed_cache_namespace(llmnm), [str(t) for t in txts])
+
+
+def set_embed_cache_batch(llmnm, txt2arr):
+    """Cache every vector of `txt2arr` as packed float32 bytes with one pipelined round trip."""
+    EMBED_CACHE.set_many(embed_cache_namespace(llmnm), {str(t): arr for t, arr in txt2arr.items()})
 
-    k = hasher.hexdigest()
-    arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
-    REDIS_CONN.set(k, arr.encode("utf-8"), 24*3600)
+
+def embed_batch(embd_mdl, txts, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Vectors of `txts`, `batch_size` texts per model call. The model caches them, see LLMBundle.encode.
+    Texts that fail to embed get None.
+    """
+    ebds = [None] * len(txts)
+    for b in range(0, len(txts), batch_size):
+        batch = txts[b:b + batch_size]
+        try:
+            vts, _ = embd_mdl.encode(batch)
+        except Exception as e:
+            logging.exception(f"Fail to embed {len(batch)} entities or relations: {e}")
+            continue
+        if len(vts) != len(batch):
+            logging.error(f"Fail to embed {len(batch)} entities or relations: got {len(vts)} vectors")
+            continue
+        for i, vt in enumerate(vts):
+            ebds[b + i] = vt
+    return ebds
 
 
 def get_tags_from_cache(kb_ids):
@@ -155,7 +212,7 @@ def graph_merge(g1, g2):
         if g.has_edge(source, target):
             g[source][target].update({"weight": attr.get("weight", 0)+1})
             continue
-        g.add_edge(source, target)#, **attr)
+        g.add_edge(source, target, **attr)
 
     for node_degree in g.degree:
         g.nodes[str(node_degree[0])]["rank"] = int(node_degree[1])
@@ -255,36 +312,118 @@ def get_entity(tenant_id, kb_id, ent_name):
     return res
 
 
-def set_entity(tenant_id, kb_id, embd_mdl, ent_name, meta):
-    chunk = {
-        "important_kwd": [ent_name],
-        "title_tks": rag_tokenizer.tokenize(ent_name),
-        "entity_kwd": ent_name,
-        "knowledge_graph_kwd": "entity",
-        "entity_type_kwd": meta["entity_type"],
-        "content_with_weight": json.dumps(meta, ensure_ascii=False),
-        "content_ltks": rag_tokenizer.tokenize(meta["description"]),
-        "source_id": list(set(meta["source_id"])),
-        "kb_id": kb_id,
-        "available_int": 0
-    }
-    chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    res = settings.retrievaler.search({"entity_kwd": ent_name, "size": 1, "fields": []},
+def _graph_rows(tenant_id, kb_id, conds, fields):
+    """(id, fields) of the rows matching `conds`."""
+    res = settings.retrievaler.search({**conds, "fields": fields, "size": 10000},
                                       search.index_name(tenant_id), [kb_id])
-    if res.ids:
-        settings.docStoreConn.update({"entity_kwd": ent_name}, chunk, search.index_name(tenant_id), kb_id)
-    else:
-        ebd = get_embed_cache(embd_mdl.llm_name, ent_name)
-        if ebd is None:
+    return [(id, res.field.get(id, {})) for id in res.ids]
+
+
+def _entity_rows(tenant_id, kb_id, ent_names, fields):
+    """The rows of every entity of `ent_names`, GRAPH_TERMS_SIZE names per terms query."""
+    ent_names = list(dict.fromkeys(ent_names))
+    rows = defaultdict(list)
+    for b in range(0, len(ent_names), GRAPH_TERMS_SIZE):
+        conds = {"entity_kwd": ent_names[b:b + GRAPH_TERMS_SIZE], "knowledge_graph_kwd": ["entity"]}
+        for id, f in _graph_rows(tenant_id, kb_id, conds, ["entity_kwd"] + fields):
+            rows[f.get("entity_kwd")].append((id, f))
+    return rows
+
+
+def _relation_rows(tenant_id, kb_id, pairs, fields):
+    """The rows of every relation of `pairs`, in either direction, with terms queries on their entities."""
+    pairs = list(dict.fromkeys(pairs))
+    rows = defaultdict(list)
+    # All relations among the entities of a batch match, fewer pairs are asked at once than entity names.
+    batch_size = GRAPH_TERMS_SIZE // 4
+    for b in range(0, len(pairs), batch_size):
+        batch = pairs[b:b + batch_size]
+        ents = list(set([e for p in batch for e in p]))
+        conds = {"from_entity_kwd": ents, "to_entity_kwd": ents, "knowledge_graph_kwd": ["relation"]}
+        for id, f in _graph_rows(tenant_id, kb_id, conds, ["from_entity_kwd", "to_entity_kwd"] + fields):
+            rows[(f.get("from_entity_kwd"), f.get("to_entity_kwd"))].append((id, f))
+    return {p: rows.get(p) or rows.get((p[1], p[0])) for p in pairs if rows.get(p) or rows.get((p[1], p[0]))}
+
+
+def get_entities(tenant_id, kb_id, ent_names):
+    """The stored entities of `ent_names` by name, with one terms query per GRAPH_TERMS_SIZE names."""
+    res = {}
+    for ent_name, rows in _entity_rows(tenant_id, kb_id, ent_names, ["content_with_weight"]).items():
+        for _, f in rows:
             try:
-                ebd, _ = embd_mdl.encode([ent_name])
-                ebd = ebd[0]
-                set_embed_cache(embd_mdl.llm_name, ent_name, ebd)
-            except Exception as e:
-                logging.exception(f"Fail to embed entity: {e}")
+                res[ent_name] = json.loads(f["content_with_weight"])
+                break
+            except Exception:
+                continue
+    return res
+
+
+def get_relations(tenant_id, kb_id, pairs):
+    """The stored relations of `pairs` by pair, whatever the direction they are stored in."""
+    res = {}
+    for pair, rows in _relation_rows(tenant_id, kb_id, pairs, ["content_with_weight"]).items():
+        for _, f in rows:
+            try:
+                res[pair] = json.loads(f["content_with_weight"])
+                break
+            except Exception:
+                continue
+    return res
+
+
+def _upsert(tenant_id, kb_id, chunks, stale_ids):
+    """Write `chunks` in bulks of GRAPH_BULK_SIZE rows, then drop the duplicated rows they replace."""
+    for b in range(0, len(chunks), GRAPH_BULK_SIZE):
+        settings.docStoreConn.insert(chunks[b:b + GRAPH_BULK_SIZE], search.index_name(tenant_id), kb_id)
+    if stale_ids:
+        settings.docStoreConn.delete({"id": stale_ids}, search.index_name(tenant_id), kb_id)
+
+
+def set_entity(tenant_id, kb_id, embd_mdl, ent_name, meta):
+    set_entities(tenant_id, kb_id, embd_mdl, {ent_name: meta})
+
+
+def set_entities(tenant_id, kb_id, embd_mdl, ent2meta: dict):
+    """
+    Upsert the entities of `ent2meta`: existing rows are looked up with terms queries and rewritten under their ids,
+    keeping their page rank, the names are embedded in batches and all rows are written in bulk.
+    """
+    if not ent2meta:
+        return
+    existing = _entity_rows(tenant_id, kb_id, list(ent2meta.keys()), ["rank_flt", "n_hop_with_weight"])
+    chunks, stale_ids = [], []
+    for ent_name, meta in ent2meta.items():
+        chunk = {
+            "important_kwd": [ent_name],
+            "title_tks": rag_tokenizer.tokenize(ent_name),
+            "entity_kwd": ent_name,
+            "knowledge_graph_kwd": "entity",
+            "entity_type_kwd": meta["entity_type"],
+            "content_with_weight": json.dumps(meta, ensure_ascii=False),
+            "content_ltks": rag_tokenizer.tokenize(meta["description"]),
+            "source_id": list(set(meta["source_id"])),
+            "kb_id": kb_id,
+            "available_int": 0
+        }
+        chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
+        rows = existing.get(ent_name)
+        if rows:
+            id, f = rows[0]
+            if f.get("rank_flt") is not None:
+                chunk["rank_flt"] = float(f["rank_flt"])
+            if f.get("n_hop_with_weight"):
+                chunk["n_hop_with_weight"] = f["n_hop_with_weight"]
+            stale_ids.extend([i for i, _ in rows[1:]])
+        else:
+            id = chunk_id(chunk)
+        chunks.append({"id": id, **chunk})
+
+    # Rewritten rows are embedded again too, their names are mostly in the embedding cache.
+    ent_names = [ck["entity_kwd"] for ck in chunks]
+    for chunk, ebd in zip(chunks, embed_batch(embd_mdl, ent_names)):
         if ebd is not None:
             chunk["q_%d_vec" % len(ebd)] = ebd
-        settings.docStoreConn.insert([{"id": chunk_id(chunk), **chunk}], search.index_name(tenant_id), kb_id)
+    _upsert(tenant_id, kb_id, chunks, stale_ids)
 
 
 def get_relation(tenant_id, kb_id, from_ent_name, to_ent_name, size=1):
@@ -315,42 +454,53 @@ def get_relation(tenant_id, kb_id, from_ent_name, to_ent_name, size=1):
 
 
 def set_relation(tenant_id, kb_id, embd_mdl, from_ent_name, to_ent_name, meta):
-    chunk = {
-        "from_entity_kwd": from_ent_name,
-        "to_entity_kwd": to_ent_name,
-        "knowledge_graph_kwd": "relation",
-        "content_with_weight": json.dumps(meta, ensure_ascii=False),
-        "content_ltks": rag_tokenizer.tokenize(meta["description"]),
-        "important_kwd": meta["keywords"],
-        "source_id": list(set(meta["source_id"])),
-        "weight_int": int(meta["weight"]),
-        "kb_id": kb_id,
-        "available_int": 0
-    }
-    chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    res = settings.retrievaler.search({"from_entity_kwd": to_ent_name, "to_entity_kwd": to_ent_name, "size": 1, "fields": []},
-                                      search.index_name(tenant_id), [kb_id])
+    set_relations(tenant_id, kb_id, embd_mdl, {(from_ent_name, to_ent_name): meta})
 
-    if res.ids:
-        settings.docStoreConn.update({"from_entity_kwd": from_ent_name, "to_entity_kwd": to_ent_name},
-                                 chunk,
-                                 search.index_name(tenant_id), kb_id)
-    else:
-        txt = f"{from_ent_name}->{to_ent_name}"
-        ebd = get_embed_cache(embd_mdl.llm_name, txt)
-        if ebd is None:
-            try:
-                ebd, _ = embd_mdl.encode([txt+f": {meta['description']}"])
-                ebd = ebd[0]
-                set_embed_cache(embd_mdl.llm_name, txt, ebd)
-            except Exception as e:
-                logging.exception(f"Fail to embed entity relation: {e}")
+
+def set_relations(tenant_id, kb_id, embd_mdl, rel2meta: dict):
+    """
+    Upsert the relations of `rel2meta`: existing rows, in either direction, are looked up with terms queries and
+    rewritten under their ids, the relations are embedded in batches and all rows are written in bulk.
+    """
+    if not rel2meta:
+        return
+    existing = _relation_rows(tenant_id, kb_id, list(rel2meta.keys()), [])
+    chunks, stale_ids, txts = [], [], []
+    for (from_ent_name, to_ent_name), meta in rel2meta.items():
+        chunk = {
+            "from_entity_kwd": from_ent_name,
+            "to_entity_kwd": to_ent_name,
+            "knowledge_graph_kwd": "relation",
+            "content_with_weight": json.dumps(meta, ensure_ascii=False),
+            "content_ltks": rag_tokenizer.tokenize(meta["description"]),
+            "important_kwd": meta["keywords"],
+            "source_id": list(set(meta["source_id"])),
+            "weight_int": int(meta["weight"]),
+            "kb_id": kb_id,
+            "available_int": 0
+        }
+        chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
+        rows = existing.get((from_ent_name, to_ent_name))
+        if rows:
+            id = rows[0][0]
+            stale_ids.extend([i for i, _ in rows[1:]])
+        else:
+            id = chunk_id(chunk)
+        chunks.append({"id": id, **chunk})
+        txts.append(f"{from_ent_name}->{to_ent_name}: {meta['description']}")
+
+    for chunk, ebd in zip(chunks, embed_batch(embd_mdl, txts)):
         if ebd is not None:
             chunk["q_%d_vec" % len(ebd)] = ebd
-        settings.docStoreConn.insert([{"id": chunk_id(chunk), **chunk}], search.index_name(tenant_id), kb_id)
+    _upsert(tenant_id, kb_id, chunks, stale_ids)
 
 
 def get_graph(tenant_id, kb_id):
+    """
+    The graph of the knowledge base and the ids of its documents. It is loaded from the graph store, from the row of
+    a graph stored as a whole before it, or rebuilt from the entities and relations when a document was removed.
+    Raise GraphVersionConflict if the graph store was written while it was loaded, it is to be loaded again then.
+    """
     conds = {
         "fields": ["content_with_weight", "source_id"],
         "removed_kwd": "N",
@@ -359,18 +509,43 @@ def get_graph(tenant_id, kb_id):
     }
     res = settings.retrievaler.search(conds, search.index_name(tenant_id), [kb_id])
     for id in res.ids:
+        # neither the row, truncated once the graph store is used, nor a rebuild stands in for a graph being written
+        graph, _ = GRAPH_STORE.load(kb_id)
+        if graph is not None:
+            return graph, res.field[id]["source_id"]
         try:
-            return json_graph.node_link_graph(json.loads(res.field[id]["content_with_weight"]), edges="edges"), \
-                   res.field[id]["source_id"]
+            obj = json.loads(res.field[id]["content_with_weight"])
+            # the row only holds the part of the graph shown to users
+            if obj.get("truncated"):
+                break
+            return json_graph.node_link_graph(obj, edges="edges"), res.field[id]["source_id"]
         except Exception:
             continue
     return rebuild_graph(tenant_id, kb_id)
 
 
-def set_graph(tenant_id, kb_id, graph, docids):
+def set_graph(tenant_id, kb_id, graph, docids, base=None, fence=None, merged=None):
+    """
+    Store the graph as the next version in the graph store, only the nodes and edges changed since it, or `base`,
+    was loaded being written, and index the part of it shown to users. `fence` is the fencing token of the graph lock
+    it is written under, `merged` the ids of the queued graphs merged into it.
+    """
+    GRAPH_STORE.save(kb_id, graph, docids, base, fence, merged)
+
+    nodes = sorted(graph.nodes(data=True), key=lambda x: x[1].get("pagerank") or 0, reverse=True)[:GRAPH_SHOWN_NODES]
+    shown = graph.subgraph([n for n, _ in nodes])
+    edges = sorted([e for e in shown.edges(data=True) if e[0] != e[1]], key=lambda x: x[2].get("weight", 0),
+                   reverse=True)[:GRAPH_SHOWN_EDGES]
+    obj = {
+        "directed": False,
+        "multigraph": False,
+        "graph": {},
+        "nodes": [{**a, "id": n} for n, a in nodes],
+        "edges": [{**a, "source": u, "target": v} for u, v, a in edges],
+        "truncated": True
+    }
     chunk = {
-        "content_with_weight": json.dumps(nx.node_link_data(graph, edges="edges"), ensure_ascii=False,
-                                          indent=2),
+        "content_with_weight": json.dumps(obj, ensure_ascii=False),
         "knowledge_graph_kwd": "graph",
         "kb_id": kb_id,
         "source_id": list(docids),
@@ -385,84 +560,48 @@ def set_graph(tenant_id, kb_id, graph, docids):
         settings.docStoreConn.insert([{"id": chunk_id(chunk), **chunk}], search.index_name(tenant_id), kb_id)
 
 
-def is_continuous_subsequence(subseq, seq):
-    def find_all_indexes(tup, value):
-        indexes = []
-        start = 0
-        while True:
-            try:
-                index = tup.index(value, start)
-                indexes.append(index)
-                start = index + 1
-            except ValueError:
-                break
-        return indexes
-
-    index_list = find_all_indexes(seq,subseq[0])
-    for idx in index_list:
-        if idx!=len(seq)-1:
-            if seq[idx+1]==subseq[-1]:
-                return True
-    return False
-
-
-def merge_tuples(list1, list2):
-    result = []
-    for tup in list1:
-        last_element = tup[-1]
-        if last_element in tup[:-1]:
-            result.append(tup)
-        else:
-            matching_tuples = [t for t in list2 if t[0] == last_element]
-            already_match_flag = 0
-            for match in matching_tuples:
-                matchh = (match[1], match[0])
-                if is_continuous_subsequence(match, tup) or is_continuous_subsequence(matchh, tup):
-                    continue
-                already_match_flag = 1
-                merged_tuple = tup + match[1:]
-                result.append(merged_tuple)
-            if not already_match_flag:
-                result.append(tup)
-    return result
-
-
 def update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, graph, n_hop):
-    def n_neighbor(id):
-        nonlocal graph, n_hop
-        count = 0
-        source_edge = list(graph.edges(id))
-        if not source_edge:
-            return []
-        count = count + 1
-        while count < n_hop:
-            count = count + 1
-            sc_edge = deepcopy(source_edge)
-            source_edge = []
-            for pair in sc_edge:
-                append_edge = list(graph.edges(pair[-1]))
-                for tuples in merge_tuples([pair], append_edge):
-                    source_edge.append(tuples)
-        nbrs = []
-        for path in source_edge:
-            n = {"path": path, "weights": []}
-            wts = nx.get_edge_attributes(graph, 'weight')
-            for i in range(len(path)-1):
-                f, t = path[i], path[i+1]
-                n["weights"].append(wts.get((f, t), 0))
-            nbrs.append(n)
-        return nbrs
-
-    pr = nx.pagerank(graph)
-    for n, p in pr.items():
-        graph.nodes[n]["pagerank"] = p
+    """
+    Compute the PageRank and n-hop paths of every node on the adjacency matrix of the graph, and write those
+    that changed since they were last written, in bulk. The written values are remembered in the node attributes.
+    """
+    adj = Adjacency(graph)
+    pr = dict(zip(adj.nodes, adj.pagerank().tolist()))
+    changed = {}
+    for i, n in enumerate(adj.nodes):
+        attrs = graph.nodes[n]
+        value = {}
+        old = attrs.get("pagerank")
+        if old is None or abs(pr[n] - old) > GRAPH_PAGERANK_TOLERANCE * max(pr[n], old):
+            value["rank_flt"] = pr[n]
+        n_hop_with_weight = json.dumps(adj.n_hop_paths(i, n_hop), ensure_ascii=False)
+        digest = xxhash.xxh64(n_hop_with_weight.encode("utf-8")).hexdigest()
+        if attrs.get("n_hop_digest") != digest:
+            value["n_hop_with_weight"] = n_hop_with_weight
+            value["n_hop_digest"] = digest
+        if value:
+            changed[n] = value
+    logging.info(f"PageRank or n-hop paths of {len(changed)}/{len(adj.nodes)} entities changed.")
+
+    id2name = {id: n for n, rows in _entity_rows(tenant_id, kb_id, list(changed.keys()), []).items() for id, _ in rows}
+    ids = list(id2name.keys())
+    failed = set()
+    for b in range(0, len(ids), GRAPH_BULK_SIZE):
+        id2value = {}
+        for id in ids[b:b + GRAPH_BULK_SIZE]:
+            id2value[id] = {k: v for k, v in changed[id2name[id]].items() if k != "n_hop_digest"}
         try:
-            settings.docStoreConn.update({"entity_kwd": n, "kb_id": kb_id},
-                                         {"rank_flt": p,
-                                          "n_hop_with_weight": json.dumps(n_neighbor(n), ensure_ascii=False)},
-                                         search.index_name(tenant_id), kb_id)
+            errors = settings.docStoreConn.bulk_update(id2value, search.index_name(tenant_id), kb_id)
         except Exception as e:
             logging.exception(e)
+            errors = [f"{id}:" for id in id2value]
+        failed.update([id2name.get(e.split(":")[0]) for e in errors])
+    # Entities whose rows were not found or not updated are written again next time.
+    for n in set(id2name.values()) - failed:
+        if "rank_flt" in changed[n]:
+            graph.nodes[n]["pagerank"] = changed[n]["rank_flt"]
+        if "n_hop_digest" in changed[n]:
+            graph.nodes[n]["n_hop_digest"] = changed[n]["n_hop_digest"]
 
     ty2ents = defaultdict(list)
     for p, r in sorted(pr.items(), key=lambda x: x[1], reverse=True):
@@ -487,6 +626,71 @@ def update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, graph, n_hop):
         settings.docStoreConn.insert([{"id": chunk_id(chunk), **chunk}], search.index_name(tenant_id), kb_id)
 
 
+def graph_lock(kb_id, timeout=GRAPH_MERGE_TIMEOUT):
+    """The lock every write of the graph of the knowledge base is made under."""
+    return RedisDistributedLock(kb_id, timeout, GRAPH_LOCK_LEASE)
+
+
+def _merge_queued_graphs(tenant_id, kb_id, lock, callback=None):
+    queue = f"{kb_id}-graph-merge"
+    raw = REDIS_CONN.REDIS.lrange(queue, 0, GRAPH_MERGE_BATCH_SIZE - 1)
+    items = [json.loads(r) for r in raw]
+    marked = REDIS_CONN.mget([f"graph-merged-{it['id']}" for it in items]) or [None] * len(items)
+    items = [it for it, m in zip(items, marked) if not m]
+    # merged and stored by a holder of the lock that stopped before marking them and trimming the queue
+    stored = set(GRAPH_STORE.merged(kb_id))
+    merged = [it["id"] for it in items if it["id"] in stored]
+    items = [it for it in items if it["id"] not in stored]
+    if items:
+        old_graph, docids = get_graph(tenant_id, kb_id)
+        graphs = [json_graph.node_link_graph(it["graph"], edges="edges") for it in items]
+        if old_graph is not None:
+            logging.info("Merge with an exiting graph...................")
+            graphs.insert(0, old_graph)
+        graph = reduce(graph_merge, graphs)
+        update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, graph, 2)
+        docids = list(set((docids or []) + [d for it in items for d in it["docids"]]))
+        lock.check()
+        set_graph(tenant_id, kb_id, graph, docids, base=old_graph, fence=lock.fence, merged=[it["id"] for it in items])
+        merged.extend([it["id"] for it in items])
+        if callback:
+            callback(msg=f"Merged the graphs of {len(items)} queued documents.")
+    if merged:
+        REDIS_CONN.mset({f"graph-merged-{id}": 1 for id in merged}, GRAPH_MERGE_TIMEOUT)
+    # only the holder of the lock removes merged graphs from the head of the queue, later ones are pushed to its tail
+    REDIS_CONN.REDIS.ltrim(queue, len(raw), -1)
+
+
+def merge_graph(tenant_id, kb_id, graph, docids, callback=None):
+    """
+    Merge `graph`, extracted from `docids`, into the graph of the knowledge base.
+
+    It is queued, and whichever task holds the graph lock merges all the queued graphs, up to GRAPH_MERGE_BATCH_SIZE,
+    at once, so that the graph is loaded, ranked and stored once per batch rather than once per document. The other
+    tasks wait until their graph is merged or they get the lock.
+    """
+    item_id = str(uuid.uuid4())
+    REDIS_CONN.REDIS.rpush(f"{kb_id}-graph-merge", json.dumps({
+        "id": item_id,
+        "docids": list(docids),
+        "graph": json_graph.node_link_data(graph, edges="edges")
+    }, ensure_ascii=False))
+    end_time = time.time() + GRAPH_MERGE_TIMEOUT
+    while time.time() < end_time:
+        lock = graph_lock(kb_id, timeout=10)
+        if lock.acquire_lock():
+            try:
+                if not REDIS_CONN.exist(f"graph-merged-{item_id}"):
+                    _merge_queued_graphs(tenant_id, kb_id, lock, callback)
+            except GraphVersionConflict as e:
+                logging.warning(f"Merge the graph of {kb_id} again: {e}")
+            finally:
+                lock.release_lock()
+        if REDIS_CONN.exist(f"graph-merged-{item_id}"):
+            return
+    raise Exception(f"Fail to merge the graph of {docids} into {kb_id} in {GRAPH_MERGE_TIMEOUT} seconds.")
+
+
 def get_entity_type2sampels(idxnms, kb_ids: list):
     es_res = settings.retrievaler.search({"knowledge_graph_kwd": "ty2ents", "kb_id": kb_ids,
                                        "size": 10000,
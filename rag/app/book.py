@@ -25,9 +25,11 @@ from rag.nlp import bullets_category, is_english,remove_contents_table, \
     tokenize_chunks
 from rag.nlp import rag_tokenizer
 from deepdoc.parser import PdfParser, DocxParser, PlainParser, HtmlParser
+from deepdoc.parser.pdf_parser import cached_parse
 
 
 class Pdf(PdfParser):
+    @cached_parse
     def __call__(self, filename, binary=None, from_page=0,
                  to_page=100000, zoomin=3, callback=None):
         from timeit import default_timer as timer
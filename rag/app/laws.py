@@ -26,6 +26,7 @@ from rag.nlp import bullets_category, remove_contents_table, hierarchical_merge,
     make_colon_as_title, tokenize_chunks, docx_question_level
 from rag.nlp import rag_tokenizer
 from deepdoc.parser import PdfParser, DocxParser, PlainParser, HtmlParser
+from deepdoc.parser.pdf_parser import cached_parse
 
 
 class Docx(DocxParser):
@@ -113,6 +114,7 @@ class Pdf(PdfParser):
         self.model_speciess = ParserType.LAWS.value
         super().__init__()
 
+    @cached_parse
     def __call__(self, filename, binary=None, from_page=0,
                  to_page=100000, zoomin=3, callback=None):
         from timeit import default_timer as timer
@@ -20,7 +20,7 @@ from io import BytesIO
 from docx import Document
 from timeit import default_timer as timer
 import re
-from deepdoc.parser.pdf_parser import PlainParser
+from deepdoc.parser.pdf_parser import PlainParser, cached_parse
 from rag.nlp import rag_tokenizer, naive_merge, tokenize_table, tokenize_chunks, find_codec, concat_img, \
     naive_merge_docx, tokenize_chunks_docx
 from deepdoc.parser import PdfParser, ExcelParser, DocxParser, HtmlParser, JsonParser, MarkdownParser, TxtParser
@@ -127,6 +127,7 @@ class Docx(DocxParser):
 
 
 class Pdf(PdfParser):
+    @cached_parse
     def __call__(self, filename, binary=None, from_page=0,
                  to_page=100000, zoomin=3, callback=None):
         start = timer()
@@ -21,6 +21,7 @@ import re
 from api.db import ParserType
 from rag.nlp import rag_tokenizer, tokenize, tokenize_table, add_positions, bullets_category, title_frequency, tokenize_chunks
 from deepdoc.parser import PdfParser, PlainParser
+from deepdoc.parser.pdf_parser import cached_parse
 import numpy as np
 
 
@@ -29,6 +30,7 @@ class Pdf(PdfParser):
         self.model_speciess = ParserType.PAPER.value
         super().__init__()
 
+    @cached_parse
     def __call__(self, filename, binary=None, from_page=0,
                  to_page=100000, zoomin=3, callback=None):
         from timeit import default_timer as timer
@@ -20,12 +20,12 @@ import csv
 from copy import deepcopy
 from io import BytesIO
 from timeit import default_timer as timer
-from openpyxl import load_workbook
 
 from deepdoc.parser.utils import get_text
 from rag.nlp import is_english, random_choices, qbullets_category, add_positions, has_qbullet, docx_question_level
 from rag.nlp import rag_tokenizer, tokenize_table, concat_img
 from deepdoc.parser import PdfParser, ExcelParser, DocxParser
+from deepdoc.parser.pdf_parser import cached_parse
 from docx import Document
 from PIL import Image
 from markdown import markdown
@@ -33,27 +33,19 @@ from markdown import markdown
 
 class Excel(ExcelParser):
     def __call__(self, fnm, binary=None, callback=None):
-        if not binary:
-            wb = load_workbook(fnm)
-        else:
-            wb = load_workbook(BytesIO(binary))
-        total = 0
-        for sheetname in wb.sheetnames:
-            total += len(list(wb[sheetname].rows))
+        total = self.row_number(fnm, binary) or 1
 
         res, fails = [], []
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
+        for sheetname, rows in self._iter_sheets(binary or fnm):
             for i, r in enumerate(rows):
                 q, a = "", ""
-                for cell in r:
-                    if not cell.value:
+                for v in r:
+                    if not v:
                         continue
                     if not q:
-                        q = str(cell.value)
+                        q = str(v)
                     elif not a:
-                        a = str(cell.value)
+                        a = str(v)
                     else:
                         break
                 if q and a:
@@ -75,6 +67,7 @@ class Excel(ExcelParser):
 
 
 class Pdf(PdfParser):
+    @cached_parse
     def __call__(self, filename, binary=None, from_page=0,
                  to_page=100000, zoomin=3, callback=None):
         start = timer()
@@ -16,11 +16,9 @@
 
 import copy
 import re
-from io import BytesIO
 from xpinyin import Pinyin
 import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
 from dateutil.parser import parse as datetime_parse
 
 from api.db.services.knowledgebase_service import KnowledgebaseService
@@ -32,39 +30,25 @@ from deepdoc.parser import ExcelParser
 class Excel(ExcelParser):
     def __call__(self, fnm, binary=None, from_page=0,
                  to_page=10000000000, callback=None):
-        if not binary:
-            wb = load_workbook(fnm)
-        else:
-            wb = load_workbook(BytesIO(binary))
-        total = 0
-        for sheetname in wb.sheetnames:
-            total += len(list(wb[sheetname].rows))
-
         res, fails, done = [], [], 0
         rn = 0
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+        for sheetname, rows in self._iter_sheets(binary or fnm):
+            headers = next(rows, None)
+            if headers is None:
                 continue
-            headers = [cell.value for cell in rows[0]]
+            width = len(headers)
             missed = set([i for i, h in enumerate(headers) if h is None])
-            headers = [
-                cell.value for i,
-                cell in enumerate(
-                    rows[0]) if i not in missed]
+            headers = [h for i, h in enumerate(headers) if i not in missed]
             if not headers:
                 continue
             data = []
-            for i, r in enumerate(rows[1:]):
+            for i, r in enumerate(rows):
                 rn += 1
                 if rn - 1 < from_page:
                     continue
                 if rn - 1 >= to_page:
                     break
-                row = [
-                    cell.value for ii,
-                    cell in enumerate(r) if ii not in missed]
+                row = [v for ii, v in enumerate(self._pad(r, width)) if ii not in missed]
                 if len(row) != len(headers):
                     fails.append(str(i))
                     continue
@@ -18,6 +18,7 @@ import logging
 import random
 from collections import Counter
 
+from rag.settings import CHUNK_IMAGE_LAZY
 from rag.utils import num_tokens_from_string
 from . import rag_tokenizer
 import re
@@ -264,7 +265,9 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
         d = copy.deepcopy(doc)
         if pdf_parser:
             try:
-                d["image"], poss = pdf_parser.crop(ck, need_position=True)
+                d["image"], poss = pdf_parser.crop(ck, need_position=True, need_image=not CHUNK_IMAGE_LAZY)
+                if CHUNK_IMAGE_LAZY and poss:
+                    d["lazy_image"] = True
                 add_positions(d, poss)
                 ck = pdf_parser.remove_tag(ck)
             except NotImplementedError:
@@ -17,6 +17,8 @@
 import logging
 import json
 import re
+import numpy as np
+from scipy.sparse import csr_matrix
 from rag.utils.doc_store_conn import MatchTextExpr
 
 from rag.nlp import rag_tokenizer, term_weight, synonym
@@ -200,28 +202,44 @@ class FulltextQueryer:
             ), keywords
         return None, keywords
 
-    def hybrid_similarity(self, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
-        from sklearn.metrics.pairwise import cosine_similarity as CosineSimilarity
-        import numpy as np
+    @staticmethod
+    def vector_similarity(avec, bvecs):
+        """Cosine similarity between `avec` and every row of `bvecs`, computed on one contiguous float32 matrix."""
+        a = np.asarray(avec, dtype=np.float32).reshape(-1)
+        b = np.asarray(bvecs, dtype=np.float32)
+        if b.ndim == 1:
+            b = b.reshape(1, -1)
+        norms = np.linalg.norm(b, axis=1) * np.linalg.norm(a)
+        norms[norms == 0] = 1.
+        return (b @ a / norms).astype(np.float64)
 
-        sims = CosineSimilarity([avec], bvecs)
+    def hybrid_similarity(self, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
+        sims = self.vector_similarity(avec, bvecs)
         tksim = self.token_similarity(atks, btkss)
-        return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
+        return sims * vtweight + np.array(tksim) * tkweight, tksim, sims
 
     def token_similarity(self, atks, btkss):
-        def toDict(tks):
-            d = {}
+        """
+        The share of the query's token weight found in each of `btkss`, like `similarity` for each of them.
+        Query tokens are indexed into one vocabulary and matched against all candidates with a sparse product.
+        """
+        if isinstance(atks, str):
+            atks = atks.split()
+        qtwt = {}
+        for t, c in self.tw.weights(atks, preprocess=False):
+            qtwt[t] = qtwt.get(t, 0) + c
+        vocab = {t: i for i, t in enumerate(qtwt.keys())}
+        qvec = np.array(list(qtwt.values()), dtype=np.float64)
+
+        rows, cols = [], []
+        for r, tks in enumerate(btkss):
             if isinstance(tks, str):
                 tks = tks.split()
-            for t, c in self.tw.weights(tks, preprocess=False):
-                if t not in d:
-                    d[t] = 0
-                d[t] += c
-            return d
-
-        atks = toDict(atks)
-        btkss = [toDict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+            for c in set([vocab[t] for t in tks if t in vocab]):
+                rows.append(r)
+                cols.append(c)
+        hits = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(btkss), len(vocab)))
+        return ((hits @ qvec + 1e-9) / (np.sum(qvec) + 1e-9)).tolist()
 
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
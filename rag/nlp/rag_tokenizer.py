@@ -164,6 +164,129 @@ class RagTokenizer:
 
         return self.dfs_(chars, s + 1, preTks, tkslist)
 
+    def dag_(self, chars):
+        """
+        Build the word DAG of `chars`: for every start position, the (end, token, (freq, tag)) of
+        every dictionary word starting there, plus the single char which is always a way forward.
+        """
+        dag = []
+        for s in range(len(chars)):
+            edges = []
+            for e in range(s + 1, len(chars) + 1):
+                t = chars[s:e]
+                k = self.key_(t)
+                if k in self.trie_:
+                    edges.append((e, t, self.trie_[k]))
+                elif e == s + 1:
+                    edges.append((e, t, (-12, '')))
+                if not self.trie_.has_keys_with_prefix(k):
+                    break
+            dag.append(edges)
+        return dag
+
+    def segment_(self, chars):
+        """
+        Find the segmentation of `chars` which maximizes `score_`,
+        by dynamic programming over the word DAG instead of enumerating every segmentation like `dfs_`.
+
+        `score_` is B/n + L/n + F for n tokens, L of them longer than one char, with frequency sum F,
+        so for every position and token count only the (F, L) pareto front needs to be kept.
+        """
+        B = 30
+        dag = self.dag_(chars)
+        # fronts[pos][n]: list of (F, L, prev_pos, prev_n, prev_idx, (tk, (freq, tag))) reaching pos with n tokens
+        fronts = [{} for _ in range(len(chars) + 1)]
+        fronts[0][0] = [(0, 0, -1, -1, -1, None)]
+        for s in range(len(chars) + 1):
+            for n, front in fronts[s].items():
+                # keep the entries not dominated on both F and L
+                front.sort(key=lambda x: (x[0], x[1]), reverse=True)
+                pareto = []
+                for entry in front:
+                    if not pareto or entry[1] > pareto[-1][1]:
+                        pareto.append(entry)
+                fronts[s][n] = pareto
+            if s == len(chars):
+                break
+            for n, front in fronts[s].items():
+                for idx, (F, L, *_) in enumerate(front):
+                    for e, t, (freq, tag) in dag[s]:
+                        fronts[e].setdefault(n + 1, []).append(
+                            (F + freq, L + (0 if len(t) < 2 else 1), s, n, idx, (t, (freq, tag))))
+
+        best, best_score = None, None
+        for n, front in fronts[len(chars)].items():
+            for idx, (F, L, *_) in enumerate(front):
+                sc = B / n + L / n + F
+                if best_score is None or sc > best_score:
+                    best, best_score = (n, idx), sc
+        if best is None:
+            return [chars], 0
+
+        tks = []
+        pos, (n, idx) = len(chars), best
+        while pos > 0:
+            _, _, prev_pos, prev_n, prev_idx, (tk, _) = fronts[pos][n][idx]
+            tks.append(tk)
+            pos, n, idx = prev_pos, prev_n, prev_idx
+        tks = tks[::-1]
+        logging.debug("[SC] {} {} {}".format(tks, len(tks), best_score))
+        return tks, best_score
+
+    def dfs_edges_(self, chars, s, singles):
+        """
+        The (end, token, (freq, tag)) `dfs_` branches into at `s`, after `singles` single char tokens in a row,
+        counted up to 3: the dictionary words its pruning keeps, or else the single char.
+        """
+        S = s + 1
+        if s + 2 <= len(chars):
+            if self.trie_.has_keys_with_prefix(self.key_(chars[s:s + 1])) and \
+                    not self.trie_.has_keys_with_prefix(self.key_(chars[s:s + 2])):
+                S = s + 2
+        if singles >= 3 and self.trie_.has_keys_with_prefix(self.key_(chars[s - 1:s + 1])):
+            S = s + 2
+
+        edges = []
+        for e in range(S, len(chars) + 1):
+            t = chars[s:e]
+            k = self.key_(t)
+            if e > s + 1 and not self.trie_.has_keys_with_prefix(k):
+                break
+            if k in self.trie_:
+                edges.append((e, t, self.trie_[k]))
+        if edges:
+            return edges
+        t = chars[s:s + 1]
+        k = self.key_(t)
+        return [(s + 1, t, self.trie_[k] if k in self.trie_ else (-12, ''))]
+
+    def top_segments_(self, chars, topn=2):
+        """
+        The `topn` best segmentations of `chars` and their scores, as `sortTks_(dfs_(chars))` ranks them,
+        ties in the order `dfs_` enumerates them, by dynamic programming over the segmentations `dfs_` walks.
+
+        For n tokens, L of them longer than one char, `score_` is B/n + L/n + F, so of the paths reaching a
+        position with the same n and L, the `topn` best on the frequency sum F are the only ones to extend.
+        """
+        B = 30
+        # states[pos][(singles, n, L)]: up to topn (F, ends, tks) reaching pos, best first
+        states = [{} for _ in range(len(chars) + 1)]
+        states[0][(0, 0, 0)] = [(0, (), [])]
+        for s in range(len(chars)):
+            for (singles, n, L), paths in states[s].items():
+                for e, t, (freq, tag) in self.dfs_edges_(chars, s, singles):
+                    key = (min(singles + 1, 3) if len(t) == 1 else 0, n + 1, L + (0 if len(t) < 2 else 1))
+                    nxt = states[e].setdefault(key, [])
+                    nxt.extend([(F + freq, ends + (e,), tks + [t]) for F, ends, tks in paths])
+                    # dfs_ enumerates the paths in the order of their token ends
+                    nxt.sort(key=lambda x: (-x[0], x[1]))
+                    del nxt[topn:]
+
+        res = [(tks, B / n + L / n + F, ends) for (_, n, L), paths in states[len(chars)].items()
+               for F, ends, tks in paths]
+        res.sort(key=lambda x: (-x[1], x[2]))
+        return [(tks, sc) for tks, sc, _ in res[:topn]]
+
     def freq(self, tk):
         k = self.key_(tk)
         if k not in self.trie_:
@@ -312,9 +435,7 @@ class RagTokenizer:
                     j += 1
                     continue
                 # backward tokens from_i to i are different from forward tokens from _j to j.
-                tkslist = []
-                self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+                res.append(" ".join(self.segment_("".join(tks[_j:j]))[0]))
 
                 same = 1
                 while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
@@ -328,9 +449,7 @@ class RagTokenizer:
             if _i < len(tks1):
                 assert _j < len(tks)
                 assert "".join(tks1[_i:]) == "".join(tks[_j:])
-                tkslist = []
-                self.dfs_("".join(tks[_j:]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+                res.append(" ".join(self.segment_("".join(tks[_j:]))[0]))
 
         res = " ".join(self.english_normalize_(res))
         logging.debug("[TKS] {}".format(self.merge_(res)))
@@ -350,15 +469,12 @@ class RagTokenizer:
             if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
                 res.append(tk)
                 continue
-            tkslist = []
-            if len(tk) > 10:
-                tkslist.append(tk)
-            else:
-                self.dfs_(tk, 0, [], tkslist)
+            # the runner-up segmentation, as indexed so far
+            tkslist = self.top_segments_(tk) if len(tk) <= 10 else []
             if len(tkslist) < 2:
                 res.append(tk)
                 continue
-            stk = self.sortTks_(tkslist)[1][0]
+            stk = tkslist[1][0]
             if len(stk) == len(tk):
                 stk = tk
             else:
@@ -13,20 +13,47 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import ast
+import json
 import logging
 import re
 from dataclasses import dataclass
+from functools import lru_cache
 
 from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import rmSpace
 from rag.nlp import rag_tokenizer, query
 import numpy as np
 from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
+from rag.utils.retrieval_cache import RETRIEVAL_CACHE
+from scipy.sparse import csr_matrix
 
 
 def index_name(uid): return f"ragflow_{uid}"
 
 
+@lru_cache(maxsize=4096)
+def _parse_tag_features(txt: str) -> dict:
+    try:
+        fea = ast.literal_eval(txt)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        try:
+            fea = json.loads(txt)
+        except Exception:
+            logging.warning(f"Fail to parse tag features: {txt[:64]}")
+            return {}
+    return fea if isinstance(fea, dict) else {}
+
+
+def parse_tag_features(fea) -> dict:
+    """Tag features of a chunk, as a dict or as its string form returned by the doc store, without eval()."""
+    if isinstance(fea, dict):
+        return fea
+    if not fea:
+        return {}
+    return _parse_tag_features(fea)
+
+
 class Dealer:
     def __init__(self, dataStore: DocStoreConnection):
         self.qryr = query.FulltextQueryer()
@@ -246,7 +273,6 @@ class Dealer:
 
     def _rank_feature_scores(self, query_rfea, search_res):
         ## For rank feature(tag_fea) scores.
-        rank_fea = []
         pageranks = []
         for chunk_id in search_res.ids:
             pageranks.append(search_res.field[chunk_id].get(PAGERANK_FLD, 0))
@@ -256,17 +282,21 @@ class Dealer:
             return np.array([0 for _ in range(len(search_res.ids))]) + pageranks
 
         q_denor = np.sqrt(np.sum([s*s for t,s in query_rfea.items() if t != PAGERANK_FLD]))
-        for i in search_res.ids:
-            nor, denor = 0, 0
-            for t, sc in eval(search_res.field[i].get(TAG_FLD, "{}")).items():
-                if t in query_rfea:
-                    nor += query_rfea[t] * sc
-                denor += sc * sc
-            if denor == 0:
-                rank_fea.append(0)
-            else:
-                rank_fea.append(nor/np.sqrt(denor)/q_denor)
-        return np.array(rank_fea)*10. + pageranks
+        vocab = {t: j for j, t in enumerate(query_rfea.keys())}
+        qvec = np.array([float(s) for s in query_rfea.values()])
+        rows, cols, data = [], [], []
+        denor = np.zeros(len(search_res.ids))
+        for r, i in enumerate(search_res.ids):
+            for t, sc in parse_tag_features(search_res.field[i].get(TAG_FLD)).items():
+                if t in vocab:
+                    rows.append(r)
+                    cols.append(vocab[t])
+                    data.append(float(sc))
+                denor[r] += sc * sc
+        nor = csr_matrix((data, (rows, cols)), shape=(len(search_res.ids), len(vocab))) @ qvec
+        rank_fea = np.zeros(len(search_res.ids))
+        np.divide(nor, np.sqrt(denor) * q_denor, out=rank_fea, where=denor > 0)
+        return rank_fea*10. + pageranks
 
     def rerank(self, sres, query, tkweight=0.3,
                vtweight=0.7, cfield="content_ltks",
@@ -275,15 +305,17 @@ class Dealer:
         _, keywords = self.qryr.question(query)
         vector_size = len(sres.query_vector)
         vector_column = f"q_{vector_size}_vec"
-        zero_vector = [0.0] * vector_size
-        ins_embd = []
-        for chunk_id in sres.ids:
-            vector = sres.field[chunk_id].get(vector_column, zero_vector)
-            if isinstance(vector, str):
-                vector = [float(v) for v in vector.split("\t")]
-            ins_embd.append(vector)
-        if not ins_embd:
+        if not sres.ids:
             return [], [], []
+        # candidates without a vector keep the zero row
+        ins_embd = np.zeros((len(sres.ids), vector_size), dtype=np.float32)
+        for r, chunk_id in enumerate(sres.ids):
+            vector = sres.field[chunk_id].get(vector_column)
+            if vector is None:
+                continue
+            if isinstance(vector, str):
+                vector = vector.split("\t")
+            ins_embd[r] = np.asarray(vector, dtype=np.float32)
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
@@ -344,6 +376,21 @@ class Dealer:
         if not question:
             return ranks
 
+        if isinstance(tenant_ids, str):
+            tenant_ids = tenant_ids.split(",")
+
+        cache_key = RETRIEVAL_CACHE.key(question, kb_ids, tenant_ids=sorted(tenant_ids), page=page,
+                                        page_size=page_size, similarity_threshold=similarity_threshold,
+                                        vector_similarity_weight=vector_similarity_weight, top=top,
+                                        doc_ids=sorted(doc_ids) if doc_ids else doc_ids, aggs=aggs,
+                                        highlight=highlight, rank_feature=rank_feature,
+                                        embd_mdl=getattr(embd_mdl, "llm_name", None),
+                                        rerank_mdl=getattr(rerank_mdl, "llm_name", None))
+        if cache_key:
+            cached = RETRIEVAL_CACHE.get(cache_key)
+            if cached is not None:
+                return cached
+
         RERANK_PAGE_LIMIT = 3
         req = {"kb_ids": kb_ids, "doc_ids": doc_ids, "size": max(page_size * RERANK_PAGE_LIMIT, 128),
                "question": question, "vector": True, "topk": top,
@@ -354,9 +401,6 @@ class Dealer:
             req["page"] = page
             req["size"] = page_size
 
-        if isinstance(tenant_ids, str):
-            tenant_ids = tenant_ids.split(",")
-
         sres = self.search(req, [index_name(tid) for tid in tenant_ids],
                            kb_ids, embd_mdl, highlight, rank_feature=rank_feature)
         ranks["total"] = sres.total
@@ -422,6 +466,8 @@ class Dealer:
                                                                    key=lambda x: x[1]["count"] * -1)]
         ranks["chunks"] = ranks["chunks"][:page_size]
 
+        if cache_key:
+            RETRIEVAL_CACHE.set(cache_key, ranks)
         return ranks
 
     def sql_retrieval(self, sql, fetch_size=128, format="json"):
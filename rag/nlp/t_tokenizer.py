@@ -0,0 +1,160 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Benchmark the DAG segmenter of RagTokenizer against the recursive `dfs_` enumeration it replaced.
+
+    python rag/nlp/t_tokenizer.py <corpus.txt> [--max_lines N]
+
+Every line of the corpus is tokenized and fine-grained tokenized by both implementations.
+The elapsed time of each, the share of lines with identical output, the lines whose tokens are
+fine-grained tokenized differently by the two, and, for every ambiguous span handed to the
+segmenter, whether the DAG segmentation scores better, equal or worse than the enumerated one
+are reported.
+"""
+
+import os
+import re
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+from timeit import default_timer as timer
+
+from rag.nlp.rag_tokenizer import RagTokenizer, is_chinese
+
+
+class DfsRagTokenizer(RagTokenizer):
+    """RagTokenizer segmenting ambiguous spans by enumerating all segmentations with `dfs_`."""
+
+    def segment_(self, chars):
+        tkslist = []
+        self.dfs_(chars, 0, [], tkslist)
+        return self.sortTks_(tkslist)[0]
+
+    def fine_grained_tokenize(self, tks):
+        tks = tks.split()
+        zh_num = len([1 for c in tks if c and is_chinese(c[0])])
+        if zh_num < len(tks) * 0.2:
+            res = []
+            for tk in tks:
+                res.extend(tk.split("/"))
+            return " ".join(res)
+
+        res = []
+        for tk in tks:
+            if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
+                res.append(tk)
+                continue
+            tkslist = []
+            if len(tk) > 10:
+                tkslist.append(tk)
+            else:
+                self.dfs_(tk, 0, [], tkslist)
+            if len(tkslist) < 2:
+                res.append(tk)
+                continue
+            stk = self.sortTks_(tkslist)[1][0]
+            if len(stk) == len(tk):
+                stk = tk
+            else:
+                if re.match(r"[a-z\.-]+$", tk):
+                    for t in stk:
+                        if len(t) < 3:
+                            stk = tk
+                            break
+                    else:
+                        stk = " ".join(stk)
+                else:
+                    stk = " ".join(stk)
+
+            res.append(stk)
+
+        return " ".join(self.english_normalize_(res))
+
+
+class SpanRecordingRagTokenizer(RagTokenizer):
+    """RagTokenizer remembering the spans handed to the segmenter together with the best score found."""
+
+    def __init__(self, debug=False):
+        super().__init__(debug)
+        self.spans = []
+
+    def segment_(self, chars):
+        tks, score = super().segment_(chars)
+        self.spans.append((chars, score))
+        return tks, score
+
+
+def run(tokenizer, lines):
+    outputs = []
+    st = timer()
+    for line in lines:
+        tks = tokenizer.tokenize(line)
+        outputs.append((tks, tokenizer.fine_grained_tokenize(tks)))
+    return outputs, timer() - st
+
+
+def main(args):
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if args.max_lines > 0:
+        lines = lines[:args.max_lines]
+
+    dag_tokenizer = SpanRecordingRagTokenizer()
+    dfs_tokenizer = DfsRagTokenizer()
+    dfs_outputs, dfs_elapsed = run(dfs_tokenizer, lines)
+    dag_outputs, dag_elapsed = run(dag_tokenizer, lines)
+
+    same_tks = len([1 for a, b in zip(dfs_outputs, dag_outputs) if a[0] == b[0]])
+    same_fine = len([1 for a, b in zip(dfs_outputs, dag_outputs) if a[1] == b[1]])
+    print(f"lines: {len(lines)}")
+    print(f"dfs: {dfs_elapsed:.3f}s, dag: {dag_elapsed:.3f}s, speedup: {dfs_elapsed / max(dag_elapsed, 1e-9):.2f}x")
+    print(f"identical tokenize output: {same_tks}/{len(lines)}")
+    print(f"identical fine_grained_tokenize output: {same_fine}/{len(lines)}")
+
+    # the same tokens must be fine-grained tokenized as they were, for new chunks to match the indexed ones
+    fine_diffs = 0
+    for tks, fine in dag_outputs:
+        dfs_fine = dfs_tokenizer.fine_grained_tokenize(tks)
+        if fine != dfs_fine:
+            fine_diffs += 1
+            print(f"fine-grained differs: {tks} dag={fine} dfs={dfs_fine}")
+    print(f"fine_grained_tokenize of the same tokens differs: {fine_diffs}/{len(lines)}")
+
+    better, same, worse = 0, 0, 0
+    for chars, score in dag_tokenizer.spans:
+        _, dfs_score = dfs_tokenizer.segment_(chars)
+        if abs(score - dfs_score) < 1e-9:
+            same += 1
+        elif score > dfs_score:
+            better += 1
+        else:
+            worse += 1
+            print(f"worse: {chars} dag={score} dfs={dfs_score}")
+    print(f"ambiguous spans: {len(dag_tokenizer.spans)}, better: {better}, same: {same}, worse: {worse}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus', help="text file with one CJK sentence or paragraph per line")
+    parser.add_argument('--max_lines', type=int, default=0, help="only benchmark the first lines of the corpus")
+    main(parser.parse_args())
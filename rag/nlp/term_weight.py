@@ -19,13 +19,15 @@ import math
 import json
 import re
 import os
+import threading
 import numpy as np
+from cachetools import LRUCache
 from rag.nlp import rag_tokenizer
 from api.utils.file_utils import get_project_base_directory
 
 
 class Dealer:
-    def __init__(self):
+    def __init__(self, cache_size=int(os.environ.get("TERM_WEIGHT_CACHE_SIZE", 100000))):
         self.stop_words = set(["请问",
                                "您",
                                "你",
@@ -89,6 +91,12 @@ class Dealer:
         except Exception:
             logging.warning("Load term.freq FAIL!")
 
+        # token -> its weight before normalization, which only depends on the dictionaries
+        self.weight_cache = LRUCache(maxsize=cache_size)
+        self.weight_cache_lock = threading.Lock()
+        self.weight_cache_hits = 0
+        self.weight_cache_misses = 0
+
     def pretoken(self, txt, num=False, stpwd=True):
         patt = [
             r"[~—\t @#%!<>,\.\?\":;'\{\}\[\]_=\(\)\|，。？》•●○↓《；‘’：“”【¥ 】…￥！、·（）×`&\\/「」\\]"
@@ -159,86 +167,117 @@ class Dealer:
                 tks.append(t)
         return tks
 
-    def weights(self, tks, preprocess=True):
-        def skill(t):
-            if t not in self.sk:
-                return 1
-            return 6
-
-        def ner(t):
-            if re.match(r"[0-9,.]{2,}$", t):
-                return 2
-            if re.match(r"[a-z]{1,2}$", t):
-                return 0.01
-            if not self.ne or t not in self.ne:
-                return 1
-            m = {"toxic": 2, "func": 1, "corp": 3, "loca": 3, "sch": 3, "stock": 3,
-                 "firstnm": 1}
-            return m[self.ne[t]]
-
-        def postag(t):
-            t = rag_tokenizer.tag(t)
-            if t in set(["r", "c", "d"]):
-                return 0.3
-            if t in set(["ns", "nt"]):
-                return 3
-            if t in set(["n"]):
-                return 2
-            if re.match(r"[0-9-]+", t):
-                return 2
+    def ner_weight(self, t):
+        if re.match(r"[0-9,.]{2,}$", t):
+            return 2
+        if re.match(r"[a-z]{1,2}$", t):
+            return 0.01
+        if not self.ne or t not in self.ne:
             return 1
+        m = {"toxic": 2, "func": 1, "corp": 3, "loca": 3, "sch": 3, "stock": 3,
+             "firstnm": 1}
+        return m[self.ne[t]]
 
-        def freq(t):
-            if re.match(r"[0-9. -]{2,}$", t):
-                return 3
-            s = rag_tokenizer.freq(t)
-            if not s and re.match(r"[a-z. -]+$", t):
-                return 300
-            if not s:
+    def postag_weight(self, t):
+        t = rag_tokenizer.tag(t)
+        if t in set(["r", "c", "d"]):
+            return 0.3
+        if t in set(["ns", "nt"]):
+            return 3
+        if t in set(["n"]):
+            return 2
+        if re.match(r"[0-9-]+", t):
+            return 2
+        return 1
+
+    def freq(self, t):
+        if re.match(r"[0-9. -]{2,}$", t):
+            return 3
+        s = rag_tokenizer.freq(t)
+        if not s and re.match(r"[a-z. -]+$", t):
+            return 300
+        if not s:
+            s = 0
+
+        if not s and len(t) >= 4:
+            s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
+            if len(s) > 1:
+                s = np.min([self.freq(tt) for tt in s]) / 6.
+            else:
                 s = 0
 
-            if not s and len(t) >= 4:
-                s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
-                if len(s) > 1:
-                    s = np.min([freq(tt) for tt in s]) / 6.
-                else:
-                    s = 0
-
-            return max(s, 10)
-
-        def df(t):
-            if re.match(r"[0-9. -]{2,}$", t):
-                return 5
-            if t in self.df:
-                return self.df[t] + 3
-            elif re.match(r"[a-z. -]+$", t):
-                return 300
-            elif len(t) >= 4:
-                s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
-                if len(s) > 1:
-                    return max(3, np.min([df(tt) for tt in s]) / 6.)
+        return max(s, 10)
 
-            return 3
+    def doc_freq(self, t):
+        if re.match(r"[0-9. -]{2,}$", t):
+            return 5
+        if t in self.df:
+            return self.df[t] + 3
+        elif re.match(r"[a-z. -]+$", t):
+            return 300
+        elif len(t) >= 4:
+            s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
+            if len(s) > 1:
+                return max(3, np.min([self.doc_freq(tt) for tt in s]) / 6.)
+
+        return 3
+
+    def token_weight(self, t):
+        """The weight of a token before normalization, memoized in a bounded LRU cache."""
+        with self.weight_cache_lock:
+            w = self.weight_cache.get(t)
+            if w is not None:
+                self.weight_cache_hits += 1
+                return w
+            self.weight_cache_misses += 1
 
         def idf(s, N): return math.log10(10 + ((N - s + 0.5) / (s + 0.5)))
 
+        w = (0.3 * idf(self.freq(t), 10000000) + 0.7 * idf(self.doc_freq(t), 1000000000)) * \
+            self.ner_weight(t) * self.postag_weight(t)
+        with self.weight_cache_lock:
+            self.weight_cache[t] = w
+        return w
+
+    def cache_info(self):
+        """The size and hit rate of the token weight cache."""
+        with self.weight_cache_lock:
+            total = self.weight_cache_hits + self.weight_cache_misses
+            return {
+                "size": self.weight_cache.currsize,
+                "maxsize": self.weight_cache.maxsize,
+                "hits": self.weight_cache_hits,
+                "misses": self.weight_cache_misses,
+                "hit_rate": self.weight_cache_hits / total if total else 0.0,
+            }
+
+    def weights(self, tks, preprocess=True):
         tw = []
         if not preprocess:
-            idf1 = np.array([idf(freq(t), 10000000) for t in tks])
-            idf2 = np.array([idf(df(t), 1000000000) for t in tks])
-            wts = (0.3 * idf1 + 0.7 * idf2) * \
-                np.array([ner(t) * postag(t) for t in tks])
-            wts = [s for s in wts]
-            tw = list(zip(tks, wts))
+            tw = [(t, self.token_weight(t)) for t in tks]
         else:
             for tk in tks:
                 tt = self.tokenMerge(self.pretoken(tk, True))
-                idf1 = np.array([idf(freq(t), 10000000) for t in tt])
-                idf2 = np.array([idf(df(t), 1000000000) for t in tt])
-                wts = (0.3 * idf1 + 0.7 * idf2) * \
-                    np.array([ner(t) * postag(t) for t in tt])
-                wts = [s for s in wts]
-                tw.extend(zip(tt, wts))
+                tw.extend([(t, self.token_weight(t)) for t in tt])
 
         S = np.sum([s for _, s in tw])
         return [(t, s / S) for t, s in tw]
+
+    def weights_batch(self, tkss):
+        """
+        Weight every token list of `tkss` in one pass, like `weights(tks, preprocess=False)` for each of them.
+        The weight of every distinct token is looked up once for the whole batch.
+        """
+        tkss = [tks.split() if isinstance(tks, str) else tks for tks in tkss]
+        vocab = {}
+        for tks in tkss:
+            for t in tks:
+                if t not in vocab:
+                    vocab[t] = len(vocab)
+        vocab_wts = np.array([self.token_weight(t) for t in vocab], dtype=float)
+
+        res = []
+        for tks in tkss:
+            wts = vocab_wts[[vocab[t] for t in tks]] if tks else np.array([], dtype=float)
+            res.append(list(zip(tks, (wts / np.sum(wts)).tolist())))
+        return res
@@ -32,6 +32,10 @@ except Exception:
     REDIS = {}
     pass
 DOC_MAXIMUM_SIZE = int(os.environ.get("MAX_CONTENT_LENGTH", 128 * 1024 * 1024))
+# Keep only the positions of the chunks of pdfs, their images are rendered from the pdf when first requested.
+CHUNK_IMAGE_LAZY = int(os.environ.get("CHUNK_IMAGE_LAZY", "0"))
+# The number of chunk images uploaded to the object storage concurrently by each task executor.
+CHUNK_IMAGE_UPLOAD_WORKERS = int(os.environ.get("CHUNK_IMAGE_UPLOAD_WORKERS", "8"))
 
 SVR_QUEUE_NAME = "rag_flow_svr_queue"
 SVR_QUEUE_RETENTION = 60*60
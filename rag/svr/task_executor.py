@@ -22,7 +22,7 @@ from api.utils.log_utils import initRootLogger
 from graphrag.general.index import WithCommunity, WithResolution, Dealer
 from graphrag.light.graph_extractor import GraphExtractor as LightKGExt
 from graphrag.general.graph_extractor import GraphExtractor as GeneralKGExt
-from graphrag.utils import get_llm_cache, set_llm_cache, get_tags_from_cache, set_tags_to_cache
+from graphrag.utils import get_llm_cache_batch, set_llm_cache_batch, get_tags_from_cache, set_tags_to_cache
 
 CONSUMER_NO = "0" if len(sys.argv) < 2 else sys.argv[1]
 CONSUMER_NAME = "task_executor_" + CONSUMER_NO
@@ -36,7 +36,9 @@ import xxhash
 import copy
 import re
 import time
+import queue
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import partial
 from io import BytesIO
 from multiprocessing.context import TimeoutError
@@ -55,16 +57,27 @@ from api.db.services.file2document_service import File2DocumentService
 from api import settings
 from api.versions import get_ragflow_version
 from api.db.db_models import close_connection
+from deepdoc.vision.ocr import session_pool_stats
 from rag.app import laws, paper, presentation, manual, qa, table, book, resume, picture, naive, one, audio, \
     email, tag
 from rag.nlp import search, rag_tokenizer
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
-from rag.settings import DOC_MAXIMUM_SIZE, SVR_QUEUE_NAME, print_rag_settings, TAG_FLD, PAGERANK_FLD
+from rag.settings import DOC_MAXIMUM_SIZE, SVR_QUEUE_NAME, print_rag_settings, TAG_FLD, PAGERANK_FLD, \
+    CHUNK_IMAGE_UPLOAD_WORKERS
 from rag.utils import num_tokens_from_string
 from rag.utils.redis_conn import REDIS_CONN, Payload
 from rag.utils.storage_factory import STORAGE_IMPL
 
 BATCH_SIZE = 64
+# How many embedded chunk batches may wait for the doc store before embedding blocks.
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', "8"))
+# Ceilings of a single doc store bulk insert, in chunks and in (estimated) bytes.
+DOC_BULK_SIZE = int(os.environ.get('DOC_BULK_SIZE', "128"))
+DOC_BULK_MAX_BYTES = int(os.environ.get('DOC_BULK_MAX_BYTES', str(8 * 1024 * 1024)))
+# Concurrent chat model calls of a tenant while enriching chunks with keywords, questions and tags.
+MAX_CONCURRENT_CHATS = int(os.environ.get('MAX_CONCURRENT_CHATS', "10"))
+# Bulk inserts faster than this grow the bulk size, ones slower than twice of it shrink it.
+DOC_BULK_TARGET_SECONDS = 1.0
 
 FACTORY = {
     "general": naive,
@@ -86,15 +99,20 @@ FACTORY = {
 }
 
 CONSUMER_NAME = "task_consumer_" + CONSUMER_NO
-PAYLOAD: Payload | None = None
 BOOT_AT = datetime.now().astimezone().isoformat(timespec="milliseconds")
 PENDING_TASKS = 0
 LAG_TASKS = 0
+MAX_CONCURRENT_TASKS = max(1, int(os.environ.get('MAX_CONCURRENT_TASKS', "1")))
 
 mt_lock = threading.Lock()
+# tenant id -> semaphore bounding that tenant's chat model calls across concurrent tasks
+TENANT_CHAT_LIMITERS: dict[str, threading.Semaphore] = {}
 DONE_TASKS = 0
 FAILED_TASKS = 0
-CURRENT_TASK = None
+# slot -> task being handled by that slot, None while the slot is idle
+CURRENT_TASKS = {slot: None for slot in range(MAX_CONCURRENT_TASKS)}
+# task id -> the queue message the task was received from
+PAYLOADS: dict[str, Payload] = {}
 
 
 class TaskCanceledException(Exception):
@@ -102,17 +120,23 @@ class TaskCanceledException(Exception):
         self.msg = msg
 
 
+def ack_payload(task_id):
+    with mt_lock:
+        payload = PAYLOADS.pop(task_id, None)
+    if not payload:
+        return False
+    payload.ack()
+    return True
+
+
 def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing..."):
-    global PAYLOAD
     if prog is not None and prog < 0:
         msg = "[ERROR]" + msg
     try:
         cancel = TaskService.do_cancel(task_id)
     except DoesNotExist:
         logging.warning(f"set_progress task {task_id} is unknown")
-        if PAYLOAD:
-            PAYLOAD.ack()
-            PAYLOAD = None
+        ack_payload(task_id)
         return
 
     if cancel:
@@ -134,34 +158,37 @@ def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing...
         TaskService.update_progress(task_id, d)
     except DoesNotExist:
         logging.warning(f"set_progress task {task_id} is unknown")
-        if PAYLOAD:
-            PAYLOAD.ack()
-            PAYLOAD = None
+        ack_payload(task_id)
         return
 
     close_connection()
-    if cancel and PAYLOAD:
-        PAYLOAD.ack()
-        PAYLOAD = None
+    if cancel and ack_payload(task_id):
         raise TaskCanceledException(msg)
 
 
-def collect():
-    global CONSUMER_NAME, PAYLOAD, DONE_TASKS, FAILED_TASKS
+def slot_consumer_name(slot):
+    # Every slot reads the stream as its own consumer so that unacked messages
+    # are recovered by the slot which received them.
+    return CONSUMER_NAME if slot == 0 else f"{CONSUMER_NAME}_{slot}"
+
+
+def collect(slot=0):
+    global DONE_TASKS
+    consumer_name = slot_consumer_name(slot)
     try:
-        PAYLOAD = REDIS_CONN.get_unacked_for(CONSUMER_NAME, SVR_QUEUE_NAME, "rag_flow_svr_task_broker")
-        if not PAYLOAD:
-            PAYLOAD = REDIS_CONN.queue_consumer(SVR_QUEUE_NAME, "rag_flow_svr_task_broker", CONSUMER_NAME)
-        if not PAYLOAD:
+        payload = REDIS_CONN.get_unacked_for(consumer_name, SVR_QUEUE_NAME, "rag_flow_svr_task_broker")
+        if not payload:
+            payload = REDIS_CONN.queue_consumer(SVR_QUEUE_NAME, "rag_flow_svr_task_broker", consumer_name)
+        if not payload:
             time.sleep(1)
-            return None
+            return None, None
     except Exception:
         logging.exception("Get task event from queue exception")
-        return None
+        return None, None
 
-    msg = PAYLOAD.get_message()
+    msg = payload.get_message()
     if not msg:
-        return None
+        return payload, None
 
     task = None
     canceled = False
@@ -179,16 +206,60 @@ def collect():
         with mt_lock:
             DONE_TASKS += 1
         logging.info(f"collect task {msg['id']} {state}")
-        return None
+        return payload, None
 
     task["task_type"] = msg.get("task_type", "")
-    return task
+    return payload, task
 
 
 def get_storage_binary(bucket, name):
     return STORAGE_IMPL.get(bucket, name)
 
 
+def tenant_chat_limiter(tenant_id):
+    with mt_lock:
+        if tenant_id not in TENANT_CHAT_LIMITERS:
+            TENANT_CHAT_LIMITERS[tenant_id] = threading.Semaphore(MAX_CONCURRENT_CHATS)
+        return TENANT_CHAT_LIMITERS[tenant_id]
+
+
+def llm_enrichment(task, chat_mdl, txts, history, genconf, generate, progress_callback, label):
+    """
+    Return the LLM answer of every text in `txts`, in order.
+    Cached answers are read with one MGET, the misses are generated concurrently
+    under the tenant's chat limiter and written back with one pipelined SET.
+    """
+    if not txts:
+        return []
+    answers = get_llm_cache_batch(chat_mdl.llm_name, txts, history, genconf)
+    misses = [i for i, a in enumerate(answers) if not a]
+    progress_callback(msg="{}: {} of {} chunks cached".format(label, len(txts) - len(misses), len(txts)))
+    if not misses:
+        return answers
+
+    limiter = tenant_chat_limiter(task["tenant_id"])
+
+    def generate_one(i):
+        with limiter:
+            return i, generate(txts[i])
+
+    generated = {}
+    report_step = max(len(misses) // 10, 1)
+    exe = ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_CHATS, len(misses)))
+    try:
+        for n, f in enumerate(as_completed([exe.submit(generate_one, i) for i in misses])):
+            i, a = f.result()
+            if a:
+                answers[i] = a
+                generated[txts[i]] = a
+            if (n + 1) % report_step == 0 or n + 1 == len(misses):
+                progress_callback(msg="{}: {}/{} chunks".format(label, len(txts) - len(misses) + n + 1, len(txts)))
+    finally:
+        exe.shutdown(wait=True, cancel_futures=True)
+        set_llm_cache_batch(chat_mdl.llm_name, generated, history, genconf)
+    return answers
+
+
 def build_chunks(task, progress_callback):
     if task["size"] > DOC_MAXIMUM_SIZE:
         set_progress(task["id"], prog=-1, msg="File size exceeds( <= %dMb )" %
@@ -233,54 +304,60 @@ def build_chunks(task, progress_callback):
     }
     if task["pagerank"]:
         doc[PAGERANK_FLD] = int(task["pagerank"])
-    el = 0
-    for ck in cks:
-        d = copy.deepcopy(doc)
-        d.update(ck)
-        d["id"] = xxhash.xxh64((ck["content_with_weight"] + str(d["doc_id"])).encode("utf-8")).hexdigest()
-        d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
-        d["create_timestamp_flt"] = datetime.now().timestamp()
-        if not d.get("image"):
-            _ = d.pop("image", None)
-            d["img_id"] = ""
-            docs.append(d)
-            continue
+    def upload(d, image):
+        output_buffer = BytesIO()
+        if isinstance(image, bytes):
+            output_buffer = BytesIO(image)
+        else:
+            image.save(output_buffer, format='JPEG')
+        STORAGE_IMPL.put(task["kb_id"], d["id"], output_buffer.getvalue())
+
+    st = timer()
+    uploads = []
+    with ThreadPoolExecutor(max_workers=max(CHUNK_IMAGE_UPLOAD_WORKERS, 1)) as exe:
+        for ck in cks:
+            d = copy.deepcopy(doc)
+            d.update(ck)
+            d["id"] = xxhash.xxh64((ck["content_with_weight"] + str(d["doc_id"])).encode("utf-8")).hexdigest()
+            d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
+            d["create_timestamp_flt"] = datetime.now().timestamp()
+            if d.pop("lazy_image", False):
+                # rendered from the pdf and stored on first request, see get_chunk_image
+                _ = d.pop("image", None)
+                d["img_id"] = "{}-{}".format(task["kb_id"], d["id"])
+                d["img_lazy_int"] = 1
+                docs.append(d)
+                continue
+            if not d.get("image"):
+                _ = d.pop("image", None)
+                d["img_id"] = ""
+                docs.append(d)
+                continue
 
-        try:
-            output_buffer = BytesIO()
-            if isinstance(d["image"], bytes):
-                output_buffer = BytesIO(d["image"])
-            else:
-                d["image"].save(output_buffer, format='JPEG')
-
-            st = timer()
-            STORAGE_IMPL.put(task["kb_id"], d["id"], output_buffer.getvalue())
-            el += timer() - st
-        except Exception:
-            logging.exception(
-                "Saving image of chunk {}/{}/{} got exception".format(task["location"], task["name"], d["id"]))
-            raise
+            uploads.append((d, exe.submit(upload, d, d.pop("image"))))
+            d["img_id"] = "{}-{}".format(task["kb_id"], d["id"])
+            # the chunker's dict shares the image, drop it so it is freed once uploaded
+            ck.pop("image", None)
+            docs.append(d)
 
-        d["img_id"] = "{}-{}".format(task["kb_id"], d["id"])
-        del d["image"]
-        docs.append(d)
-    logging.info("MINIO PUT({}):{}".format(task["name"], el))
+        for d, f in uploads:
+            try:
+                f.result()
+            except Exception:
+                logging.exception(
+                    "Saving image of chunk {}/{}/{} got exception".format(task["location"], task["name"], d["id"]))
+                raise
+    logging.info("MINIO PUT({}) {} images:{}".format(task["name"], len(uploads), timer() - st))
 
     if task["parser_config"].get("auto_keywords", 0):
         st = timer()
         progress_callback(msg="Start to generate keywords for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-        for d in docs:
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "keywords",
-                                   {"topn": task["parser_config"]["auto_keywords"]})
-            if not cached:
-                cached = keyword_extraction(chat_mdl, d["content_with_weight"],
-                                            task["parser_config"]["auto_keywords"])
-                if cached:
-                    set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "keywords",
-                                  {"topn": task["parser_config"]["auto_keywords"]})
-
-            d["important_kwd"] = cached.split(",")
+        topn = task["parser_config"]["auto_keywords"]
+        answers = llm_enrichment(task, chat_mdl, [d["content_with_weight"] for d in docs], "keywords", {"topn": topn},
+                                 lambda txt: keyword_extraction(chat_mdl, txt, topn), progress_callback, "Keywords")
+        for d, cached in zip(docs, answers):
+            d["important_kwd"] = (cached or "").split(",")
             d["important_tks"] = rag_tokenizer.tokenize(" ".join(d["important_kwd"]))
         progress_callback(msg="Keywords generation completed in {:.2f}s".format(timer() - st))
 
@@ -288,16 +365,11 @@ def build_chunks(task, progress_callback):
         st = timer()
         progress_callback(msg="Start to generate questions for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-        for d in docs:
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "question",
-                                   {"topn": task["parser_config"]["auto_questions"]})
-            if not cached:
-                cached = question_proposal(chat_mdl, d["content_with_weight"], task["parser_config"]["auto_questions"])
-                if cached:
-                    set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "question",
-                                  {"topn": task["parser_config"]["auto_questions"]})
-
-            d["question_kwd"] = cached.split("\n")
+        topn = task["parser_config"]["auto_questions"]
+        answers = llm_enrichment(task, chat_mdl, [d["content_with_weight"] for d in docs], "question", {"topn": topn},
+                                 lambda txt: question_proposal(chat_mdl, txt, topn), progress_callback, "Questions")
+        for d, cached in zip(docs, answers):
+            d["question_kwd"] = (cached or "").split("\n")
             d["question_tks"] = rag_tokenizer.tokenize("\n".join(d["question_kwd"]))
         progress_callback(msg="Question generation completed in {:.2f}s".format(timer() - st))
 
@@ -317,19 +389,23 @@ def build_chunks(task, progress_callback):
             all_tags = json.loads(all_tags)
 
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
+        docs_to_tag = []
         for d in docs:
             if settings.retrievaler.tag_content(tenant_id, kb_ids, d, all_tags, topn_tags=topn_tags, S=S):
                 examples.append({"content": d["content_with_weight"], TAG_FLD: d[TAG_FLD]})
                 continue
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], all_tags, {"topn": topn_tags})
-            if not cached:
-                cached = content_tagging(chat_mdl, d["content_with_weight"], all_tags,
-                                         random.choices(examples, k=2) if len(examples)>2 else examples,
-                                         topn=topn_tags)
-                if cached:
-                    cached = json.dumps(cached)
+            docs_to_tag.append(d)
+
+        def tagging(txt):
+            tags = content_tagging(chat_mdl, txt, all_tags,
+                                   random.choices(examples, k=2) if len(examples) > 2 else examples,
+                                   topn=topn_tags)
+            return json.dumps(tags) if tags else None
+
+        answers = llm_enrichment(task, chat_mdl, [d["content_with_weight"] for d in docs_to_tag], all_tags,
+                                 {"topn": topn_tags}, tagging, progress_callback, "Tagging")
+        for d, cached in zip(docs_to_tag, answers):
             if cached:
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, all_tags, {"topn": topn_tags})
                 d[TAG_FLD] = json.loads(cached)
 
         progress_callback(msg="Tagging completed in {:.2f}s".format(timer() - st))
@@ -342,49 +418,148 @@ def init_kb(row, vector_size: int):
     return settings.docStoreConn.createIdx(idxnm, row.get("kb_id", ""), vector_size)
 
 
-def embedding(docs, mdl, parser_config=None, callback=None):
+def embedding_batches(docs, mdl, parser_config=None, batch_size=16):
+    """
+    Embed `docs` batch by batch and yield `(batch, token_count, vector_size)` as soon as
+    the vectors of a batch are set, so that the batch can be indexed while the next one is embedded.
+    """
     if parser_config is None:
         parser_config = {}
-    batch_size = 16
-    tts, cnts = [], []
-    for d in docs:
-        tts.append(d.get("docnm_kwd", "Title"))
-        c = "\n".join(d.get("question_kwd", []))
-        if not c:
-            c = d["content_with_weight"]
-        c = re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", c)
-        if not c:
-            c = "None"
-        cnts.append(c)
-
-    tk_count = 0
-    if len(tts) == len(cnts):
-        vts, c = mdl.encode(tts[0: 1])
-        tts = np.concatenate([vts for _ in range(len(tts))], axis=0)
+    if not docs:
+        return
+    title_w = float(parser_config.get("filename_embd_weight", 0.1))
+    tts, tk_count = mdl.encode([docs[0].get("docnm_kwd", "Title")])
+    for i in range(0, len(docs), batch_size):
+        batch = docs[i: i + batch_size]
+        cnts = []
+        for d in batch:
+            c = "\n".join(d.get("question_kwd", []))
+            if not c:
+                c = d["content_with_weight"]
+            c = re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", c)
+            if not c:
+                c = "None"
+            cnts.append(c)
+        vts, c = mdl.encode(cnts)
         tk_count += c
+        vects = title_w * tts + (1 - title_w) * vts
+        assert len(vects) == len(batch)
+        vector_size = 0
+        for d, v in zip(batch, vects):
+            v = v.tolist()
+            vector_size = len(v)
+            d["q_%d_vec" % len(v)] = v
+        yield batch, tk_count, vector_size
+        tk_count = 0
+
+
+def prefetch(iterable, maxsize=PIPELINE_QUEUE_SIZE):
+    """
+    Drive `iterable` on a background thread and yield its items through a bounded queue,
+    so the producer runs at most `maxsize` items ahead of the consumer.
+    Exceptions raised by the producer are re-raised in the consumer.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
 
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), batch_size):
-        vts, c = mdl.encode(cnts[i: i + batch_size])
-        if len(cnts_) == 0:
-            cnts_ = vts
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, e = q.get()
+            if e is not None:
+                raise e
+            if item is done:
+                break
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def estimate_chunk_bytes(chunk):
+    size = 0
+    for v in chunk.values():
+        if isinstance(v, str):
+            size += len(v)
+        elif isinstance(v, list):
+            # vectors and keyword lists
+            size += 20 * len(v)
         else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
-        tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
-
-    title_w = float(parser_config.get("filename_embd_weight", 0.1))
-    vects = (title_w * tts + (1 - title_w) *
-             cnts) if len(tts) == len(cnts) else cnts
-
-    assert len(vects) == len(docs)
-    vector_size = 0
-    for i, d in enumerate(docs):
-        v = vects[i].tolist()
-        vector_size = len(v)
-        d["q_%d_vec" % len(v)] = v
-    return tk_count, vector_size
+            size += 16
+    return size
+
+
+def index_chunks(task, chunk_batches, chunk_total, progress_callback):
+    """
+    Insert chunk batches into the doc store as they arrive.
+    The bulk size adapts to the payload size and to the doc store latency, bounded by
+    DOC_BULK_SIZE and DOC_BULK_MAX_BYTES, and the ids of every bulk are appended to the task.
+    Returns the ids of the inserted chunks, or None if the task disappeared meanwhile.
+    """
+    index_name = search.index_name(task["tenant_id"])
+    chunk_ids = []
+    bulk, bulk_bytes = [], 0
+    bulk_size = min(16, DOC_BULK_SIZE)
+    TaskService.update_chunk_ids(task["id"], "")
+
+    def flush():
+        nonlocal bulk, bulk_bytes, bulk_size
+        progress_callback(prog=0.7 + 0.2 * (len(chunk_ids) + 1) / chunk_total, msg="")
+        st = timer()
+        doc_store_result = settings.docStoreConn.insert(bulk, index_name, task["kb_id"])
+        elapsed = timer() - st
+        if doc_store_result:
+            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
+            progress_callback(-1, msg=error_message)
+            raise Exception(error_message)
+        bulk_ids = [chunk["id"] for chunk in bulk]
+        chunk_ids.extend(bulk_ids)
+        try:
+            task_exists = TaskService.append_chunk_ids(task["id"], " ".join(bulk_ids)) > 0
+        except DoesNotExist:
+            task_exists = False
+        if not task_exists:
+            logging.warning(f"do_handle_task update_chunk_ids failed since task {task['id']} is unknown.")
+            settings.docStoreConn.delete({"id": chunk_ids}, index_name, task["kb_id"])
+            return False
+
+        if elapsed < DOC_BULK_TARGET_SECONDS and len(bulk) >= bulk_size:
+            bulk_size = min(bulk_size * 2, DOC_BULK_SIZE)
+        elif elapsed > 2 * DOC_BULK_TARGET_SECONDS:
+            bulk_size = max(bulk_size // 2, 1)
+        logging.debug(f"Inserted {len(bulk)} chunks ({bulk_bytes} bytes) in {elapsed:.2f}s, next bulk size {bulk_size}")
+        bulk, bulk_bytes = [], 0
+        return True
+
+    for chunks in chunk_batches:
+        for chunk in chunks:
+            bulk.append(chunk)
+            bulk_bytes += estimate_chunk_bytes(chunk)
+            if (len(bulk) >= bulk_size or bulk_bytes >= DOC_BULK_MAX_BYTES) and not flush():
+                return None
+    if bulk and not flush():
+        return None
+    return chunk_ids
 
 
 def run_raptor(row, chat_mdl, embd_mdl, vector_size, callback=None):
@@ -566,41 +741,42 @@ def do_handle_task(task):
         # TODO: exception handler
         ## set_progress(task["did"], -1, "ERROR: ")
         progress_callback(msg="Generate {} chunks".format(len(chunks)))
-        start_ts = timer()
-        try:
-            token_count, vector_size = embedding(chunks, embedding_model, task_parser_config, progress_callback)
-        except Exception as e:
-            error_message = "Generate embedding error:{}".format(str(e))
-            progress_callback(-1, error_message)
-            logging.exception(error_message)
-            token_count = 0
-            raise
-        progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
-        logging.info(progress_message)
-        progress_callback(msg=progress_message)
 
     chunk_count = len(set([chunk["id"] for chunk in chunks]))
     start_ts = timer()
-    doc_store_result = ""
-    es_bulk_size = 4
-    for b in range(0, len(chunks), es_bulk_size):
-        doc_store_result = settings.docStoreConn.insert(chunks[b:b + es_bulk_size], search.index_name(task_tenant_id),
-                                                        task_dataset_id)
-        if b % 128 == 0:
-            progress_callback(prog=0.8 + 0.1 * (b + 1) / len(chunks), msg="")
-        if doc_store_result:
-            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
-            progress_callback(-1, msg=error_message)
-            raise Exception(error_message)
-        chunk_ids = [chunk["id"] for chunk in chunks[:b + es_bulk_size]]
-        chunk_ids_str = " ".join(chunk_ids)
-        try:
-            TaskService.update_chunk_ids(task["id"], chunk_ids_str)
-        except DoesNotExist:
-            logging.warning(f"do_handle_task update_chunk_ids failed since task {task['id']} is unknown.")
-            doc_store_result = settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id),
-                                                            task_dataset_id)
-            return
+    if task.get("task_type", "") == "raptor":
+        # RAPTOR chunks come with their vectors already
+        chunk_batches = [chunks]
+    else:
+        # Embedding runs on a background thread, one bounded queue ahead of indexing.
+        token_count = 0
+        embedding_elapsed = 0
+
+        def embedded_batches():
+            nonlocal token_count, embedding_elapsed
+            try:
+                st = timer()
+                for batch, c, _ in embedding_batches(chunks, embedding_model, task_parser_config):
+                    token_count += c
+                    embedding_elapsed += timer() - st
+                    yield batch
+                    st = timer()
+            except TaskCanceledException:
+                raise
+            except Exception as e:
+                error_message = "Generate embedding error:{}".format(str(e))
+                progress_callback(-1, error_message)
+                logging.exception(error_message)
+                raise
+
+        chunk_batches = prefetch(embedded_batches())
+    chunk_ids = index_chunks(task, chunk_batches, len(chunks), progress_callback)
+    if chunk_ids is None:
+        return
+    if task.get("task_type", "") != "raptor":
+        progress_message = "Embedding chunks ({:.2f}s)".format(embedding_elapsed)
+        logging.info(progress_message)
+        progress_callback(msg=progress_message)
     logging.info("Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(task_document_name, task_from_page,
                                                                                      task_to_page, len(chunks),
                                                                                      timer() - start_ts))
@@ -615,23 +791,24 @@ def do_handle_task(task):
                                                                                    token_count, time_cost))
 
 
-def handle_task():
-    global PAYLOAD, mt_lock, DONE_TASKS, FAILED_TASKS, CURRENT_TASK
-    task = collect()
+def handle_task(slot=0):
+    global mt_lock, DONE_TASKS, FAILED_TASKS
+    payload, task = collect(slot)
     if task:
+        with mt_lock:
+            PAYLOADS[task["id"]] = payload
+            CURRENT_TASKS[slot] = copy.deepcopy(task)
         try:
             logging.info(f"handle_task begin for task {json.dumps(task)}")
-            with mt_lock:
-                CURRENT_TASK = copy.deepcopy(task)
             do_handle_task(task)
             with mt_lock:
                 DONE_TASKS += 1
-                CURRENT_TASK = None
+                CURRENT_TASKS[slot] = None
             logging.info(f"handle_task done for task {json.dumps(task)}")
         except TaskCanceledException:
             with mt_lock:
                 DONE_TASKS += 1
-                CURRENT_TASK = None
+                CURRENT_TASKS[slot] = None
             try:
                 set_progress(task["id"], prog=-1, msg="handle_task got TaskCanceledException")
             except Exception:
@@ -640,19 +817,25 @@ def handle_task():
         except Exception as e:
             with mt_lock:
                 FAILED_TASKS += 1
-                CURRENT_TASK = None
+                CURRENT_TASKS[slot] = None
             try:
                 set_progress(task["id"], prog=-1, msg=f"[Exception]: {e}")
             except Exception:
                 pass
             logging.exception(f"handle_task got exception for task {json.dumps(task)}")
-    if PAYLOAD:
-        PAYLOAD.ack()
-        PAYLOAD = None
+        with mt_lock:
+            payload = PAYLOADS.pop(task["id"], None)
+    if payload:
+        payload.ack()
+
+
+def task_worker(slot):
+    while True:
+        handle_task(slot)
 
 
 def report_status():
-    global CONSUMER_NAME, BOOT_AT, PENDING_TASKS, LAG_TASKS, mt_lock, DONE_TASKS, FAILED_TASKS, CURRENT_TASK
+    global CONSUMER_NAME, BOOT_AT, PENDING_TASKS, LAG_TASKS, mt_lock, DONE_TASKS, FAILED_TASKS
     REDIS_CONN.sadd("TASKEXE", CONSUMER_NAME)
     while True:
         try:
@@ -671,7 +854,9 @@ def report_status():
                     "lag": LAG_TASKS,
                     "done": DONE_TASKS,
                     "failed": FAILED_TASKS,
-                    "current": CURRENT_TASK,
+                    "slots": MAX_CONCURRENT_TASKS,
+                    "current": {slot: task for slot, task in CURRENT_TASKS.items() if task},
+                    "models": session_pool_stats(),
                 })
             REDIS_CONN.zadd(CONSUMER_NAME, heartbeat, now.timestamp())
             logging.info(f"{CONSUMER_NAME} reported heartbeat: {heartbeat}")
@@ -712,10 +897,17 @@ def main():
     logging.info(f'TaskExecutor: RAGFlow version: {get_ragflow_version()}')
     settings.init_settings()
     print_rag_settings()
+    logging.info(f"MAX_CONCURRENT_TASKS: {MAX_CONCURRENT_TASKS}")
     background_thread = threading.Thread(target=report_status)
     background_thread.daemon = True
     background_thread.start()
 
+    # Slot 0 runs on the main thread, the others share the loaded models from worker threads.
+    for slot in range(1, MAX_CONCURRENT_TASKS):
+        worker_thread = threading.Thread(target=task_worker, args=(slot,), name=f"task_worker_{slot}")
+        worker_thread.daemon = True
+        worker_thread.start()
+
     TRACE_MALLOC_DELTA = int(os.environ.get('TRACE_MALLOC_DELTA', "0"))
     TRACE_MALLOC_FULL = int(os.environ.get('TRACE_MALLOC_FULL', "0"))
     if TRACE_MALLOC_DELTA > 0:
@@ -723,12 +915,14 @@ def main():
             TRACE_MALLOC_FULL = TRACE_MALLOC_DELTA
         tracemalloc.start()
         snapshot1 = tracemalloc.take_snapshot()
+    last_snapshot_id = 0
     while True:
-        handle_task()
+        handle_task(0)
         num_tasks = DONE_TASKS + FAILED_TASKS
-        if TRACE_MALLOC_DELTA > 0 and num_tasks > 0 and num_tasks % TRACE_MALLOC_DELTA == 0:
+        if TRACE_MALLOC_DELTA > 0 and num_tasks // TRACE_MALLOC_DELTA > last_snapshot_id:
+            last_snapshot_id = num_tasks // TRACE_MALLOC_DELTA
             snapshot2 = tracemalloc.take_snapshot()
-            analyze_heap(snapshot1, snapshot2, int(num_tasks / TRACE_MALLOC_DELTA), num_tasks % TRACE_MALLOC_FULL == 0)
+            analyze_heap(snapshot1, snapshot2, last_snapshot_id, last_snapshot_id * TRACE_MALLOC_DELTA % TRACE_MALLOC_FULL == 0)
             snapshot1 = snapshot2
             snapshot2 = None
 
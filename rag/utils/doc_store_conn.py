@@ -229,6 +229,13 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    @abstractmethod
+    def bulk_update(self, id2value: dict[str, dict], indexName: str, knowledgebaseId: str) -> list[str]:
+        """
+        Update rows by id, every row with its own new values, return the errors
+        """
+        raise NotImplementedError("Not implemented")
+
     @abstractmethod
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         """
@@ -0,0 +1,93 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import threading
+from collections import defaultdict
+
+import numpy as np
+import xxhash
+from cachetools import LRUCache
+
+from rag.utils.redis_conn import REDIS_CONN
+
+# Embeddings kept in process, 0 disables the in-process layer.
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "4096"))
+# Seconds an embedding is kept in Redis, 0 disables the Redis layer.
+EMBEDDING_CACHE_TTL = int(os.environ.get("EMBEDDING_CACHE_TTL", str(24 * 3600)))
+
+
+class EmbedCache:
+    """
+    Embeddings of texts, namespaced per model, kept as float32 in a local LRU in front of Redis.
+    Vectors are stored in Redis as raw float32 bytes, a quarter of their JSON size.
+    """
+
+    def __init__(self, size=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL):
+        self.ttl = ttl
+        self.lru = LRUCache(maxsize=size) if size > 0 else None
+        self.lock = threading.Lock()
+        self.counters = defaultdict(lambda: {"hits": 0, "redis_hits": 0, "misses": 0})
+
+    @staticmethod
+    def key(namespace, txt):
+        return f"embd:{namespace}:{xxhash.xxh128(txt.encode('utf-8')).hexdigest()}"
+
+    def get_many(self, namespace, txts):
+        """The cached vector of every text, None for the texts that are not cached."""
+        keys = [self.key(namespace, t) for t in txts]
+        vects = [None] * len(keys)
+        if self.lru is not None:
+            with self.lock:
+                for i, k in enumerate(keys):
+                    vects[i] = self.lru.get(k)
+        local_hits = len([1 for v in vects if v is not None])
+
+        missing = [i for i, v in enumerate(vects) if v is None]
+        if missing and self.ttl > 0:
+            bins = REDIS_CONN.mget_bytes([keys[i] for i in missing]) or [None] * len(missing)
+            found = {}
+            for i, bin in zip(missing, bins):
+                if bin:
+                    vects[i] = np.frombuffer(bin, dtype=np.float32)
+                    found[keys[i]] = vects[i]
+            if found and self.lru is not None:
+                with self.lock:
+                    self.lru.update(found)
+
+        misses = len([1 for v in vects if v is None])
+        with self.lock:
+            counter = self.counters[namespace]
+            counter["hits"] += local_hits
+            counter["redis_hits"] += len(vects) - local_hits - misses
+            counter["misses"] += misses
+        return vects
+
+    def set_many(self, namespace, txt2vect):
+        if not txt2vect:
+            return
+        vects = {self.key(namespace, t): np.asarray(v, dtype=np.float32).ravel() for t, v in txt2vect.items()}
+        if self.lru is not None:
+            with self.lock:
+                self.lru.update(vects)
+        if self.ttl > 0 and REDIS_CONN.is_alive():
+            REDIS_CONN.mset({k: v.tobytes() for k, v in vects.items()}, self.ttl)
+
+    def stats(self):
+        with self.lock:
+            return {ns: dict(c) for ns, c in self.counters.items()}
+
+
+EMBED_CACHE = EmbedCache()
@@ -28,6 +28,7 @@ from rag import settings
 from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import singleton
 from api.utils.file_utils import get_project_base_directory
+from rag.utils.retrieval_cache import bumps_kb_generation
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
     FusionExpr
 from rag.nlp import is_english, rag_tokenizer
@@ -102,6 +103,7 @@ class ESConnection(DocStoreConnection):
         except Exception:
             logger.exception("ESConnection.createIndex error %s" % (indexName))
 
+    @bumps_kb_generation
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         if len(knowledgebaseId) > 0:
             # The index need to be alive after any kb deletion since all kb under this tenant are in one index.
@@ -277,6 +279,7 @@ class ESConnection(DocStoreConnection):
         logger.error("ESConnection.get timeout for 3 times!")
         raise Exception("ESConnection.get timeout.")
 
+    @bumps_kb_generation
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-bulk.html
         operations = []
@@ -313,6 +316,7 @@ class ESConnection(DocStoreConnection):
                     continue
         return res
 
+    @bumps_kb_generation
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -396,6 +400,39 @@ class ESConnection(DocStoreConnection):
                 break
         return False
 
+    @bumps_kb_generation
+    def bulk_update(self, id2value: dict[str, dict], indexName: str, knowledgebaseId: str) -> list[str]:
+        operations = []
+        for chunkId, newValue in id2value.items():
+            doc = copy.deepcopy(newValue)
+            doc.pop("id", None)
+            operations.append({"update": {"_index": indexName, "_id": chunkId}})
+            operations.append({"doc": doc})
+        if not operations:
+            return []
+
+        res = []
+        for _ in range(ATTEMPT_TIME):
+            try:
+                res = []
+                r = self.es.bulk(index=indexName, operations=operations, refresh=False, timeout="60s")
+                if re.search(r"False", str(r["errors"]), re.IGNORECASE):
+                    return res
+
+                for item in r["items"]:
+                    if "error" in item.get("update", {}):
+                        res.append(str(item["update"]["_id"]) + ":" + str(item["update"]["error"]))
+                return res
+            except Exception as e:
+                res.append(str(e))
+                logger.warning("ESConnection.bulk_update got exception: " + str(e))
+                if re.search(r"(Timeout|time out)", str(e), re.IGNORECASE):
+                    time.sleep(3)
+                    continue
+                break
+        return res
+
+    @bumps_kb_generation
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         qry = None
         assert "_id" not in condition
@@ -32,6 +32,7 @@ import polars as pl
 from polars.series.series import Series
 from api.utils.file_utils import get_project_base_directory
 
+from rag.utils.retrieval_cache import bumps_kb_generation
 from rag.utils.doc_store_conn import (
     DocStoreConnection,
     MatchExpr,
@@ -245,6 +246,7 @@ class InfinityConnection(DocStoreConnection):
             f"INFINITY created table {table_name}, vector size {vectorSize}"
         )
 
+    @bumps_kb_generation
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         table_name = f"{indexName}_{knowledgebaseId}"
         inf_conn = self.connPool.get_conn()
@@ -441,6 +443,7 @@ class InfinityConnection(DocStoreConnection):
         res_fields = self.getFields(res, res.columns)
         return res_fields.get(chunkId, None)
 
+    @bumps_kb_generation
     def insert(
             self, documents: list[dict], indexName: str, knowledgebaseId: str = None
     ) -> list[str]:
@@ -511,6 +514,7 @@ class InfinityConnection(DocStoreConnection):
         logger.debug(f"INFINITY inserted into {table_name} {str_ids}.")
         return []
 
+    @bumps_kb_generation
     def update(
             self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str
     ) -> bool:
@@ -551,6 +555,24 @@ class InfinityConnection(DocStoreConnection):
         self.connPool.release_conn(inf_conn)
         return True
 
+    @bumps_kb_generation
+    def bulk_update(self, id2value: dict[str, dict], indexName: str, knowledgebaseId: str) -> list[str]:
+        inf_conn = self.connPool.get_conn()
+        db_instance = inf_conn.get_database(self.dbName)
+        table_name = f"{indexName}_{knowledgebaseId}"
+        table_instance = db_instance.get_table(table_name)
+        res = []
+        for chunkId, newValue in id2value.items():
+            newValue = {k: v for k, v in newValue.items() if k != "id"}
+            try:
+                table_instance.update(f"id='{chunkId}'", newValue)
+            except Exception as e:
+                res.append(f"{chunkId}:{e}")
+        logger.debug(f"INFINITY bulk updated {len(id2value)} rows of table {table_name}.")
+        self.connPool.release_conn(inf_conn)
+        return res
+
+    @bumps_kb_generation
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
@@ -0,0 +1,132 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import base64
+import json
+import logging
+import os
+import tempfile
+import zlib
+from io import BytesIO
+
+import numpy as np
+import xxhash
+from PIL import Image
+
+from api.utils.file_utils import get_project_base_directory
+
+# Where parse results are cached: "storage" (the object storage of the documents), "disk" or "" (default) for nowhere.
+PARSE_CACHE_BACKEND = os.environ.get("PARSE_CACHE", "").lower()
+# The directory of the "disk" cache.
+PARSE_CACHE_DIR = os.environ.get("PARSE_CACHE_DIR", os.path.join(get_project_base_directory(), "parse_cache"))
+PARSE_CACHE_BUCKET = "ragflow-parse-cache"
+# Bumped whenever a parser changes what it returns for the same input, so that older results are not reused.
+PARSE_CACHE_VERSION = 1
+
+
+def _encode(o):
+    if isinstance(o, Image.Image):
+        buf = BytesIO()
+        o.save(buf, format="PNG")
+        return {"__image__": base64.b64encode(buf.getvalue()).decode("ascii")}
+    if isinstance(o, tuple):
+        return {"__tuple__": [_encode(v) for v in o]}
+    if isinstance(o, list):
+        return [_encode(v) for v in o]
+    if isinstance(o, dict):
+        return {k: _encode(v) for k, v in o.items()}
+    if isinstance(o, np.generic):
+        return o.item()
+    return o
+
+
+def _decode(o):
+    if "__image__" in o:
+        img = Image.open(BytesIO(base64.b64decode(o["__image__"])))
+        img.load()
+        return img
+    if "__tuple__" in o:
+        return tuple(o["__tuple__"])
+    return o
+
+
+class ParseCache:
+    """
+    Results of the document parsers, addressed by the content of the document and the arguments of the parser.
+    They hold the sections and tables, images included, before they are merged into chunks, so that changing the
+    chunking, keywords or embedding settings of a knowledge base does not parse its documents again.
+    """
+
+    def __init__(self, backend=PARSE_CACHE_BACKEND, directory=PARSE_CACHE_DIR):
+        self.backend = backend
+        self.directory = directory
+
+    @property
+    def enabled(self):
+        return self.backend in ("storage", "disk")
+
+    @staticmethod
+    def key(binary, parser, params):
+        """`content hash/parser and params hash`, so that all the results of a document share a prefix."""
+        params = json.dumps({"parser": parser, "params": params, "version": PARSE_CACHE_VERSION},
+                            sort_keys=True, ensure_ascii=False, default=str)
+        return f"{xxhash.xxh128(binary).hexdigest()}/{xxhash.xxh64(params.encode('utf-8')).hexdigest()}"
+
+    def _read(self, key):
+        if self.backend == "disk":
+            path = os.path.join(self.directory, key)
+            if not os.path.exists(path):
+                return
+            with open(path, "rb") as f:
+                return f.read()
+        from rag.utils.storage_factory import STORAGE_IMPL
+        if not STORAGE_IMPL.obj_exist(PARSE_CACHE_BUCKET, key):
+            return
+        return STORAGE_IMPL.get(PARSE_CACHE_BUCKET, key)
+
+    def _write(self, key, binary):
+        if self.backend == "disk":
+            path = os.path.join(self.directory, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(binary)
+            os.replace(tmp, path)
+            return
+        from rag.utils.storage_factory import STORAGE_IMPL
+        STORAGE_IMPL.put(PARSE_CACHE_BUCKET, key, binary)
+
+    def get(self, key):
+        """The cached result, None if there is none or it can not be read."""
+        if not self.enabled:
+            return
+        try:
+            binary = self._read(key)
+            if not binary:
+                return
+            return json.loads(zlib.decompress(binary).decode("utf-8"), object_hook=_decode)
+        except Exception:
+            logging.exception(f"ParseCache get {key} got exception")
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        try:
+            self._write(key, zlib.compress(json.dumps(_encode(value), ensure_ascii=False).encode("utf-8")))
+        except Exception:
+            logging.exception(f"ParseCache set {key} got exception")
+
+
+PARSE_CACHE = ParseCache()
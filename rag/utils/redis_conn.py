@@ -16,6 +16,8 @@
 
 import logging
 import json
+import random
+import threading
 import time
 import uuid
 
@@ -48,18 +50,21 @@ class Payload:
 class RedisDB:
     def __init__(self):
         self.REDIS = None
+        self.REDIS_BYTES = None
         self.config = settings.REDIS
         self.__open__()
 
     def __open__(self):
         try:
-            self.REDIS = redis.StrictRedis(
-                host=self.config["host"].split(":")[0],
-                port=int(self.config.get("host", ":6379").split(":")[1]),
-                db=int(self.config.get("db", 1)),
-                password=self.config.get("password"),
-                decode_responses=True,
-            )
+            conn_args = {
+                "host": self.config["host"].split(":")[0],
+                "port": int(self.config.get("host", ":6379").split(":")[1]),
+                "db": int(self.config.get("db", 1)),
+                "password": self.config.get("password"),
+            }
+            self.REDIS = redis.StrictRedis(**conn_args, decode_responses=True)
+            # Binary values, e.g. float32 embeddings, can not go through the decoding client.
+            self.REDIS_BYTES = redis.StrictRedis(**conn_args, decode_responses=False)
         except Exception:
             logging.warning("Redis can't be connected.")
         return self.REDIS
@@ -93,6 +98,37 @@ class RedisDB:
             logging.warning("RedisDB.get " + str(k) + " got exception: " + str(e))
             self.__open__()
 
+    def mget(self, keys: list[str]):
+        if not self.REDIS:
+            return
+        try:
+            return self.REDIS.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget " + str(len(keys)) + " keys got exception: " + str(e))
+            self.__open__()
+
+    def mget_bytes(self, keys: list[str]):
+        if not self.REDIS_BYTES:
+            return
+        try:
+            return self.REDIS_BYTES.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget_bytes " + str(len(keys)) + " keys got exception: " + str(e))
+            self.__open__()
+
+    def mset(self, mapping: dict, exp=3600):
+        """Set every key of `mapping` with the same expiration, in one pipelined round trip."""
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipeline.set(k, v, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mset " + str(len(mapping)) + " keys got exception: " + str(e))
+            self.__open__()
+        return False
+
     def set_obj(self, k, obj, exp=3600):
         try:
             self.REDIS.set(k, json.dumps(obj, ensure_ascii=False), exp)
@@ -111,6 +147,15 @@ class RedisDB:
             self.__open__()
         return False
 
+    def incr(self, key: str):
+        if not self.REDIS:
+            return
+        try:
+            return self.REDIS.incr(key)
+        except Exception as e:
+            logging.warning("RedisDB.incr " + str(key) + " got exception: " + str(e))
+            self.__open__()
+
     def sadd(self, key: str, member: str):
         try:
             self.REDIS.sadd(key, member)
@@ -283,10 +328,37 @@ REDIS_CONN = RedisDB()
 
 
 class RedisDistributedLock:
-    def __init__(self, lock_key, timeout=10):
+    """
+    A lock held for `lease` seconds at a time and renewed in the background while it is held, so that the lock of a
+    crashed holder is free again once its lease expires. Every acquisition gets a fencing token, greater than those of
+    all the holders before it, for the writes made under the lock to be refused once a later holder has written.
+    """
+    # Set the lock and draw the next fencing token, only if it is free.
+    _ACQUIRE = """
+    if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+        return redis.call('incr', KEYS[2])
+    end
+    return 0
+    """
+    # Extend, or delete when ARGV[2] is 0, the lock only if it is still held by ARGV[1].
+    _RENEW = """
+    if redis.call('get', KEYS[1]) ~= ARGV[1] then
+        return 0
+    end
+    if ARGV[2] == '0' then
+        return redis.call('del', KEYS[1])
+    end
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+    """
+
+    def __init__(self, lock_key, timeout=10, lease=30):
         self.lock_key = lock_key
         self.lock_value = str(uuid.uuid4())
         self.timeout = timeout
+        self.lease = lease
+        self.fence = None
+        self.lost = False
+        self._stopped = threading.Event()
 
     @staticmethod
     def clean_lock(lock_key):
@@ -294,18 +366,51 @@ class RedisDistributedLock:
 
     def acquire_lock(self):
         end_time = time.time() + self.timeout
-        while time.time() < end_time:
-            if REDIS_CONN.REDIS.setnx(self.lock_key, self.lock_value):
+        wait = 0.05
+        while True:
+            fence = REDIS_CONN.REDIS.eval(self._ACQUIRE, 2, self.lock_key, f"{self.lock_key}-fence",
+                                          self.lock_value, int(self.lease * 1000))
+            if fence:
+                self.fence, self.lost = int(fence), False
+                self._stopped = threading.Event()
+                threading.Thread(target=self._renew, args=(self._stopped,), daemon=True).start()
                 return True
-            time.sleep(1)
-        return False
+            if time.time() + wait > end_time:
+                return False
+            time.sleep(wait * random.uniform(0.5, 1.5))
+            wait = min(wait * 2, 1)
+
+    def _renew(self, stopped):
+        while not stopped.wait(self.lease / 3):
+            try:
+                if REDIS_CONN.REDIS.eval(self._RENEW, 1, self.lock_key, self.lock_value, int(self.lease * 1000)):
+                    continue
+                logging.error(f"RedisDistributedLock {self.lock_key} is lost to another holder.")
+                self.lost = True
+                return
+            except Exception as e:
+                logging.warning(f"RedisDistributedLock {self.lock_key} fails to renew its lease: {e}")
+
+    def check(self):
+        """Raise if the lock has been lost, its lease having expired before it was renewed."""
+        if self.fence is None or self.lost or REDIS_CONN.REDIS.get(self.lock_key) != self.lock_value:
+            self.lost = True
+            raise Exception(f"The lock {self.lock_key} is not held.")
 
     def release_lock(self):
-        if REDIS_CONN.REDIS.get(self.lock_key) == self.lock_value:
-            REDIS_CONN.REDIS.delete(self.lock_key)
+        self._stopped.set()
+        if self.fence is None:
+            return
+        self.fence = None
+        try:
+            REDIS_CONN.REDIS.eval(self._RENEW, 1, self.lock_key, self.lock_value, 0)
+        except Exception as e:
+            logging.warning(f"RedisDistributedLock {self.lock_key} fails to release: {e}")
 
     def __enter__(self):
-        self.acquire_lock()
+        if not self.acquire_lock():
+            raise Exception(f"Fail to acquire the lock {self.lock_key} in {self.timeout} seconds.")
+        return self
 
     def __exit__(self, exception_type, exception_value, exception_traceback):
-        self.release_lock()
\ No newline at end of file
+        self.release_lock()
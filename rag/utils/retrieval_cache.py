@@ -0,0 +1,172 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import copy
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import xxhash
+from cachetools import LRUCache
+
+from rag.utils.redis_conn import REDIS_CONN
+
+# Entries kept in process, 0 disables the retrieval cache.
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "0"))
+# Seconds a result is kept in Redis, 0 keeps the cache in process only.
+RETRIEVAL_CACHE_REDIS_TTL = int(os.environ.get("RETRIEVAL_CACHE_REDIS_TTL", "0"))
+# Seconds after a write its knowledge base generation is bumped again. Elasticsearch makes writes searchable at its
+# next refresh, every second by conf/mapping.json, so results retrieved in between must not outlive it.
+RETRIEVAL_CACHE_REFRESH_DELAY = float(os.environ.get("RETRIEVAL_CACHE_REFRESH_DELAY", "2"))
+
+# knowledge base id -> when its generation is bumped again
+_refresh_deadlines = {}
+_refresh_cond = threading.Condition()
+_refresh_thread = None
+
+
+def kb_generation_key(kb_id):
+    return f"kb_generation:{kb_id}"
+
+
+def _bump_after_refresh():
+    while True:
+        with _refresh_cond:
+            while not _refresh_deadlines:
+                _refresh_cond.wait()
+            now = time.time()
+            due = [kb_id for kb_id, t in _refresh_deadlines.items() if t <= now]
+            if not due:
+                _refresh_cond.wait(min(_refresh_deadlines.values()) - now)
+                continue
+            for kb_id in due:
+                del _refresh_deadlines[kb_id]
+        for kb_id in due:
+            REDIS_CONN.incr(kb_generation_key(kb_id))
+
+
+def bump_kb_generation(kb_ids):
+    """
+    Bump the generation of the knowledge bases now, and once more RETRIEVAL_CACHE_REFRESH_DELAY seconds later, for
+    the results retrieved before the doc store made the write searchable to be unreachable as well.
+    """
+    global _refresh_thread
+    kb_ids = set([kb_id for kb_id in kb_ids if kb_id])
+    for kb_id in kb_ids:
+        REDIS_CONN.incr(kb_generation_key(kb_id))
+    if not kb_ids or RETRIEVAL_CACHE_REFRESH_DELAY <= 0:
+        return
+    with _refresh_cond:
+        deadline = time.time() + RETRIEVAL_CACHE_REFRESH_DELAY
+        for kb_id in kb_ids:
+            _refresh_deadlines[kb_id] = deadline
+        if _refresh_thread is None:
+            _refresh_thread = threading.Thread(target=_bump_after_refresh, daemon=True)
+            _refresh_thread.start()
+        _refresh_cond.notify()
+
+
+def get_kb_generations(kb_ids):
+    """Current generation of every knowledge base, or None if they can not be read."""
+    if not REDIS_CONN.is_alive():
+        return None
+    gens = REDIS_CONN.mget([kb_generation_key(kb_id) for kb_id in kb_ids])
+    if gens is None:
+        return None
+    return [int(g) if g else 0 for g in gens]
+
+
+def bumps_kb_generation(func):
+    """
+    Decorate a doc store write, so that the generation of the knowledge bases it touched is bumped
+    once it is done. The knowledge base comes from the `knowledgebaseId` argument, or from the
+    `kb_id` of the written rows if that is not given.
+    """
+    sig = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            try:
+                bound = sig.bind(*args, **kwargs).arguments
+                kb_ids = [bound.get("knowledgebaseId")]
+                if not kb_ids[0]:
+                    kb_ids = []
+                    for d in bound.get("documents", []):
+                        kb_id = d.get("kb_id")
+                        kb_ids.extend(kb_id if isinstance(kb_id, list) else [kb_id])
+                bump_kb_generation(kb_ids)
+            except Exception:
+                logging.exception(f"Fail to bump the knowledge base generation after {func.__name__}")
+
+    return wrapper
+
+
+class RetrievalCache:
+    """
+    Ranked retrieval results, keyed on the normalized question and every retrieval parameter.
+    Keys embed the generation of the searched knowledge bases, so any write to a knowledge base
+    makes its cached results unreachable. Results live in a local LRU, optionally backed by Redis.
+    """
+
+    def __init__(self, size=RETRIEVAL_CACHE_SIZE, redis_ttl=RETRIEVAL_CACHE_REDIS_TTL):
+        self.size = size
+        self.redis_ttl = redis_ttl
+        self.lru = LRUCache(maxsize=max(size, 1))
+        self.lock = threading.Lock()
+
+    def enabled(self):
+        return self.size > 0
+
+    def key(self, question, kb_ids, **params):
+        if not self.enabled() or not kb_ids:
+            return None
+        kb_ids = sorted(set(kb_ids))
+        gens = get_kb_generations(kb_ids)
+        if gens is None:
+            return None
+        hasher = xxhash.xxh64()
+        hasher.update(re.sub(r"\s+", " ", question.strip().lower()).encode("utf-8"))
+        hasher.update(json.dumps(list(zip(kb_ids, gens))).encode("utf-8"))
+        hasher.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        return "retrieval:" + hasher.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            ranks = self.lru.get(key)
+        if ranks is None and self.redis_ttl > 0:
+            bin = REDIS_CONN.get(key)
+            if bin:
+                ranks = json.loads(bin)
+                with self.lock:
+                    self.lru[key] = ranks
+        return copy.deepcopy(ranks)
+
+    def set(self, key, ranks):
+        ranks = copy.deepcopy(ranks)
+        with self.lock:
+            self.lru[key] = ranks
+        if self.redis_ttl > 0:
+            REDIS_CONN.set(key, json.dumps(ranks, ensure_ascii=False, default=float), self.redis_ttl)
+
+
+RETRIEVAL_CACHE = RetrievalCache()
@@ -0,0 +1,85 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import numpy as np
+import pytest
+
+from api.db import LLMType
+from api.db.services import llm_service
+from api.db.services.llm_service import LLMBundle, TenantLLMService
+from rag.utils.embed_cache import EmbedCache
+
+
+class Embedding:
+    """An embedding model whose vector of a text is its length, counting the texts it embedded."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[len(t), 1.0] for t in texts]), 10 * len(texts)
+
+
+@pytest.fixture
+def bundle(fake_redis, monkeypatch):
+    monkeypatch.setattr(llm_service, "EMBED_CACHE", EmbedCache(size=16, ttl=60))
+    monkeypatch.setattr(TenantLLMService, "increase_usage", classmethod(lambda cls, *args: 1))
+    bdl = LLMBundle.__new__(LLMBundle)
+    bdl.tenant_id, bdl.llm_type, bdl.llm_name = "tenant", LLMType.EMBEDDING, "embd"
+    bdl.mdl = Embedding()
+    bdl.cache_namespace = "factory/embd"
+    return bdl
+
+
+def test_miss_then_hit(bundle):
+    vects, tokens = bundle.encode(["a", "bb"])
+    assert vects.tolist() == [[1, 1], [2, 1]] and tokens == 20
+    vects, tokens = bundle.encode(["a", "bb"])
+    assert vects.tolist() == [[1, 1], [2, 1]] and tokens == 0
+    assert bundle.mdl.encoded == ["a", "bb"]
+
+
+def test_mixed_hits_stay_aligned(bundle):
+    bundle.encode(["bb"])
+    vects, tokens = bundle.encode(["a", "bb", "cccc"])
+    assert vects.tolist() == [[1, 1], [2, 1], [4, 1]]
+    assert tokens == 20
+    assert bundle.mdl.encoded == ["bb", "a", "cccc"]
+
+
+def test_empty(bundle):
+    vects, tokens = bundle.encode([])
+    assert len(vects) == 0 and tokens == 0
+    assert bundle.mdl.encoded == []
+
+
+def test_partial_result_raises(bundle):
+    bundle.encode(["bb"])
+    bundle.mdl.encode = lambda texts: (np.array([[1.0, 1.0]]), 1)
+    with pytest.raises(Exception):
+        bundle.encode(["a", "bb", "cccc"])
+
+
+def test_endpoints_do_not_share_vectors(fake_redis, monkeypatch):
+    def bundle_of(api_base):
+        monkeypatch.setattr(TenantLLMService, "model_instance", classmethod(lambda cls, *args, **kwargs: Embedding()))
+        monkeypatch.setattr(TenantLLMService, "get_model_config", classmethod(
+            lambda cls, *args: {"llm_factory": "OpenAI-API-Compatible", "llm_name": "bge-m3", "api_base": api_base}))
+        return LLMBundle("tenant", LLMType.EMBEDDING, "bge-m3")
+
+    a, b = bundle_of("http://10.0.0.1:8080/v1"), bundle_of("http://10.0.0.2:8080/v1")
+    assert a.cache_namespace != b.cache_namespace
+    assert bundle_of("http://10.0.0.1:8080/v1").cache_namespace == a.cache_namespace
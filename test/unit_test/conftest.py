@@ -0,0 +1,146 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Unit tests of the server modules, run without the services of docker compose:
+
+    cd test/unit_test && pytest
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../")))
+
+
+class FakeRedis:
+    """The subset of the Redis client used through REDIS_CONN, kept in memory."""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.RLock()
+
+    def _expire(self):
+        now = time.time()
+        for k, t in list(self.expires.items()):
+            if t <= now:
+                self.data.pop(k, None)
+                self.expires.pop(k)
+
+    def get(self, k):
+        with self.lock:
+            self._expire()
+            return self.data.get(k)
+
+    def mget(self, keys):
+        with self.lock:
+            self._expire()
+            return [self.data.get(k) for k in keys]
+
+    def set(self, k, v, ex=None, nx=False):
+        with self.lock:
+            self._expire()
+            if nx and k in self.data:
+                return None
+            self.data[k] = v
+            self.expires.pop(k, None)
+            if ex:
+                self.expires[k] = time.time() + ex
+            return True
+
+    def exists(self, k):
+        with self.lock:
+            self._expire()
+            return int(k in self.data)
+
+    def delete(self, k):
+        with self.lock:
+            return int(self.data.pop(k, None) is not None)
+
+    def rpush(self, k, *values):
+        with self.lock:
+            self.data.setdefault(k, []).extend(values)
+            return len(self.data[k])
+
+    def lrange(self, k, start, end):
+        with self.lock:
+            return self.data.get(k, [])[start:None if end == -1 else end + 1]
+
+    def ltrim(self, k, start, end):
+        with self.lock:
+            self.data[k] = self.lrange(k, start, end)
+            return True
+
+    def incr(self, k):
+        with self.lock:
+            self.data[k] = str(int(self.data.get(k) or 0) + 1)
+            return int(self.data[k])
+
+    def pipeline(self, transaction=False):
+        client = self
+
+        class Pipeline:
+            def __init__(self):
+                self.ops = []
+
+            def set(self, *args, **kwargs):
+                self.ops.append((args, kwargs))
+                return self
+
+            def execute(self):
+                return [client.set(*args, **kwargs) for args, kwargs in self.ops]
+
+        return Pipeline()
+
+
+class FakeStorage:
+    """The object storage of STORAGE_IMPL, kept in memory."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def obj_exist(self, bucket, name):
+        return (bucket, name) in self.objects
+
+    def get(self, bucket, name):
+        return self.objects.get((bucket, name))
+
+    def put(self, bucket, name, binary):
+        self.objects[(bucket, name)] = binary
+
+    def rm(self, bucket, name):
+        self.objects.pop((bucket, name), None)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    from rag.utils.redis_conn import REDIS_CONN
+    client = FakeRedis()
+    monkeypatch.setattr(REDIS_CONN, "REDIS", client)
+    monkeypatch.setattr(REDIS_CONN, "REDIS_BYTES", client)
+    return client
+
+
+@pytest.fixture
+def fake_storage(monkeypatch):
+    """The graph store kept in memory."""
+    from graphrag.graph_store import GraphStore
+    storage = FakeStorage()
+    monkeypatch.setattr(GraphStore, "storage", property(lambda self: storage))
+    return storage
@@ -0,0 +1,93 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import pytest
+
+from deepdoc.parser import pdf_parser
+from deepdoc.parser.pdf_parser import RAGFlowPdfParser
+
+
+def char(text, x0, top, width=5, height=10, upright=True):
+    """A char as pdfplumber extracts it."""
+    return {"text": text, "x0": x0, "x1": x0 + width, "top": top, "bottom": top + height, "doctop": top,
+            "upright": upright, "width": width, "height": height, "fontname": "F", "size": height,
+            "matrix": (1, 0, 0, 1, x0, top)}
+
+
+def line(text, x0, top, width=5):
+    return [char(c, x0 + i * width, top, width) for i, c in enumerate(text) if c != " "] if text.strip() else []
+
+
+def words(*parts):
+    """Chars of words at (text, x0, top), the words of a text separated by a char width."""
+    chars = []
+    for text, x0, top in parts:
+        for w in text.split(" "):
+            chars.extend(line(w, x0, top))
+            x0 += (len(w) + 1) * 5
+    return chars
+
+
+@pytest.fixture
+def parser():
+    parser = RAGFlowPdfParser.__new__(RAGFlowPdfParser)
+    parser.page_chars = []
+    parser.page_image_regions = []
+    return parser
+
+
+def test_words_of_a_line_make_one_box(parser):
+    bxs = parser._text_layer_boxes(1, words(("hello big world", 10, 10)))
+    assert [b["text"] for b in bxs] == ["hello big world"]
+    assert bxs[0]["x0"] == 10 and bxs[0]["x1"] == 10 + 15 * 5
+    assert bxs[0]["top"] == 10 and bxs[0]["bottom"] == 20
+    assert bxs[0]["page_number"] == 1
+
+
+def test_lines_and_columns_make_separate_boxes(parser):
+    chars = words(("left column", 10, 10), ("right column", 200, 10), ("second line", 10, 30))
+    bxs = parser._text_layer_boxes(2, chars)
+    assert sorted([(b["top"], b["text"]) for b in bxs]) == [(10, "left column"), (10, "right column"),
+                                                            (30, "second line")]
+
+
+def test_chinese_chars_are_not_spaced(parser):
+    chars = line("文本", 10, 10, 10) + line("解析", 35, 10, 10)
+    assert [b["text"] for b in parser._text_layer_boxes(1, chars)] == ["文本解析"]
+
+
+def test_text_layer_is_off_by_default(parser, monkeypatch):
+    parser.page_chars = [words(("clean text layer " * 4, 10, 10))]
+    parser.page_image_regions = [[]]
+    assert not pdf_parser.PDF_TEXT_LAYER
+    assert not parser._text_layer_usable(1, 3)
+
+
+def test_garbled_or_short_text_layers_are_not_used(parser, monkeypatch):
+    class Images:
+        def size(self, i):
+            return 600 * 3, 800 * 3
+
+    monkeypatch.setattr(pdf_parser, "PDF_TEXT_LAYER", 1)
+    parser.page_images = Images()
+    clean = words(("clean text layer " * 4, 10, 10))
+    parser.page_chars = [clean, clean[:10], clean + [char("(cid:12)", 10, 50)] * 5,
+                         [dict(c, upright=False) for c in clean]]
+    parser.page_image_regions = [[]] * 4
+    assert [parser._text_layer_usable(i + 1, 3) for i in range(4)] == [True, False, False, False]
+
+    # pages mostly covered by images are scans
+    parser.page_image_regions = [[(0, 0, 600, 500)], [], [], []]
+    assert not parser._text_layer_usable(1, 3)
@@ -0,0 +1,78 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import networkx as nx
+
+# graphrag.utils is imported through api.settings
+from api import settings  # noqa: F401
+from graphrag import entity_resolution
+from graphrag.entity_resolution import EntityResolution
+from graphrag.general.extractor import GRAPH_FIELD_SEP
+
+
+class Store:
+    """The entities and relations of the doc store, read and written in bulk."""
+
+    def __init__(self):
+        self.entities = {
+            "A1": {"entity_type": "ORG", "description": "A1", "source_id": ["d1"]},
+            "A2": {"entity_type": "ORG", "description": "A2", "source_id": ["d2"]},
+            "N": {"entity_type": "PERSON", "description": "N", "source_id": ["d1"]},
+        }
+        self.relations = {
+            ("A1", "N"): {"weight": 1, "description": "A1-N rel", "keywords": [], "source_id": ["d1"]},
+            ("A2", "N"): {"weight": 5, "description": "A-N rel", "keywords": [], "source_id": ["d2"]},
+        }
+
+    def get_entities(self, names):
+        return {n: self.entities[n] for n in names if n in self.entities}
+
+    def get_relations(self, pairs):
+        return {p: self.relations.get(p) or self.relations.get(p[::-1]) for p in pairs
+                if p in self.relations or p[::-1] in self.relations}
+
+    def set_entities(self, ent2meta):
+        self.entities.update(ent2meta)
+
+    def set_relations(self, pair2meta):
+        for (src, tgt), meta in pair2meta.items():
+            self.relations.pop((tgt, src), None)
+            self.relations[(src, tgt)] = meta
+
+
+def test_relations_of_removed_entities_merge_into_the_kept_ones(monkeypatch):
+    store = Store()
+    graph = nx.Graph()
+    graph.add_nodes_from([(n, {"entity_type": e["entity_type"]}) for n, e in store.entities.items()])
+    graph.add_edge("A1", "N", weight=1)
+    graph.add_edge("A2", "N", weight=5)
+
+    monkeypatch.setattr(entity_resolution, "block_candidates", lambda nodes, *args: [tuple(nodes)] if len(nodes) == 2 else [])
+    er = EntityResolution(None, get_entity=lambda n: store.entities.get(n),
+                          get_relation=lambda s, t: store.relations.get((s, t)) or store.relations.get((t, s)),
+                          set_entities=store.set_entities, set_relations=store.set_relations,
+                          get_entities=store.get_entities, get_relations=store.get_relations)
+    monkeypatch.setattr(er, "_resolve_candidates", lambda entity_type, candidates, prompt_variables: candidates)
+    monkeypatch.setattr(er, "_handle_entity_relation_summary", lambda name, description: description)
+
+    res = er(graph)
+    [removed] = res.removed_entities
+    kept = ({"A1", "A2"} - {removed}).pop()
+    assert list(res.graph.edges) in [[(kept, "N")], [("N", kept)]]
+
+    assert store.entities["N"]["entity_type"] == "PERSON"
+    rel = store.relations.get((kept, "N")) or store.relations.get(("N", kept))
+    assert rel["weight"] == 6
+    assert rel["description"].split(GRAPH_FIELD_SEP) == ["A-N rel", "A1-N rel"]
@@ -0,0 +1,75 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import json
+
+import networkx as nx
+import pytest
+from networkx.readwrite import json_graph
+
+# graphrag.utils is imported through api.settings
+from api import settings  # noqa: F401
+from graphrag import utils
+from graphrag.graph_store import GraphStore
+
+
+class Lock:
+    fence = 1
+
+    def check(self):
+        pass
+
+
+@pytest.fixture
+def store(fake_redis, fake_storage, monkeypatch):
+    store = GraphStore(cache_size=0)
+    monkeypatch.setattr(utils, "GRAPH_STORE", store)
+    monkeypatch.setattr(utils, "get_graph", lambda tenant_id, kb_id: store.load(kb_id))
+    monkeypatch.setattr(utils, "update_nodes_pagerank_nhop_neighbour", lambda *args: None)
+    return store
+
+
+def enqueue(fake_redis, item_id, entity):
+    graph = nx.Graph()
+    graph.add_node(entity, entity_type="T", description=entity, source_id=[item_id])
+    fake_redis.rpush("kb-graph-merge", json.dumps({
+        "id": item_id, "docids": [item_id], "graph": json_graph.node_link_data(graph, edges="edges")}))
+
+
+def test_graphs_stored_before_a_crash_are_not_merged_again(fake_redis, store, monkeypatch):
+    enqueue(fake_redis, "a", "A")
+    enqueue(fake_redis, "b", "B")
+
+    def crash(tenant_id, kb_id, graph, docids, base=None, fence=None, merged=None):
+        store.save(kb_id, graph, docids, base, fence, merged)
+        raise Exception("stopped before marking the graphs merged")
+
+    monkeypatch.setattr(utils, "set_graph", crash)
+    with pytest.raises(Exception):
+        utils._merge_queued_graphs("tenant", "kb", Lock())
+    assert fake_redis.get("graph-merged-a") is None
+    assert len(fake_redis.lrange("kb-graph-merge", 0, -1)) == 2
+
+    saved = []
+    monkeypatch.setattr(utils, "set_graph", lambda *args, **kwargs: saved.append(kwargs["merged"]))
+    utils._merge_queued_graphs("tenant", "kb", Lock())
+    assert saved == []
+    assert fake_redis.get("graph-merged-a") and fake_redis.get("graph-merged-b")
+    assert fake_redis.lrange("kb-graph-merge", 0, -1) == []
+    assert sorted(store.load("kb")[0].nodes) == ["A", "B"]
+
+    enqueue(fake_redis, "c", "C")
+    utils._merge_queued_graphs("tenant", "kb", Lock())
+    assert saved == [["c"]]
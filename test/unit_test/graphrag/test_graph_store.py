@@ -0,0 +1,86 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import networkx as nx
+import pytest
+
+from graphrag import graph_store
+from graphrag.graph_store import GraphStore, GraphVersionConflict
+
+
+@pytest.fixture
+def store(fake_storage, monkeypatch):
+    monkeypatch.setattr(graph_store, "GRAPH_MAX_DELTAS", 1)
+    return GraphStore(cache_size=0)
+
+
+def write(store, graph, fence=None):
+    graph.add_node(f"n{graph.number_of_nodes()}", description=f"entity {graph.number_of_nodes()}")
+    store.save("kb", graph, ["doc"], fence=fence)
+
+
+def load_at(store, manifest):
+    """Load the graph as a reader that read `manifest` before it was replaced."""
+    reader = GraphStore(cache_size=0)
+    reader._manifest = lambda kb_id: manifest
+    return reader.load("kb")[0]
+
+
+def test_replaced_versions_are_kept_until_the_next_snapshot(store):
+    graph = nx.Graph()
+    graph.add_nodes_from([(f"e{i}", {"description": f"entity {i}"}) for i in range(100)])
+    write(store, graph)
+    write(store, store.load("kb")[0])
+    v2 = store._manifest("kb")
+    assert v2["snapshot"][0] == 1 and len(v2["deltas"]) == 1
+
+    # a snapshot replaces version 2, its snapshot and delta are kept
+    write(store, store.load("kb")[0])
+    assert store._manifest("kb")["snapshot"][0] == 3
+    assert load_at(store, v2).number_of_nodes() == 102
+
+    # and dropped by the next snapshot
+    write(store, store.load("kb")[0])
+    write(store, store.load("kb")[0])
+    assert store._manifest("kb")["snapshot"][0] == 5
+    with pytest.raises(GraphVersionConflict):
+        load_at(store, v2)
+    assert store.load("kb")[0].number_of_nodes() == 105
+    assert sorted(name for _, name in store.storage.objects) == [
+        "graphrag/graph/00000003.snapshot", "graphrag/graph/00000004.delta", "graphrag/graph/00000005.snapshot",
+        "graphrag/graph/manifest.json"]
+
+
+def test_stale_fence_or_version_conflicts(store):
+    write(store, nx.Graph(), fence=2)
+    with pytest.raises(GraphVersionConflict):
+        write(store, store.load("kb")[0], fence=1)
+
+    loaded = store.load("kb")[0]
+    write(store, store.load("kb")[0], fence=2)
+    with pytest.raises(GraphVersionConflict):
+        write(store, loaded, fence=2)
+
+
+def test_merged_ids_are_kept_until_the_next_merge(store):
+    graph = nx.Graph()
+    graph.add_nodes_from([(f"e{i}", {"description": f"entity {i}"}) for i in range(100)])
+    store.save("kb", graph, ["doc"], merged=["a", "b"])
+    # entity resolution, written as a delta and as a snapshot
+    write(store, store.load("kb")[0])
+    write(store, store.load("kb")[0])
+    assert store.merged("kb") == ["a", "b"]
+    store.save("kb", store.load("kb")[0], ["doc"], merged=["c"])
+    assert store.merged("kb") == ["c"]
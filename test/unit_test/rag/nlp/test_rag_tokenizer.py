@@ -0,0 +1,47 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import random
+import string
+
+import datrie
+import pytest
+
+from rag.nlp.rag_tokenizer import RagTokenizer
+
+
+def tokenizer(tmp_path, words, freqs):
+    """A tokenizer of a dictionary of `words`, with frequencies drawn from `freqs`."""
+    fnm = tmp_path / "dict.txt"
+    fnm.write_text("".join(f"{w} {random.choice(freqs)} n\n" for w in sorted(words)), encoding="utf-8")
+    tkr = RagTokenizer.__new__(RagTokenizer)
+    tkr.DENOMINATOR = 1000000
+    tkr.trie_ = datrie.Trie(string.printable)
+    tkr.loadDict_(str(fnm))
+    return tkr
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_top_segments_rank_like_dfs(tmp_path, seed):
+    random.seed(seed)
+    chars = "abcdef"[:2 + seed % 5]
+    words = set("".join(random.choice(chars) for _ in range(random.randint(1, 4))) for _ in range(100))
+    # few distinct frequencies make ties, which keep the order dfs_ enumerates them in
+    tkr = tokenizer(tmp_path, words, [1, 10, 100] if seed % 2 else range(1, 100000))
+    for _ in range(200):
+        tk = "".join(random.choice(chars) for _ in range(random.randint(3, 10)))
+        tkslist = []
+        tkr.dfs_(tk, 0, [], tkslist)
+        assert tkr.top_segments_(tk) == tkr.sortTks_(tkslist)[:2]
@@ -0,0 +1,39 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import pytest
+
+from rag.nlp.term_weight import Dealer
+
+
+@pytest.fixture(scope="module")
+def dealer():
+    return Dealer()
+
+
+def test_batch_weights_match_weights(dealer):
+    res = dealer.weights_batch([["the", "retrieval", "augmented", "the"], "generation of the answer", []])
+    assert res == [dealer.weights(["the", "retrieval", "augmented", "the"], preprocess=False),
+                   dealer.weights(["generation", "of", "the", "answer"], preprocess=False), []]
+
+
+def test_token_weights_are_cached(dealer):
+    dealer.weight_cache.clear()
+    dealer.weight_cache_hits = dealer.weight_cache_misses = 0
+    dealer.weights_batch([["the", "rag"]] * 128)
+    dealer.weights(["the", "rag", "the"], preprocess=False)
+    info = dealer.cache_info()
+    assert info["size"] == 2 and info["misses"] == 2 and info["hits"] == 3
+    assert info["hit_rate"] == pytest.approx(3 / 5)
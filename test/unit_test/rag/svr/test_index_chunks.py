@@ -0,0 +1,126 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import inspect
+
+import pytest
+from peewee import SqliteDatabase
+
+from api import settings
+from api.db.db_models import Task
+from api.db.services.task_service import TaskService
+from rag.svr import task_executor
+from rag.svr.task_executor import estimate_chunk_bytes, index_chunks
+
+TASK = {"id": "task", "tenant_id": "tenant", "kb_id": "kb"}
+
+
+class DocStore:
+    """A doc store taking `latency` seconds of the fake clock per insert."""
+
+    def __init__(self, clock, latency):
+        self.clock, self.latency = clock, latency
+        self.bulks, self.deleted = [], []
+
+    def insert(self, bulk, index_name, kb_id):
+        self.clock[0] += self.latency
+        self.bulks.append(list(bulk))
+        return []
+
+    def delete(self, condition, index_name, kb_id):
+        self.deleted.append(condition)
+
+
+@pytest.fixture
+def task_chunk_ids(monkeypatch):
+    """The chunk ids appended to the task, `None` once it is cancelled."""
+    chunk_ids = []
+
+    def append_chunk_ids(cls, id, ids):
+        if chunk_ids[-1:] == [None]:
+            return 0
+        chunk_ids.extend(ids.split(" "))
+        return 1
+
+    monkeypatch.setattr(TaskService, "update_chunk_ids", classmethod(lambda cls, id, ids: None))
+    monkeypatch.setattr(TaskService, "append_chunk_ids", classmethod(append_chunk_ids))
+    return chunk_ids
+
+
+def doc_store(monkeypatch, latency):
+    clock = [0.0]
+    store = DocStore(clock, latency)
+    monkeypatch.setattr(task_executor, "timer", lambda: clock[0])
+    monkeypatch.setattr(settings, "docStoreConn", store)
+    return store
+
+
+def chunks(n, size=10):
+    return [{"id": f"c{i}", "content_with_weight": "x" * size} for i in range(n)]
+
+
+def index(batches):
+    return index_chunks(TASK, batches, sum(len(b) for b in batches), lambda *args, **kwargs: None)
+
+
+def test_bulks_grow_while_the_doc_store_is_fast(monkeypatch, task_chunk_ids):
+    monkeypatch.setattr(task_executor, "DOC_BULK_SIZE", 64)
+    store = doc_store(monkeypatch, task_executor.DOC_BULK_TARGET_SECONDS / 2)
+    assert len(index([chunks(100), chunks(100)[:50]])) == 150
+    assert [len(b) for b in store.bulks] == [16, 32, 64, 38]
+    assert len(task_chunk_ids) == 150
+
+
+def test_bulks_shrink_while_the_doc_store_is_slow(monkeypatch, task_chunk_ids):
+    store = doc_store(monkeypatch, task_executor.DOC_BULK_TARGET_SECONDS * 3)
+    index([chunks(40)])
+    assert [len(b) for b in store.bulks] == [16, 8, 4, 2] + [1] * 10
+
+
+def test_bulks_are_split_at_the_byte_cap(monkeypatch, task_chunk_ids):
+    size = estimate_chunk_bytes(chunks(1, 1000)[0])
+    monkeypatch.setattr(task_executor, "DOC_BULK_MAX_BYTES", 5 * size)
+    store = doc_store(monkeypatch, task_executor.DOC_BULK_TARGET_SECONDS / 2)
+    index([chunks(12, 1000)])
+    assert [len(b) for b in store.bulks] == [5, 5, 2]
+
+
+def test_chunks_of_a_cancelled_task_are_deleted(monkeypatch, task_chunk_ids):
+    store = doc_store(monkeypatch, task_executor.DOC_BULK_TARGET_SECONDS * 3)
+    batches = iter([chunks(16), chunks(40)[16:]])
+
+    def cancelled():
+        yield next(batches)
+        # the task is removed, e.g. its document was deleted, while indexing
+        task_chunk_ids.append(None)
+        yield next(batches)
+
+    assert index_chunks(TASK, cancelled(), 40, lambda *args, **kwargs: None) is None
+    assert [len(b) for b in store.bulks] == [16, 8]
+    assert store.deleted == [{"id": [f"c{i}" for i in range(24)]}]
+
+
+def test_chunk_ids_are_appended_to_the_task():
+    db = SqliteDatabase(":memory:")
+    db.register_function(lambda *args: "".join(args), "CONCAT")
+    # the query itself, without the connection of the service database
+    append_chunk_ids = inspect.unwrap(TaskService.append_chunk_ids.__func__)
+    with Task.bind_ctx(db):
+        db.create_tables([Task])
+        Task.create(id="task", doc_id="doc", chunk_ids="")
+        assert append_chunk_ids(TaskService, "task", "c0 c1") == 1
+        assert append_chunk_ids(TaskService, "task", "c2") == 1
+        assert Task.get_by_id("task").chunk_ids.split() == ["c0", "c1", "c2"]
+        assert append_chunk_ids(TaskService, "removed", "c3") == 0
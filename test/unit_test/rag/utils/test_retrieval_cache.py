@@ -0,0 +1,69 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import time
+
+from rag.utils import retrieval_cache
+from rag.utils.retrieval_cache import RetrievalCache, bump_kb_generation, bumps_kb_generation
+
+RANKS = {"total": 1, "chunks": [{"chunk_id": "c1", "similarity": 0.5}], "doc_aggs": []}
+
+
+def test_hit_until_the_knowledge_base_is_written(fake_redis, monkeypatch):
+    monkeypatch.setattr(retrieval_cache, "RETRIEVAL_CACHE_REFRESH_DELAY", 0)
+    cache = RetrievalCache(size=8)
+    key = cache.key("What is  RAG?", ["kb1"], page=1)
+    cache.set(key, RANKS)
+    assert cache.key("what is rag?", ["kb1"], page=1) == key
+    assert cache.get(key) == RANKS
+
+    bump_kb_generation(["kb1"])
+    new_key = cache.key("what is rag?", ["kb1"], page=1)
+    assert new_key != key
+    assert cache.get(new_key) is None
+
+
+def test_write_of_another_knowledge_base_keeps_entries(fake_redis, monkeypatch):
+    monkeypatch.setattr(retrieval_cache, "RETRIEVAL_CACHE_REFRESH_DELAY", 0)
+    cache = RetrievalCache(size=8)
+    key = cache.key("q", ["kb1"])
+    bump_kb_generation(["kb2"])
+    assert cache.key("q", ["kb1"]) == key
+
+
+def test_results_retrieved_before_the_refresh_are_dropped(fake_redis, monkeypatch):
+    monkeypatch.setattr(retrieval_cache, "RETRIEVAL_CACHE_REFRESH_DELAY", 0.1)
+
+    @bumps_kb_generation
+    def insert(documents, indexName, knowledgebaseId=None):
+        return []
+
+    cache = RetrievalCache(size=8)
+    insert([{"kb_id": "kb1"}], "idx")
+    # retrieved while the write is not searchable yet
+    stale = cache.key("q", ["kb1"])
+    cache.set(stale, RANKS)
+    assert cache.get(cache.key("q", ["kb1"])) == RANKS
+
+    time.sleep(0.5)
+    assert cache.key("q", ["kb1"]) != stale
+    assert cache.get(cache.key("q", ["kb1"])) is None
+
+
+def test_disabled_without_redis(monkeypatch):
+    from rag.utils.redis_conn import REDIS_CONN
+    monkeypatch.setattr(REDIS_CONN, "REDIS", None)
+    assert RetrievalCache(size=8).key("q", ["kb1"]) is None
+    assert RetrievalCache(size=0).key("q", ["kb1"]) is None